@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Онлайн-бэкап SQLite без остановки бота.
+
+Копия снимается через sqlite3.Connection.backup небольшими порциями страниц
+(между порциями блокировка отпускается, запись студентов продолжается), затем
+проверяется PRAGMA integrity_check, сжимается gzip и кладётся в BACKUP_DIR;
+хранятся последние BACKUP_KEEP снимков. Вызывать из пула потоков.
+
+Если база часто меняется, пошаговое копирование начинается заново после каждой
+чужой записи; после BACKUP_MAX_RESTARTS перезапусков копия снимается одним
+проходом — в режиме WAL (init_db) он не блокирует пишущих.
+"""
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+from bot.database import DB_PATH, get_connection
+from bot.metrics import inc, timed
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.environ.get("VKR_BACKUP_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "backups")
+BACKUP_KEEP = int(os.environ.get("VKR_BACKUP_KEEP", "7"))
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+BACKUP_MAX_RESTARTS = 3
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy(dst: sqlite3.Connection):
+    """Пошаговая копия текущей базы в dst; при частых перезапусках — одним проходом."""
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        last = state["remaining"]
+        if last is not None and remaining > last:
+            state["restarts"] += 1
+            if state["restarts"] > BACKUP_MAX_RESTARTS:
+                raise _Restarted
+        state["remaining"] = remaining
+
+    src = get_connection()
+    try:
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, progress=progress, sleep=BACKUP_SLEEP)
+        except _Restarted:
+            inc("backup.single_pass")
+            src.backup(dst, pages=-1)
+    finally:
+        src.close()
+
+
+def _rotate(prefix: str):
+    snapshots = sorted(glob.glob(os.path.join(BACKUP_DIR, f"{prefix}-*.db.gz")))
+    for old in snapshots[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+        os.remove(old)
+
+
+@timed("job.backup")
+def backup_db() -> str:
+    """Снимок базы: копия, integrity_check, gzip, ротация. Возвращает путь к .db.gz; RuntimeError — копия битая."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    prefix = os.path.splitext(os.path.basename(DB_PATH))[0]
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    raw = os.path.join(BACKUP_DIR, f".{prefix}-{stamp}.db.tmp")
+    target = os.path.join(BACKUP_DIR, f"{prefix}-{stamp}.db.gz")
+    try:
+        dst = sqlite3.connect(raw)
+        try:
+            _copy(dst)
+            result = dst.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            dst.close()
+        if result != "ok":
+            inc("backup.failed")
+            raise RuntimeError(f"integrity_check копии: {result}")
+        with open(raw, "rb") as f_in, gzip.open(target + ".tmp", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        os.replace(target + ".tmp", target)
+    finally:
+        for path in (raw, target + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+    _rotate(prefix)
+    inc("backup.ok")
+    return target
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Рассылка админа всем студентам (/broadcast).
+
+Получатели фиксируются в broadcast_recipients при создании рассылки; отправители
+(BROADCAST_WORKERS задач) по одному берут следующего получателя из базы
+(pending → sending) и сразу записывают итог: sent, blocked (бот заблокирован /
+аккаунт удалён) или failed. После перезапуска рассылка досылается с того же
+места; получатели, взятые в отправку до перезапуска, помечаются failed — повторная
+отправка могла бы продублировать сообщение.
+
+Общий темп — не больше BROADCAST_RPS сообщений в секунду (лимит Telegram ~30/с на
+бота): один ограничитель на процесс для всех вызовов deliver — параллельные рассылки
+и напоминания бездействующим делят его. Каждому чату уходит одно сообщение, так что
+лимит на чат не достигается. RetryAfter приостанавливает всех отправителей на
+указанное Telegram время.
+
+Повтор — только если запрос заведомо не ушёл (соединение не установлено, нет
+свободного соединения в пуле). Любая другая сетевая ошибка — failed: обрыв после
+записи запроса мог уже доставить сообщение.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from bot.metrics import inc, timer
+from bot.storage import adb
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RPS = float(os.environ.get("VKR_BROADCAST_RPS", "25"))
+BROADCAST_WORKERS = int(os.environ.get("VKR_BROADCAST_WORKERS", "8"))
+# Повторы при сетевых ошибках, когда запрос заведомо не ушёл в Telegram (см. _not_sent)
+BROADCAST_RETRIES = 3
+
+# Рассылки, которые досылаются этим процессом (id → задача)
+_running: dict[int, asyncio.Task] = {}
+
+
+class RateLimiter:
+    """Равномерные слоты не чаще rate в секунду на все задачи цикла событий; pause() — общая пауза."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+# Общий темп исходящих сообщений deliver — на все рассылки и напоминания процесса
+_limiter = RateLimiter(BROADCAST_RPS)
+
+
+def _not_sent(error: NetworkError) -> bool:
+    """Запрос не ушёл в Telegram: ошибка соединения или ожидания пула (httpx — причина ошибки PTB)."""
+    return isinstance(error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+async def deliver(bot, user_id: int, text: str) -> tuple[str, str | None]:
+    """Отправка одному получателю (рассылки, напоминания) в общем темпе: (статус, ошибка)."""
+    attempt = 0
+    while True:
+        await _limiter.wait()
+        try:
+            with timer("broadcast.send"):
+                await bot.send_message(chat_id=user_id, text=text)
+            return "sent", None
+        except RetryAfter as e:
+            inc("broadcast.retry_after")
+            _limiter.pause(float(e.retry_after))
+        except Forbidden as e:
+            return "blocked", e.message
+        except BadRequest as e:
+            return "failed", e.message
+        except NetworkError as e:
+            # Таймаут чтения, обрыв, 5xx: запрос мог дойти — не повторяем, чтобы не продублировать
+            if not _not_sent(e) or attempt >= BROADCAST_RETRIES:
+                return "failed", e.message or type(e).__name__
+            attempt += 1
+            inc("broadcast.retry")
+            await asyncio.sleep(attempt)
+        except TelegramError as e:
+            return "failed", e.message
+
+
+async def run_broadcast(bot, broadcast_id: int, text: str) -> dict[str, int]:
+    """Досылает рассылку всем получателям в статусе pending; возвращает счётчики по статусам."""
+    async def worker():
+        while (user_id := await adb.claim_broadcast_recipient(broadcast_id)) is not None:
+            try:
+                status, error = await deliver(bot, user_id, text)
+            except Exception as e:
+                logger.exception("Рассылка %s: ошибка отправки %s", broadcast_id, user_id)
+                status, error = "failed", str(e)[:200]
+            await adb.set_broadcast_status(broadcast_id, user_id, status, error)
+            inc(f"broadcast.{status}")
+
+    with timer("broadcast.run"):
+        await asyncio.gather(*(worker() for _ in range(max(1, BROADCAST_WORKERS))))
+    await adb.finish_broadcast(broadcast_id)
+    return await adb.get_broadcast_counts(broadcast_id)
+
+
+def start_broadcast(application, broadcast_id: int, text: str, on_done=None, resume: bool = False) -> bool:
+    """
+    Запускает досылку в фоне (application.create_task). resume — после перезапуска:
+    сначала зависшие в отправке получатели помечаются failed. False — уже идёт.
+    on_done(broadcast_id, counts) — корутина, вызывается по завершении.
+    """
+    if broadcast_id in _running:
+        return False
+
+    async def run():
+        try:
+            if resume:
+                abandoned = await adb.abandon_broadcast_sends(broadcast_id)
+                if abandoned:
+                    logger.warning(
+                        "Рассылка %s: %s получателей в неизвестном состоянии после перезапуска", broadcast_id, abandoned
+                    )
+            counts = await run_broadcast(application.bot, broadcast_id, text)
+            logger.info("Рассылка %s завершена: %s", broadcast_id, counts)
+            if on_done is not None:
+                await on_done(broadcast_id, counts)
+        finally:
+            _running.pop(broadcast_id, None)
+
+    _running[broadcast_id] = application.create_task(run())
+    return True
+
+
+def counts_summary(counts: dict[str, int]) -> str:
+    text = f"доставлено {counts.get('sent', 0)}, заблокировали бота {counts.get('blocked', 0)}, ошибок {counts.get('failed', 0)}"
+    left = counts.get("pending", 0) + counts.get("sending", 0)
+    if left:
+        text += f", в очереди {left}"
+    return text
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Офлайн-бандл брифов: список тем, контент каждой темы и отпечатки её блоков
+в одном zip-файле (deflate, компактный JSON): index.json — метаданные и список тем,
+pages/<page_id>.json — контент и отпечатки одной темы. Версия формата — в комментарии
+архива, он читается вместе с оглавлением. Бриф, вытесненный из кэша, читается
+из бандла одним элементом, без распаковки остальных тем. По отпечаткам первый
+/refresh после старта из бандла перепарсивает только изменившиеся шаги.
+
+Бандл собирается scripts/sync_notion_bundle.py; бот может стартовать из него
+без NOTION_TOKEN (VKR_BRIEFS_BUNDLE=путь) — детерминированный деплой и фикстура
+для офлайн-бенчмарков.
+"""
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from bot.models import EMPTY_CONTENT, Brief, BriefBlocks, BriefContent, ChecklistItem, Section, Step, intern_text
+from bot.notion_client import NotionError, fetch_brief_blocks, fetch_briefs, parse_brief_blocks
+
+BUNDLE_FORMAT = "vkr-briefs"
+# 2 — отпечатки блоков (blocks); 3 — zip, тема — отдельный элемент
+BUNDLE_VERSION = 3
+_INDEX = "index.json"
+
+
+def _brief_to_dict(b: Brief) -> dict:
+    d = {"title": b.title, "type": b.type, "block_id": b.block_id, "level": b.level}
+    if b.page_id:
+        d["page_id"] = b.page_id
+    if b.description:
+        d["description"] = b.description
+    return d
+
+
+def _brief_from_dict(d: dict) -> Brief:
+    page_id = d.get("page_id")
+    return Brief(
+        title=intern_text(d["title"]),
+        type=intern_text(d["type"]),
+        block_id=intern_text(d["block_id"]),
+        level=d.get("level", 1),
+        page_id=intern_text(page_id) if page_id else None,
+        description=d.get("description", ""),
+    )
+
+
+def _section_to_dict(s: Section | None) -> dict | None:
+    return {"title": s.title, "preview": s.preview} if s else None
+
+
+def _content_to_dict(c: BriefContent) -> dict:
+    return {
+        "steps": [[s.title, s.content_preview] for s in c.steps],
+        "checklist": [[i.text, i.checked] for i in c.checklist],
+        "environment": _section_to_dict(c.environment),
+        "product": _section_to_dict(c.product),
+    }
+
+
+def _content_from_dict(d: dict) -> BriefContent:
+    steps = tuple(
+        Step(index=i, title=intern_text(title), content_preview=preview)
+        for i, (title, preview) in enumerate(d.get("steps") or [], 1)
+    )
+    # превью разделов — те же строки, что у шагов (без копий в памяти)
+    previews = {s.title: s.content_preview for s in steps}
+
+    def section(raw: dict | None) -> Section | None:
+        if not raw:
+            return None
+        title = intern_text(raw["title"])
+        preview = raw.get("preview", "")
+        return Section(title=title, preview=previews.get(title, preview) if preview else "")
+
+    return BriefContent(
+        steps=steps,
+        checklist=tuple(ChecklistItem(text=intern_text(t), checked=bool(c)) for t, c in d.get("checklist") or []),
+        environment=section(d.get("environment")),
+        product=section(d.get("product")),
+    )
+
+
+def _blocks_to_dict(b: BriefBlocks) -> dict:
+    return {"steps": list(b.steps), "checklist": list(b.checklist)}
+
+
+def _blocks_from_dict(d: dict) -> BriefBlocks:
+    return BriefBlocks(steps=tuple(d.get("steps") or ()), checklist=tuple(d.get("checklist") or ()))
+
+
+def _page_member(page_id: str) -> str:
+    return f"pages/{page_id}.json"
+
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def save_bundle(
+    path: str,
+    briefs: list[Brief],
+    contents: dict[str, BriefContent],
+    blocks: dict[str, BriefBlocks] | None = None,
+    source_page_id: str = "",
+) -> int:
+    """Пишет бандл атомарно (через временный файл). Возвращает размер файла в байтах."""
+    blocks = blocks or {}
+    index = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "source_page_id": source_page_id,
+        "briefs": [_brief_to_dict(b) for b in briefs],
+        "pages": list(contents),
+    }
+    tmp = f"{path}.tmp"
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+        zf.comment = f"{BUNDLE_FORMAT}/{BUNDLE_VERSION}".encode("ascii")
+        zf.writestr(_INDEX, _dumps(index))
+        for pid, content in contents.items():
+            page = {"content": _content_to_dict(content)}
+            if pid in blocks:
+                page["blocks"] = _blocks_to_dict(blocks[pid])
+            zf.writestr(_page_member(pid), _dumps(page))
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def _open(path: str) -> zipfile.ZipFile:
+    """Открывает бандл и проверяет формат и версию (по комментарию архива). ValueError — чужой файл."""
+    try:
+        zf = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ValueError(f"{path}: не бандл брифов (ожидается zip, версия {BUNDLE_VERSION})") from None
+    fmt, _, version = zf.comment.decode("ascii", "replace").partition("/")
+    if fmt != BUNDLE_FORMAT:
+        zf.close()
+        raise ValueError(f"{path}: не бандл брифов")
+    if version != str(BUNDLE_VERSION):
+        zf.close()
+        raise ValueError(f"{path}: версия бандла {version}, ожидается {BUNDLE_VERSION}")
+    return zf
+
+
+def _read_page(zf: zipfile.ZipFile, page_id: str) -> tuple[BriefContent, BriefBlocks | None] | None:
+    try:
+        page = json.loads(zf.read(_page_member(page_id)))
+    except KeyError:
+        return None
+    raw_blocks = page.get("blocks")
+    return _content_from_dict(page["content"]), _blocks_from_dict(raw_blocks) if raw_blocks else None
+
+
+def load_bundle(path: str) -> tuple[list[Brief], dict[str, BriefContent], dict[str, BriefBlocks], dict]:
+    """
+    Читает бандл: (briefs, contents по page_id, отпечатки блоков по page_id, метаданные).
+    ValueError — чужой формат или версия.
+    """
+    with _open(path) as zf:
+        index = json.loads(zf.read(_INDEX))
+        briefs = [_brief_from_dict(d) for d in index.get("briefs") or []]
+        contents, blocks = {}, {}
+        for pid in index.get("pages") or []:
+            pid = intern_text(pid)
+            page = _read_page(zf, pid)
+            if page is None:
+                raise ValueError(f"{path}: нет элемента {_page_member(pid)}")
+            content, hashes = page
+            contents[pid] = content
+            if hashes is not None:
+                blocks[pid] = hashes
+    meta = {k: index.get(k) for k in ("version", "created_at", "source_page_id")}
+    return briefs, contents, blocks, meta
+
+
+def load_bundle_page(path: str, page_id: str) -> tuple[BriefContent, BriefBlocks | None]:
+    """
+    Контент и отпечатки одной темы из бандла (бриф, вытесненный из кэша): читается
+    и распаковывается только её элемент. Нет в бандле — пустой контент.
+    """
+    with _open(path) as zf:
+        return _read_page(zf, page_id) or (EMPTY_CONTENT, None)
+
+
+def crawl(
+    page_id: str, token: str | None = None, workers: int = 3, allow_empty: bool = False,
+) -> tuple[list[Brief], dict[str, BriefContent], dict[str, BriefBlocks]]:
+    """
+    Обходит страницу брифов и контент всех тем параллельно (частоту ограничивает notion_client).
+    Любой неполный ответ Notion — NotionError: бандл с пустыми или обрезанными брифами
+    не собирается. Страница темы без блоков — тоже ошибка, если не allow_empty.
+    """
+    briefs = fetch_briefs(page_id, token, strict=True)
+    page_ids = list(dict.fromkeys(b.page_id for b in briefs if b.is_page))
+
+    def fetch(pid: str) -> tuple[int, BriefContent, BriefBlocks]:
+        blocks = fetch_brief_blocks(pid, token, strict=True)
+        content, hashes, _ = parse_brief_blocks(blocks)
+        return len(blocks), content, hashes
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pages = dict(zip(page_ids, pool.map(fetch, page_ids)))
+    empty = [pid for pid, (n, _, _) in pages.items() if not n]
+    if empty and not allow_empty:
+        raise NotionError(f"Страницы тем без блоков ({len(empty)}): {', '.join(empty[:5])}")
+    contents = {pid: content for pid, (_, content, _) in pages.items()}
+    hashes = {pid: h for pid, (_, _, h) in pages.items()}
+    return briefs, contents, hashes
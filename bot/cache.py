@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш с бюджетом в байтах и вытеснением давно не использованных записей (LRU).
+
+Размер записи — приблизительный: sys.getsizeof по графу объектов значения
+(контейнеры, dataclass/slots-модели, объекты клавиатур Telegram); общие объекты
+внутри записи считаются один раз. Счётчики: <name>.evicted (попадания и промахи
+считает вызывающий — он знает, что такое «промах» для его данных).
+"""
+import sys
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, MutableMapping
+
+from bot.metrics import inc
+
+_ATOMS = (str, bytes, int, float, bool, type(None))
+
+
+def approx_size(obj) -> int:
+    """Приблизительный размер объекта в байтах вместе со всем, на что он ссылается."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, _ATOMS):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        else:
+            # только публичные слоты: служебные (_bot у объектов Telegram и т.п.) ведут за пределы записи
+            for cls in type(o).__mro__:
+                slots = getattr(cls, "__slots__", ())
+                for name in (slots,) if isinstance(slots, str) else slots:
+                    if not name.startswith("_") and hasattr(o, name):
+                        stack.append(getattr(o, name))
+    return total
+
+
+class ByteLRU(MutableMapping):
+    """dict-подобный кэш: при превышении max_bytes вытесняются давно не использованные записи."""
+
+    def __init__(self, name: str, max_bytes: int, on_evict: Callable[[Hashable], None] | None = None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.bytes = 0
+        self._data: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+
+    def __getitem__(self, key):
+        value, _ = self._data[key]
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value, approx_size(value))
+
+    def __delitem__(self, key):
+        _, size = self._data.pop(key)
+        self.bytes -= size
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def peek(self, key, default=None):
+        """Значение без отметки об использовании (порядок вытеснения не меняется)."""
+        entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def put(self, key: Hashable, value, size: int):
+        """Кладёт запись с заранее посчитанным размером; самая свежая запись не вытесняется, даже если одна больше бюджета."""
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self._data[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self._data) > 1:
+            evicted, (_, evicted_size) = self._data.popitem(last=False)
+            self.bytes -= evicted_size
+            inc(f"{self.name}.evicted")
+            if self.on_evict is not None:
+                self.on_evict(evicted)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Слияние частых нажатий кнопок по ключу (чат, сообщение).
+
+Пока по ключу идёт отрисовка (запись в базу + edit_message_text), новые нажатия
+только меняют состояние и оставляют свою функцию отрисовки; когда текущая
+закончится, выполняется одна — последняя — отрисовка. Серия из N быстрых
+нажатий даёт 2 обращения к Telegram вместо N.
+"""
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+
+from bot.metrics import inc
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    def __init__(self, name: str):
+        self.name = name
+        # ключ → отрисовка, ожидающая выполнения (None — ждущих нет, но ключ занят)
+        self._pending: dict[Hashable, Callable[[], Awaitable] | None] = {}
+
+    def busy(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    async def run(self, key: Hashable, flush: Callable[[], Awaitable]) -> bool:
+        """
+        Выполняет flush() либо, если по key уже идёт отрисовка, откладывает его
+        (заменяя ранее отложенный) и сразу возвращает False. Первый вызвавший
+        выполняет отложенные отрисовки, пока они появляются, и возвращает True.
+        """
+        if key in self._pending:
+            self._pending[key] = flush
+            inc(f"{self.name}.coalesced")
+            return False
+        self._pending[key] = None
+        inc(f"{self.name}.calls")
+        try:
+            while flush is not None:
+                try:
+                    await flush()
+                except Exception:
+                    # Есть более новое состояние — его отрисовка важнее ошибки промежуточной
+                    if self._pending.get(key) is None:
+                        raise
+                    logger.debug("%s: ошибка промежуточной отрисовки %r", self.name, key, exc_info=True)
+                flush = self._pending.get(key)
+                self._pending[key] = None
+        finally:
+            self._pending.pop(key, None)
+        return True
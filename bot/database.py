@@ -2,17 +2,80 @@
 """SQLite-база: студенты, прогресс по брифам, запросы на встречи."""
 import sqlite3
 import os
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from bot.metrics import timed
 
 DB_PATH = os.environ.get("VKR_DB_PATH", "vkr_bot.db")
+# Часовой пояс бота: по нему идут задачи по расписанию и считаются сутки в сводках /trend
+BOT_TZ = os.environ.get("VKR_BOT_TZ", "Europe/Moscow")
+
+
+def day_offset_minutes() -> int:
+    """
+    Текущее смещение BOT_TZ от UTC в минутах. Время событий хранится в UTC;
+    сводки относят событие к местным суткам (при переходе на летнее время — по смещению на момент сводки).
+    """
+    return int(datetime.now(ZoneInfo(BOT_TZ)).utcoffset().total_seconds() // 60)
+
+
+# Счётчик открытых заявок держим в памяти процесса: считается один раз в init_db,
+# дальше меняется вместе с add_help_request / resolve_help_request (для /stats без COUNT(*)).
+_pending_help_requests = 0
+# Есть ли FTS5 в сборке SQLite (определяется в init_db)
+_fts_available = False
 
 
 def get_connection():
     return sqlite3.connect(DB_PATH)
 
 
+def pending_help_count() -> int:
+    """Число необработанных заявок (счётчик в памяти)."""
+    return _pending_help_requests
+
+
+def db_file_sizes() -> dict:
+    """Размер файла БД и WAL/журнала в байтах (0, если файла нет)."""
+    sizes = {}
+    for key, path in (("db", DB_PATH), ("wal", DB_PATH + "-wal"), ("journal", DB_PATH + "-journal")):
+        try:
+            sizes[key] = os.path.getsize(path)
+        except OSError:
+            sizes[key] = 0
+    return sizes
+
+
+# Версия схемы в PRAGMA user_version: увеличивать при каждом изменении в _migrate
+SCHEMA_VERSION = 3
+
+
+@timed("db.init_db")
 def init_db():
+    """Схема и счётчики при старте; если user_version актуальна — без CREATE/ALTER."""
+    global _pending_help_requests, _fts_available
     conn = get_connection()
     cur = conn.cursor()
+    if cur.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        _fts_available = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'faq_fts'"
+        ).fetchone() is not None
+    else:
+        _migrate(cur)
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    _pending_help_requests = cur.execute("SELECT COUNT(*) FROM help_requests WHERE resolved = 0").fetchone()[0]
+    conn.close()
+
+
+def _migrate(cur):
+    """Создание/обновление схемы (идемпотентно)."""
+    # Новая база сразу создаётся с incremental vacuum (существующую переводит retention.archive_old_data)
+    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL: читатели (бэкап, выгрузки) не блокируют запись студентов; режим сохраняется в файле
+    cur.execute("PRAGMA journal_mode = WAL")
     # Студенты (Telegram user_id как ключ),
     # selected_brief_index — выбранная тема ВКР,
     # current_step_index — следующий шаг в разделе "Шаги по порядку".
@@ -70,6 +133,69 @@ def init_db():
             created_at TEXT DEFAULT (datetime('now'))
         )
     """)
+    # Поиск записи FAQ по тексту вопроса (upsert при импорте)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_faq_question ON faq(question)")
+    # Заявки студента (счётчики в выгрузке /export)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_help_requests_user ON help_requests(user_id)")
+    # Открытые заявки по времени (утренняя сводка: новые после водяного знака и счётчик старых)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_help_requests_open ON help_requests(resolved, created_at, id)")
+    # Служебные значения (водяные знаки фоновых задач и т.п.)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    # Журнал переходов по шагам (для дневных сводок; students хранит только текущий шаг)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS step_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            brief_index INTEGER,
+            step_index INTEGER,
+            reached_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    # Дневные сводки по темам: копятся ночной задачей rollup_progress, читает /trend
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            day TEXT,
+            brief_index INTEGER,
+            steps_reached INTEGER NOT NULL DEFAULT 0,
+            checklist_done INTEGER NOT NULL DEFAULT 0,
+            briefs_done INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, brief_index)
+        )
+    """)
+    # Рассылки админа (/broadcast) и статус доставки каждому получателю:
+    # pending → sending (взят отправителем) → sent / blocked / failed. Переживает перезапуск.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TEXT DEFAULT (datetime('now')),
+            finished_at TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER,
+            user_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            updated_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (broadcast_id, user_id)
+        )
+    """)
+    # Следующий получатель в статусе pending — по индексу, без просмотра уже доставленных
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(broadcast_id, status, user_id)"
+    )
+    # Диапазонные выборки новых событий по времени
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_checklist_progress_completed ON checklist_progress(completed_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_progress_completed ON progress(completed_at)")
+    _init_faq_fts(cur)
     # Колонки могут быть добавлены позже — пытаемся добавить их, игнорируя ошибки, если уже существуют.
     try:
         cur.execute("ALTER TABLE students ADD COLUMN selected_brief_index INTEGER")
@@ -79,15 +205,73 @@ def init_db():
         cur.execute("ALTER TABLE students ADD COLUMN current_step_index INTEGER")
     except sqlite3.OperationalError:
         pass
-    conn.commit()
-    conn.close()
+    # last_activity_at — последний шаг/отметка чеклиста/завершение брифа (для напоминаний «застрявшим»),
+    # nudged_at — когда напомнили (одно напоминание на период бездействия)
+    for column in ("last_activity_at TEXT", "nudged_at TEXT"):
+        try:
+            cur.execute(f"ALTER TABLE students ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            pass
+    cur.execute("""
+        UPDATE students SET last_activity_at = COALESCE(
+            (SELECT MAX(t) FROM (
+                SELECT MAX(reached_at) AS t FROM step_log WHERE user_id = students.user_id
+                UNION ALL SELECT MAX(completed_at) FROM checklist_progress WHERE user_id = students.user_id
+                UNION ALL SELECT MAX(completed_at) FROM progress WHERE user_id = students.user_id
+            )),
+            created_at
+        )
+        WHERE last_activity_at IS NULL
+    """)
+    # Выборка бездействующих — диапазон по индексу, без просмотра всех студентов
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_students_last_activity ON students(last_activity_at)")
 
 
+def _init_faq_fts(cur):
+    """Полнотекстовый индекс FAQ (FTS5, external content) и триггеры синхронизации с faq."""
+    global _fts_available
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'faq_fts'").fetchone()
+    try:
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS faq_fts USING fts5(
+                question, answer,
+                content='faq', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite собран без FTS5 — поиск деградирует до LIKE
+        _fts_available = False
+        return
+    _fts_available = True
+    cur.executescript("""
+        CREATE TRIGGER IF NOT EXISTS faq_fts_ai AFTER INSERT ON faq BEGIN
+            INSERT INTO faq_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+        END;
+        CREATE TRIGGER IF NOT EXISTS faq_fts_ad AFTER DELETE ON faq BEGIN
+            INSERT INTO faq_fts(faq_fts, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer);
+        END;
+        CREATE TRIGGER IF NOT EXISTS faq_fts_au AFTER UPDATE ON faq BEGIN
+            INSERT INTO faq_fts(faq_fts, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer);
+            INSERT INTO faq_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+        END;
+    """)
+    if not exists:
+        # Индекс создан на существующей таблице — заполнить из faq
+        cur.execute("INSERT INTO faq_fts(faq_fts) VALUES ('rebuild')")
+
+
+# Отметка активности студента (шаг, чеклист, завершение брифа) — в той же транзакции, что и само действие
+_TOUCH_ACTIVITY = "UPDATE students SET last_activity_at = datetime('now') WHERE user_id = ?"
+
+
+@timed("db.ensure_student")
 def ensure_student(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        "INSERT OR IGNORE INTO students (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
+        "INSERT OR IGNORE INTO students (user_id, username, first_name, last_name, last_activity_at)"
+        " VALUES (?, ?, ?, ?, datetime('now'))",
         (user_id, username, first_name, last_name),
     )
     cur.execute(
@@ -98,6 +282,7 @@ def ensure_student(user_id: int, username: str = None, first_name: str = None, l
     conn.close()
 
 
+@timed("db.set_selected_brief")
 def set_selected_brief(user_id: int, brief_index: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -106,6 +291,7 @@ def set_selected_brief(user_id: int, brief_index: int):
     conn.close()
 
 
+@timed("db.get_selected_brief")
 def get_selected_brief(user_id: int) -> int | None:
     conn = get_connection()
     cur = conn.cursor()
@@ -115,6 +301,7 @@ def get_selected_brief(user_id: int) -> int | None:
     return row[0] if row and row[0] is not None else None
 
 
+@timed("db.clear_selected_brief")
 def clear_selected_brief(user_id: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -127,6 +314,7 @@ def clear_selected_brief(user_id: int):
     conn.close()
 
 
+@timed("db.clear_checklist_progress")
 def clear_checklist_progress(user_id: int) -> int:
     """Удаляет все отметки чеклиста для пользователя. Возвращает количество удалённых строк."""
     conn = get_connection()
@@ -138,6 +326,7 @@ def clear_checklist_progress(user_id: int) -> int:
     return deleted
 
 
+@timed("db.add_faq")
 def add_faq(question: str, answer: str, created_by: int | None = None) -> int:
     conn = get_connection()
     cur = conn.cursor()
@@ -151,6 +340,7 @@ def add_faq(question: str, answer: str, created_by: int | None = None) -> int:
     return faq_id
 
 
+@timed("db.list_faq")
 def list_faq(limit: int | None = 20) -> list[dict]:
     conn = get_connection()
     cur = conn.cursor()
@@ -177,6 +367,116 @@ def list_faq(limit: int | None = 20) -> list[dict]:
     ]
 
 
+def _fts_query(text: str) -> str:
+    """Запрос пользователя → выражение FTS5: все слова, каждое как префикс ("слово"*)."""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{w}"*' for w in words[:10])
+
+
+@timed("db.search_faq")
+def search_faq(query: str, limit: int = 10) -> list[dict]:
+    """
+    Поиск по FAQ, лучшие совпадения первыми (bm25, вопрос весит больше ответа).
+    snippet — фрагмент ответа с подсвеченными «совпадениями».
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+    conn = get_connection()
+    cur = conn.cursor()
+    if _fts_available:
+        cur.execute("""
+            SELECT f.id, f.question, f.answer,
+                   snippet(faq_fts, 1, '«', '»', '…', 16)
+            FROM faq_fts
+            JOIN faq f ON f.id = faq_fts.rowid
+            WHERE faq_fts MATCH ?
+            ORDER BY bm25(faq_fts, 4.0, 1.0)
+            LIMIT ?
+        """, (match, limit))
+    else:
+        like = f"%{query.strip()}%"
+        cur.execute(
+            "SELECT id, question, answer, substr(answer, 1, 120) FROM faq"
+            " WHERE question LIKE ? OR answer LIKE ? ORDER BY id LIMIT ?",
+            (like, like, limit),
+        )
+    rows = cur.fetchall()
+    conn.close()
+    return [{"id": r[0], "question": r[1], "answer": r[2], "snippet": r[3]} for r in rows]
+
+
+@timed("db.count_faq")
+def count_faq() -> int:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM faq")
+    n = cur.fetchone()[0]
+    conn.close()
+    return n
+
+
+@timed("db.upsert_students")
+def upsert_students(rows: list[tuple]) -> int:
+    """
+    Массовая загрузка студентов одной транзакцией (executemany).
+    rows: (user_id, username, first_name, last_name, selected_brief_index);
+    пустые (None) поля не затирают уже сохранённые значения.
+    """
+    conn = get_connection()
+    try:
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO students (user_id, username, first_name, last_name, selected_brief_index, last_activity_at)
+                VALUES (?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, students.username),
+                    first_name = COALESCE(excluded.first_name, students.first_name),
+                    last_name = COALESCE(excluded.last_name, students.last_name),
+                    selected_brief_index = COALESCE(excluded.selected_brief_index, students.selected_brief_index)
+                """,
+                rows,
+            )
+    finally:
+        conn.close()
+    return len(rows)
+
+
+@timed("db.upsert_faq")
+def upsert_faq(rows: list[tuple], created_by: int | None = None) -> int:
+    """
+    Массовая загрузка FAQ одной транзакцией. rows: (id или None, question, answer).
+    С id — вставка/замена записи с этим id; без id — ответ обновляется у записи
+    с тем же вопросом, иначе добавляется новая.
+    """
+    with_id = [(r[0], r[1], r[2], created_by) for r in rows if r[0] is not None]
+    by_question = [r for r in rows if r[0] is None]
+    conn = get_connection()
+    try:
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO faq (id, question, answer, created_by) VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET question = excluded.question, answer = excluded.answer
+                """,
+                with_id,
+            )
+            conn.executemany(
+                "UPDATE faq SET answer = ? WHERE question = ? AND answer <> ?",
+                ((a, q, a) for _, q, a in by_question),
+            )
+            conn.executemany(
+                "INSERT INTO faq (question, answer, created_by)"
+                " SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM faq WHERE question = ?)",
+                ((q, a, created_by, q) for _, q, a in by_question),
+            )
+    finally:
+        conn.close()
+    return len(rows)
+
+
+@timed("db.mark_brief_done")
 def mark_brief_done(user_id: int, brief_index: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -184,10 +484,12 @@ def mark_brief_done(user_id: int, brief_index: int):
         "INSERT OR IGNORE INTO progress (user_id, brief_index) VALUES (?, ?)",
         (user_id, brief_index),
     )
+    cur.execute(_TOUCH_ACTIVITY, (user_id,))
     conn.commit()
     conn.close()
 
 
+@timed("db.get_progress")
 def get_progress(user_id: int) -> list:
     conn = get_connection()
     cur = conn.cursor()
@@ -197,6 +499,7 @@ def get_progress(user_id: int) -> list:
     return [r[0] for r in rows]
 
 
+@timed("db.add_help_request")
 def add_help_request(user_id: int, kind: str, comment: str = ""):
     conn = get_connection()
     cur = conn.cursor()
@@ -207,9 +510,12 @@ def add_help_request(user_id: int, kind: str, comment: str = ""):
     conn.commit()
     rid = cur.lastrowid
     conn.close()
+    global _pending_help_requests
+    _pending_help_requests += 1
     return rid
 
 
+@timed("db.get_all_students_with_progress")
 def get_all_students_with_progress():
     conn = get_connection()
     cur = conn.cursor()
@@ -238,6 +544,7 @@ def get_all_students_with_progress():
     ]
 
 
+@timed("db.get_help_requests")
 def get_help_requests(resolved: bool = False):
     conn = get_connection()
     cur = conn.cursor()
@@ -261,23 +568,79 @@ def get_help_requests(resolved: bool = False):
     ]
 
 
-def resolve_help_request(request_id: int):
+@timed("db.get_open_help_requests_page")
+def get_open_help_requests_page(after_id: int = 0, limit: int = 5) -> tuple[list[dict], bool]:
+    """
+    Страница открытых заявок (старые первыми) после заявки after_id — keyset по (created_at, id),
+    один запрос по индексу (resolved, created_at, id) при любом размере очереди.
+    Возвращает (заявки, есть ли следующая страница).
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT hr.id, hr.user_id, hr.kind, hr.comment, hr.created_at,
+               s.username, s.first_name, s.last_name
+        FROM help_requests hr
+        LEFT JOIN students s ON s.user_id = hr.user_id
+        WHERE hr.resolved = 0
+          AND (hr.created_at, hr.id) > (
+              SELECT COALESCE((SELECT created_at FROM help_requests WHERE id = ?), ''), ?
+          )
+        ORDER BY hr.created_at, hr.id
+        LIMIT ?
+    """, (after_id, after_id, limit + 1))
+    rows = cur.fetchall()
+    conn.close()
+    return [
+        {
+            "id": r[0], "user_id": r[1], "kind": r[2], "comment": r[3], "created_at": r[4],
+            "username": r[5], "first_name": r[6], "last_name": r[7],
+        }
+        for r in rows[:limit]
+    ], len(rows) > limit
+
+
+def _resolved(count: int) -> int:
+    global _pending_help_requests
+    _pending_help_requests = max(0, _pending_help_requests - count)
+    return count
+
+
+@timed("db.resolve_help_request")
+def resolve_help_request(request_id: int) -> int:
+    """Закрывает заявку; возвращает 1, если она была открыта."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE help_requests SET resolved = 1 WHERE id = ? AND resolved = 0", (request_id,))
+    resolved = cur.rowcount
+    conn.commit()
+    conn.close()
+    return _resolved(resolved)
+
+
+@timed("db.resolve_help_requests_for_user")
+def resolve_help_requests_for_user(user_id: int) -> int:
+    """Закрывает все открытые заявки студента; возвращает их число."""
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("UPDATE help_requests SET resolved = 1 WHERE id = ?", (request_id,))
+    cur.execute("UPDATE help_requests SET resolved = 1 WHERE user_id = ? AND resolved = 0", (user_id,))
+    resolved = cur.rowcount
     conn.commit()
     conn.close()
+    return _resolved(resolved)
 
 
 # --- Чеклист: отметки студентов ---
 
 
+@timed("db.set_checklist_item")
 def set_checklist_item(user_id: int, brief_index: int, item_index: int, completed: bool):
     conn = get_connection()
     cur = conn.cursor()
     if completed:
+        # OR IGNORE: повторная отметка не сдвигает completed_at — в сводке не считается дважды
         cur.execute(
-            "INSERT OR REPLACE INTO checklist_progress (user_id, brief_index, item_index) VALUES (?, ?, ?)",
+            "INSERT OR IGNORE INTO checklist_progress (user_id, brief_index, item_index) VALUES (?, ?, ?)",
             (user_id, brief_index, item_index),
         )
     else:
@@ -285,10 +648,35 @@ def set_checklist_item(user_id: int, brief_index: int, item_index: int, complete
             "DELETE FROM checklist_progress WHERE user_id = ? AND brief_index = ? AND item_index = ?",
             (user_id, brief_index, item_index),
         )
+    cur.execute(_TOUCH_ACTIVITY, (user_id,))
     conn.commit()
     conn.close()
 
 
+@timed("db.set_checklist_items")
+def set_checklist_items(user_id: int, brief_index: int, states: dict[int, bool]):
+    """Несколько отметок чеклиста одной транзакцией: {item_index: completed}."""
+    if not states:
+        return
+    done = [(user_id, brief_index, i) for i, completed in states.items() if completed]
+    undone = [(user_id, brief_index, i) for i, completed in states.items() if not completed]
+    conn = get_connection()
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO checklist_progress (user_id, brief_index, item_index) VALUES (?, ?, ?)",
+                done,
+            )
+            conn.executemany(
+                "DELETE FROM checklist_progress WHERE user_id = ? AND brief_index = ? AND item_index = ?",
+                undone,
+            )
+            conn.execute(_TOUCH_ACTIVITY, (user_id,))
+    finally:
+        conn.close()
+
+
+@timed("db.get_checklist_checked")
 def get_checklist_checked(user_id: int, brief_index: int) -> set:
     conn = get_connection()
     cur = conn.cursor()
@@ -301,17 +689,28 @@ def get_checklist_checked(user_id: int, brief_index: int) -> set:
     return {r[0] for r in rows}
 
 
+@timed("db.set_current_step")
 def set_current_step(user_id: int, step_index: int):
     conn = get_connection()
     cur = conn.cursor()
+    # В журнал — только реальная смена шага (повторное нажатие не считается)
+    cur.execute(
+        """
+        INSERT INTO step_log (user_id, brief_index, step_index)
+        SELECT user_id, selected_brief_index, ? FROM students
+        WHERE user_id = ? AND current_step_index IS NOT ?
+        """,
+        (step_index, user_id, step_index),
+    )
     cur.execute(
-        "UPDATE students SET current_step_index = ? WHERE user_id = ?",
+        "UPDATE students SET current_step_index = ?, last_activity_at = datetime('now') WHERE user_id = ?",
         (step_index, user_id),
     )
     conn.commit()
     conn.close()
 
 
+@timed("db.get_current_step")
 def get_current_step(user_id: int) -> int | None:
     conn = get_connection()
     cur = conn.cursor()
@@ -324,6 +723,7 @@ def get_current_step(user_id: int) -> int | None:
     return row[0] if row and row[0] is not None else None
 
 
+@timed("db.get_all_checklist_results")
 def get_all_checklist_results():
     """Для админа: (user_id, brief_index, total_items, completed_count), с именами из students."""
     conn = get_connection()
@@ -341,3 +741,406 @@ def get_all_checklist_results():
         {"user_id": r[0], "first_name": r[1], "last_name": r[2], "username": r[3], "brief_index": r[4], "completed_count": r[5]}
         for r in rows
     ]
+
+
+EXPORT_COLUMNS = (
+    "user_id", "username", "first_name", "last_name", "selected_brief_index", "current_step_index",
+    "checklist_done", "briefs_done", "help_total", "help_open", "registered_at",
+)
+
+
+def iter_export_rows(chunk_size: int = 500):
+    """
+    Строки выгрузки прогресса (кортежи в порядке EXPORT_COLUMNS) порциями через fetchmany.
+    Порядок по user_id — обход по первичному ключу без сортировки, счётчики — по индексам,
+    так что память не растёт с числом студентов.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.execute("""
+            SELECT s.user_id, s.username, s.first_name, s.last_name,
+                   s.selected_brief_index, s.current_step_index,
+                   (SELECT COUNT(*) FROM checklist_progress cp
+                     WHERE cp.user_id = s.user_id AND cp.brief_index = s.selected_brief_index),
+                   (SELECT COUNT(*) FROM progress p WHERE p.user_id = s.user_id),
+                   (SELECT COUNT(*) FROM help_requests hr WHERE hr.user_id = s.user_id),
+                   (SELECT COUNT(*) FROM help_requests hr WHERE hr.user_id = s.user_id AND hr.resolved = 0),
+                   s.created_at
+            FROM students s
+            ORDER BY s.user_id
+        """)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+# --- Служебные значения и дневные сводки ---
+
+
+def _get_meta(cur, key: str, default: str | None = None) -> str | None:
+    row = cur.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_meta(cur, key: str, value: str):
+    cur.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+@timed("db.get_meta")
+def get_meta(key: str, default: str | None = None) -> str | None:
+    conn = get_connection()
+    value = _get_meta(conn.cursor(), key, default)
+    conn.close()
+    return value
+
+
+@timed("db.set_meta")
+def set_meta(key: str, value: str):
+    conn = get_connection()
+    _set_meta(conn.cursor(), key, value)
+    conn.commit()
+    conn.close()
+
+
+_ROLLUP_SOURCES = (
+    # (колонка сводки, SQL событий с водяным знаком; ? — смещение суток BOT_TZ, нижняя и верхняя граница)
+    ("steps_reached", """
+        SELECT date(reached_at, ?), brief_index, COUNT(*) FROM step_log
+        WHERE id > ? AND id <= ? AND brief_index IS NOT NULL
+        GROUP BY 1, 2
+    """),
+    ("checklist_done", """
+        SELECT date(completed_at, ?), brief_index, COUNT(*) FROM checklist_progress
+        WHERE completed_at > ? AND completed_at <= ?
+        GROUP BY 1, 2
+    """),
+    ("briefs_done", """
+        SELECT date(completed_at, ?), brief_index, COUNT(*) FROM progress
+        WHERE completed_at > ? AND completed_at <= ?
+        GROUP BY 1, 2
+    """),
+)
+
+
+@timed("db.rollup_progress")
+def rollup_progress() -> dict:
+    """
+    Добавляет в daily_rollup события после прошлого водяного знака (одна транзакция).
+    step_log — по id, отметки чеклиста и завершения брифов — по completed_at (по индексу);
+    верхняя граница по времени на секунду в прошлом, чтобы не потерять записи текущей секунды.
+    День события — местные сутки BOT_TZ. checklist_done считает отметки: пункт, снятый
+    и отмеченный снова, даёт новое событие (повторная отметка без снятия — нет).
+    Возвращает число учтённых событий по колонкам.
+    """
+    offset = f"{day_offset_minutes():+d} minutes"
+    conn = get_connection()
+    added = {}
+    try:
+        with conn:
+            cur = conn.cursor()
+            time_hi = cur.execute("SELECT datetime('now', '-1 second')").fetchone()[0]
+            id_hi = cur.execute("SELECT COALESCE(MAX(id), 0) FROM step_log").fetchone()[0]
+            for column, sql in _ROLLUP_SOURCES:
+                key = f"rollup.{column}"
+                if column == "steps_reached":
+                    lo, hi = int(_get_meta(cur, key, "0")), id_hi
+                else:
+                    lo, hi = _get_meta(cur, key, ""), time_hi
+                rows = cur.execute(sql, (offset, lo, hi)).fetchall()
+                cur.executemany(
+                    f"""
+                    INSERT INTO daily_rollup (day, brief_index, {column}) VALUES (?, ?, ?)
+                    ON CONFLICT(day, brief_index) DO UPDATE SET {column} = {column} + excluded.{column}
+                    """,
+                    rows,
+                )
+                _set_meta(cur, key, str(hi))
+                added[column] = sum(r[2] for r in rows)
+    finally:
+        conn.close()
+    return added
+
+
+@timed("db.get_trend")
+def get_trend(days: int = 14) -> tuple[list[dict], list[dict]]:
+    """
+    Из сводок за последние days дней (местные сутки BOT_TZ, включая сегодня):
+    (итоги по дням, итоги по темам).
+    Читает только daily_rollup — стоимость O(дней × тем), не O(событий).
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    offset = f"{day_offset_minutes():+d} minutes"
+    since = f"-{max(1, days) - 1} days"
+    by_day = cur.execute("""
+        SELECT day, SUM(steps_reached), SUM(checklist_done), SUM(briefs_done)
+        FROM daily_rollup WHERE day >= date('now', ?, ?)
+        GROUP BY day ORDER BY day
+    """, (offset, since)).fetchall()
+    by_brief = cur.execute("""
+        SELECT brief_index, SUM(steps_reached), SUM(checklist_done), SUM(briefs_done)
+        FROM daily_rollup WHERE day >= date('now', ?, ?)
+        GROUP BY brief_index ORDER BY SUM(steps_reached) + SUM(checklist_done) DESC
+    """, (offset, since)).fetchall()
+    conn.close()
+    keys = ("steps_reached", "checklist_done", "briefs_done")
+    return (
+        [{"day": r[0], **dict(zip(keys, r[1:]))} for r in by_day],
+        [{"brief_index": r[0], **dict(zip(keys, r[1:]))} for r in by_brief],
+    )
+
+
+DIGEST_WATERMARK_KEY = "digest.help_requests"
+
+
+@timed("db.get_help_digest")
+def get_help_digest(limit: int = 20) -> dict:
+    """
+    Утренняя сводка открытых заявок относительно водяного знака (created_at, id) в meta:
+    new — до limit новых заявок (с именами), new_total — всего новых,
+    older — {kind: число} старых открытых, oldest_at — самая старая из них,
+    watermark — новый водяной знак "created_at|id" (сохранить set_meta после отправки).
+    Все выборки — диапазоны по индексу (resolved, created_at, id).
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    raw = _get_meta(cur, DIGEST_WATERMARK_KEY, "|0")
+    wm_at, _, wm_id = raw.partition("|")
+    wm = (wm_at, int(wm_id or 0))
+    new = cur.execute("""
+        SELECT hr.id, hr.user_id, hr.kind, hr.comment, hr.created_at,
+               s.username, s.first_name, s.last_name
+        FROM help_requests hr
+        LEFT JOIN students s ON s.user_id = hr.user_id
+        WHERE hr.resolved = 0 AND (hr.created_at, hr.id) > (?, ?)
+        ORDER BY hr.created_at, hr.id
+        LIMIT ?
+    """, (*wm, limit)).fetchall()
+    new_total = cur.execute(
+        "SELECT COUNT(*) FROM help_requests WHERE resolved = 0 AND (created_at, id) > (?, ?)", wm
+    ).fetchone()[0]
+    last = cur.execute("""
+        SELECT created_at, id FROM help_requests
+        WHERE resolved = 0 AND (created_at, id) > (?, ?)
+        ORDER BY created_at DESC, id DESC LIMIT 1
+    """, wm).fetchone()
+    older = dict(cur.execute(
+        "SELECT kind, COUNT(*) FROM help_requests WHERE resolved = 0 AND (created_at, id) <= (?, ?) GROUP BY kind", wm
+    ).fetchall())
+    oldest_at = cur.execute(
+        "SELECT MIN(created_at) FROM help_requests WHERE resolved = 0 AND (created_at, id) <= (?, ?)", wm
+    ).fetchone()[0]
+    conn.close()
+    return {
+        "new": [
+            {
+                "id": r[0], "user_id": r[1], "kind": r[2], "comment": r[3], "created_at": r[4],
+                "username": r[5], "first_name": r[6], "last_name": r[7],
+            }
+            for r in new
+        ],
+        "new_total": new_total,
+        "older": older,
+        "oldest_at": oldest_at,
+        "watermark": f"{last[0]}|{last[1]}" if last else raw,
+    }
+
+
+# --- Рассылки (/broadcast) ---
+
+BROADCAST_STATUSES = ("pending", "sending", "sent", "blocked", "failed")
+
+
+@timed("db.create_broadcast")
+def create_broadcast(text: str, created_by: int | None = None) -> tuple[int, int]:
+    """Рассылка и её получатели — все студенты на момент создания (одна транзакция). Возвращает (id, получателей)."""
+    conn = get_connection()
+    try:
+        with conn:
+            cur = conn.execute("INSERT INTO broadcasts (text, created_by) VALUES (?, ?)", (text, created_by))
+            broadcast_id = cur.lastrowid
+            recipients = conn.execute(
+                "INSERT INTO broadcast_recipients (broadcast_id, user_id) SELECT ?, user_id FROM students",
+                (broadcast_id,),
+            ).rowcount
+    finally:
+        conn.close()
+    return broadcast_id, recipients
+
+
+@timed("db.claim_broadcast_recipient")
+def claim_broadcast_recipient(broadcast_id: int) -> int | None:
+    """Берёт следующего получателя pending → sending (атомарно). None — ждущих не осталось."""
+    conn = get_connection()
+    try:
+        with conn:
+            row = conn.execute("""
+                UPDATE broadcast_recipients SET status = 'sending', updated_at = datetime('now')
+                WHERE broadcast_id = ? AND user_id = (
+                    SELECT user_id FROM broadcast_recipients
+                    WHERE broadcast_id = ? AND status = 'pending'
+                    ORDER BY user_id LIMIT 1
+                )
+                RETURNING user_id
+            """, (broadcast_id, broadcast_id)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+@timed("db.set_broadcast_status")
+def set_broadcast_status(broadcast_id: int, user_id: int, status: str, error: str | None = None):
+    conn = get_connection()
+    conn.execute(
+        """
+        UPDATE broadcast_recipients SET status = ?, error = ?, updated_at = datetime('now')
+        WHERE broadcast_id = ? AND user_id = ?
+        """,
+        (status, error, broadcast_id, user_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed("db.abandon_broadcast_sends")
+def abandon_broadcast_sends(broadcast_id: int, error: str = "прервано перезапуском") -> int:
+    """
+    Получатели, взятые в отправку до перезапуска (sending), → failed: доставка не
+    подтверждена, повторная отправка могла бы продублировать сообщение.
+    """
+    conn = get_connection()
+    cur = conn.execute(
+        """
+        UPDATE broadcast_recipients SET status = 'failed', error = ?, updated_at = datetime('now')
+        WHERE broadcast_id = ? AND status = 'sending'
+        """,
+        (error, broadcast_id),
+    )
+    conn.commit()
+    conn.close()
+    return cur.rowcount
+
+
+@timed("db.finish_broadcast")
+def finish_broadcast(broadcast_id: int):
+    conn = get_connection()
+    conn.execute(
+        "UPDATE broadcasts SET finished_at = datetime('now') WHERE id = ? AND finished_at IS NULL", (broadcast_id,)
+    )
+    conn.commit()
+    conn.close()
+
+
+@timed("db.get_unfinished_broadcasts")
+def get_unfinished_broadcasts() -> list[dict]:
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id, text, created_by, created_at FROM broadcasts WHERE finished_at IS NULL ORDER BY id"
+    ).fetchall()
+    conn.close()
+    return [{"id": r[0], "text": r[1], "created_by": r[2], "created_at": r[3]} for r in rows]
+
+
+@timed("db.list_broadcasts")
+def list_broadcasts(limit: int = 5) -> list[dict]:
+    """Последние рассылки (новые первыми) со счётчиками получателей по статусам."""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id, text, created_by, created_at, finished_at FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    result = [
+        {
+            "id": r[0], "text": r[1], "created_by": r[2], "created_at": r[3], "finished_at": r[4],
+            "counts": _broadcast_counts(conn, r[0]),
+        }
+        for r in rows
+    ]
+    conn.close()
+    return result
+
+
+def _broadcast_counts(conn, broadcast_id: int) -> dict[str, int]:
+    counts = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status", (broadcast_id,)
+    ).fetchall())
+    return {status: counts.get(status, 0) for status in BROADCAST_STATUSES}
+
+
+@timed("db.get_broadcast_counts")
+def get_broadcast_counts(broadcast_id: int) -> dict[str, int]:
+    """Число получателей рассылки по статусам."""
+    conn = get_connection()
+    counts = _broadcast_counts(conn, broadcast_id)
+    conn.close()
+    return counts
+
+
+# --- Бездействующие студенты (напоминания, /stalled) ---
+
+_STALLED_WHERE = """
+    WHERE s.last_activity_at < datetime('now', ?)
+      AND NOT EXISTS (
+          SELECT 1 FROM progress p WHERE p.user_id = s.user_id AND p.brief_index = s.selected_brief_index
+      )
+"""
+
+
+@timed("db.get_stalled_students")
+def get_stalled_students(idle_days: int, limit: int | None = None, only_unnudged: bool = False) -> list[dict]:
+    """
+    Студенты без активности дольше idle_days дней (давно бездействующие первыми), кроме
+    завершивших выбранную тему. Диапазон по индексу last_activity_at — стоимость
+    пропорциональна числу бездействующих, а не всех студентов.
+    only_unnudged — только те, кому после последней активности ещё не напоминали.
+    """
+    where = _STALLED_WHERE
+    if only_unnudged:
+        where += " AND (s.nudged_at IS NULL OR s.nudged_at < s.last_activity_at)"
+    conn = get_connection()
+    rows = conn.execute(
+        f"""
+        SELECT s.user_id, s.username, s.first_name, s.last_name, s.selected_brief_index,
+               s.current_step_index, s.last_activity_at, s.nudged_at
+        FROM students s INDEXED BY idx_students_last_activity
+        {where}
+        ORDER BY s.last_activity_at
+        LIMIT ?
+        """,
+        (f"-{int(idle_days)} days", -1 if limit is None else limit),
+    ).fetchall()
+    conn.close()
+    keys = (
+        "user_id", "username", "first_name", "last_name", "selected_brief_index",
+        "current_step_index", "last_activity_at", "nudged_at",
+    )
+    return [dict(zip(keys, r)) for r in rows]
+
+
+@timed("db.count_stalled_students")
+def count_stalled_students(idle_days: int) -> int:
+    conn = get_connection()
+    n = conn.execute(
+        f"SELECT COUNT(*) FROM students s INDEXED BY idx_students_last_activity {_STALLED_WHERE}",
+        (f"-{int(idle_days)} days",),
+    ).fetchone()[0]
+    conn.close()
+    return n
+
+
+@timed("db.mark_nudged")
+def mark_nudged(user_ids: list[int]):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.executemany(
+                "UPDATE students SET nudged_at = datetime('now') WHERE user_id = ?", [(uid,) for uid in user_ids]
+            )
+    finally:
+        conn.close()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Выгрузка прогресса студентов в CSV (/export).
+
+Строки читаются из хранилища порциями (db.iter_export_rows) и сразу пишутся
+во временный файл — память постоянна при любом размере потока. Названия тем
+и шагов — из контента брифов, который собирает export_cmd: загруженные берутся
+из кэша, остальные догружаются из Notion (или бандла) без записи в кэш.
+"""
+import csv
+import os
+import tempfile
+import time
+
+from bot.database import EXPORT_COLUMNS
+from bot.metrics import timer
+from bot.models import Brief, BriefContent
+from bot.render import topic_only
+from bot.storage import db
+
+CSV_COLUMNS = EXPORT_COLUMNS + ("topic", "step_title", "steps_total", "checklist_total")
+
+
+def _brief_columns(briefs: list[Brief], contents: dict[str, BriefContent], brief_index, step_index) -> tuple:
+    """Тема, текущий шаг, число шагов и пунктов чеклиста по индексу брифа."""
+    if brief_index is None or not 0 <= brief_index < len(briefs):
+        return "", "", "", ""
+    brief = briefs[brief_index]
+    content = contents.get(brief.page_id)
+    topic = topic_only(brief.title or "")
+    if content is None:
+        return topic, "", "", ""
+    steps = content.steps
+    step_title = ""
+    if steps:
+        step_title = steps[step_index if step_index is not None and 0 <= step_index < len(steps) else 0].title
+    return topic, step_title, len(steps), len(content.checklist)
+
+
+def write_progress_csv(briefs: list[Brief], contents: dict[str, BriefContent], directory: str | None = None) -> tuple[str, int]:
+    """
+    Пишет выгрузку во временный CSV (UTF-8 с BOM — открывается в Excel).
+    Возвращает (путь, число строк); файл удаляет вызывающий.
+    """
+    fd, path = tempfile.mkstemp(prefix="vkr_export_", suffix=".csv", dir=directory)
+    rows = 0
+    try:
+        with timer("export.progress_csv"), os.fdopen(fd, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            for row in db.iter_export_rows():
+                writer.writerow(row + _brief_columns(briefs, contents, row[4], row[5]))
+                rows += 1
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, rows
+
+
+def export_filename() -> str:
+    return time.strftime("vkr_progress_%Y%m%d_%H%M.csv")
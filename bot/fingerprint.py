@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Пропуск повторных правок сообщения: отпечаток последнего отрисованного состояния.
+
+Для каждого сообщения (чат, message_id) хранится хэш текста и клавиатуры,
+которые бот туда последним записал. Если новая отрисовка совпадает, запрос
+edit_message_text не отправляется вовсе (Telegram всё равно ответил бы
+«message is not modified»). Кэш ограничен: вытесняются давно не правленные сообщения.
+"""
+from collections import OrderedDict
+from collections.abc import Hashable
+
+from telegram.error import BadRequest
+
+from bot.metrics import inc
+
+RENDER_CACHE_SIZE = 10_000
+
+
+def fingerprint(text: str, reply_markup=None) -> int:
+    return hash((text, reply_markup.to_json() if reply_markup is not None else None))
+
+
+class RenderCache:
+    def __init__(self, name: str, maxsize: int = RENDER_CACHE_SIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self._prints: OrderedDict[Hashable, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._prints)
+
+    def unchanged(self, key: Hashable, print_: int) -> bool:
+        if self._prints.get(key) != print_:
+            return False
+        self._prints.move_to_end(key)
+        return True
+
+    def remember(self, key: Hashable, print_: int):
+        self._prints[key] = print_
+        self._prints.move_to_end(key)
+        while len(self._prints) > self.maxsize:
+            self._prints.popitem(last=False)
+
+    def forget(self, key: Hashable):
+        self._prints.pop(key, None)
+
+    async def edit(self, query, key: Hashable, text: str, reply_markup=None) -> bool:
+        """query.edit_message_text, если содержимое отличается от последнего записанного; True — правка отправлена."""
+        print_ = fingerprint(text, reply_markup)
+        if self.unchanged(key, print_):
+            inc(f"{self.name}.skipped")
+            return False
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            if "not modified" in (e.message or "").lower():
+                self.remember(key, print_)
+            else:
+                self.forget(key)
+            raise
+        except Exception:
+            self.forget(key)
+            raise
+        self.remember(key, print_)
+        inc(f"{self.name}.sent")
+        return True
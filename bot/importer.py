@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Массовый импорт студентов и FAQ из CSV/JSON (CLI scripts/import_data.py и загрузка документа админом).
+
+Студенты: user_id, username, first_name, last_name, brief (индекс темы или её название).
+FAQ: id (необязательно), question, answer.
+CSV — с заголовком (разделитель , или ;), JSON — список объектов.
+Запись — одна транзакция с upsert (db.upsert_students / upsert_faq).
+"""
+import csv
+import io
+import json
+import time
+from dataclasses import dataclass
+
+from bot.storage import db
+
+KINDS = ("students", "faq")
+
+
+@dataclass(frozen=True, slots=True)
+class ImportResult:
+    kind: str
+    rows: int
+    skipped: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float(self.rows)
+
+    def summary(self) -> str:
+        text = f"Импорт {self.kind}: {self.rows} строк за {self.seconds * 1000:.0f} мс ({self.rate:,.0f} строк/с)"
+        if self.skipped:
+            text += f", пропущено некорректных: {self.skipped}"
+        return text
+
+
+def detect_kind(name: str) -> str | None:
+    """Тип импорта по подписи/имени файла: students или faq."""
+    lower = (name or "").lower()
+    if "faq" in lower:
+        return "faq"
+    if "student" in lower or "студент" in lower:
+        return "students"
+    return None
+
+
+def read_records(data: bytes | str, filename: str = "") -> list[dict]:
+    """CSV или JSON → список словарей (формат по расширению, иначе по первому символу)."""
+    text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+    stripped = text.lstrip()
+    if filename.lower().endswith(".json") or stripped[:1] in ("[", "{"):
+        payload = json.loads(text)
+        if isinstance(payload, dict):
+            payload = payload.get("items") or payload.get("rows") or []
+        return [r for r in payload if isinstance(r, dict)]
+    sample = text[:4096]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    return [{(k or "").strip().lower(): v for k, v in row.items()} for row in reader]
+
+
+def _clean(value) -> str | None:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _int_or_none(value) -> int | None:
+    value = _clean(value)
+    if value is None or not value.lstrip("-").isdigit():
+        return None
+    return int(value)
+
+
+def student_rows(records: list[dict], brief_lookup: dict[str, int] | None = None) -> tuple[list[tuple], int]:
+    """Строки для upsert_students и число пропущенных (нет числового user_id)."""
+    rows = []
+    skipped = 0
+    for r in records:
+        user_id = _int_or_none(r.get("user_id") or r.get("id") or r.get("telegram_id"))
+        if user_id is None:
+            skipped += 1
+            continue
+        raw_brief = r.get("brief", r.get("brief_index", r.get("selected_brief_index")))
+        brief_index = _int_or_none(raw_brief)
+        if brief_index is None and brief_lookup and _clean(raw_brief):
+            brief_index = brief_lookup.get(_clean(raw_brief).casefold())
+        username = _clean(r.get("username"))
+        rows.append((
+            user_id,
+            username.lstrip("@") if username else None,
+            _clean(r.get("first_name")),
+            _clean(r.get("last_name")),
+            brief_index,
+        ))
+    return rows, skipped
+
+
+def faq_rows(records: list[dict]) -> tuple[list[tuple], int]:
+    """Строки для upsert_faq и число пропущенных (нет вопроса или ответа)."""
+    rows = []
+    skipped = 0
+    for r in records:
+        question = _clean(r.get("question") or r.get("q"))
+        answer = _clean(r.get("answer") or r.get("a"))
+        if not question or not answer:
+            skipped += 1
+            continue
+        rows.append((_int_or_none(r.get("id")), question, answer))
+    return rows, skipped
+
+
+def import_data(
+    kind: str,
+    data: bytes | str,
+    filename: str = "",
+    brief_lookup: dict[str, int] | None = None,
+    created_by: int | None = None,
+) -> ImportResult:
+    """Разбор и запись одной транзакцией; время — разбор + запись."""
+    if kind not in KINDS:
+        raise ValueError(f"Неизвестный тип импорта: {kind} (ожидается students или faq)")
+    started = time.perf_counter()
+    records = read_records(data, filename)
+    if kind == "students":
+        rows, skipped = student_rows(records, brief_lookup)
+        db.upsert_students(rows)
+    else:
+        rows, skipped = faq_rows(records)
+        db.upsert_faq(rows, created_by)
+    return ImportResult(kind=kind, rows=len(rows), skipped=skipped, seconds=time.perf_counter() - started)
@@ -2,47 +2,64 @@
 """
 Telegram-бот ВКР: выбор темы из Notion, пошаговые брифы, чеклист, помощь.
 """
+import asyncio
 import os
 import logging
+import time as time_module
 from datetime import time
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 load_dotenv()
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
 
-from bot.database import (
-    init_db,
-    ensure_student,
-    set_selected_brief,
-    get_selected_brief,
-    clear_selected_brief,
-    clear_checklist_progress,
-    add_help_request,
-    get_help_requests,
-    set_checklist_item,
-    get_checklist_checked,
-    get_all_checklist_results,
-    get_all_students_with_progress,
-    set_current_step,
-    get_current_step,
-    mark_brief_done,
-    add_faq,
-    list_faq,
-)
+from bot.coalesce import Coalescer
+from bot.database import DIGEST_WATERMARK_KEY
+from bot.fingerprint import RenderCache
+from bot.bundle import load_bundle, load_bundle_page
+from bot.cache import ByteLRU, approx_size
+from bot.metrics import counter, inc, observe, start_http_server, summary_lines, timed, timer
+from bot.models import Brief, BriefBlocks, BriefContent, BriefDiff
 from bot.notion_client import (
+    NotionError,
     fetch_briefs,
-    fetch_brief_content,
+    fetch_brief_blocks,
+    fetch_brief_page,
     get_page_title,
     page_url,
+    parse_brief_blocks,
+)
+from bot.singleflight import SingleFlight
+from bot.storage import STORAGE_BACKEND, adb, db
+from bot.render import (
+    BriefRender,
+    TopicEntry,
+    back_keyboard,
+    build_topic_index,
+    checklist_message,
+    render_brief,
+    render_topic_pages,
+    search_topics,
+    topic_menu_message,
+    topic_only,
+    topic_picker,
 )
 
 logging.basicConfig(
@@ -58,100 +75,233 @@ ADMIN_IDS = set(int(x) for x in _ADMIN_IDS_RAW.split() if x.strip())
 REMINDER_HOUR = int(os.environ.get("VKR_REMINDER_HOUR", "11"))
 REMINDER_MINUTE = int(os.environ.get("VKR_REMINDER_MINUTE", "0"))
 REMINDER_TZ = os.environ.get("VKR_BOT_TZ", "Europe/Moscow")
-
-
-def get_briefs(context: ContextTypes.DEFAULT_TYPE):
-    """Кэш брифов в bot_data (обновляется при старте и по необходимости)."""
-    if "briefs" not in context.bot_data or not context.bot_data["briefs"]:
-        context.bot_data["briefs"] = fetch_briefs(NOTION_BRIEFS_PAGE_ID)
-    return context.bot_data["briefs"]
-
-
-def get_brief_content(context: ContextTypes.DEFAULT_TYPE, page_id: str):
-    """Контент страницы брифа (можно закэшировать по page_id в user_data или bot_data)."""
-    cache = context.bot_data.setdefault("brief_content", {})
-    if page_id not in cache:
-        cache[page_id] = fetch_brief_content(page_id)
+# Ночная сводка прогресса по дням (для /trend)
+ROLLUP_HOUR = int(os.environ.get("VKR_ROLLUP_HOUR", "3"))
+# Перенос старых данных в архивную базу — после сводок
+ARCHIVE_HOUR = int(os.environ.get("VKR_ARCHIVE_HOUR", "4"))
+# Онлайн-бэкап базы (сжатые снимки в VKR_BACKUP_DIR)
+BACKUP_HOUR = int(os.environ.get("VKR_BACKUP_HOUR", "5"))
+# Напоминание студентам без активности NUDGE_IDLE_DAYS дней (шаги, чеклист) — раз в день в NUDGE_HOUR
+NUDGE_HOUR = int(os.environ.get("VKR_NUDGE_HOUR", "12"))
+NUDGE_IDLE_DAYS = int(os.environ.get("VKR_NUDGE_IDLE_DAYS", "7"))
+# Сколько бездействующих перечислять в /stalled (остальные — числом)
+STALLED_LIST_MAX = 30
+TREND_DEFAULT_DAYS = 14
+TREND_MAX_DAYS = 90
+# Сколько новых заявок перечислять в утренней сводке (остальные — числом)
+DIGEST_MAX_ITEMS = 20
+# Заявок на странице /requests
+REQUESTS_PAGE_SIZE = 5
+STARTED_AT = time_module.time()
+FAQ_SEARCH_LIMIT = 10
+# Сколько апдейтов обрабатывать одновременно. По умолчанию 1 — строго по порядку, как до параллельной
+# обработки: обработчики читают и пишут user_data между await, и два быстрых нажатия одного
+# студента не должны перемешаться. Больше 1 — только осознанно (включается через env).
+CONCURRENT_UPDATES = int(os.environ.get("VKR_CONCURRENT_UPDATES", "1"))
+# Прогрев кэша брифов до начала polling (post_init)
+WARMUP_ENABLED = os.environ.get("VKR_WARMUP", "1").strip().lower() not in ("0", "false", "no", "")
+WARMUP_TIMEOUT = float(os.environ.get("VKR_WARMUP_TIMEOUT", "60"))
+WARMUP_CONCURRENCY = int(os.environ.get("VKR_WARMUP_CONCURRENCY", "3"))
+# Офлайн-бандл брифов (scripts/sync_notion_bundle.py): старт без обращения к Notion
+BRIEFS_BUNDLE = os.environ.get("VKR_BRIEFS_BUNDLE", "").strip()
+# Бюджет кэша контента брифов (МБ, приблизительно): сверх него вытесняются давно не открытые брифы
+BRIEF_CACHE_BYTES = int(float(os.environ.get("VKR_BRIEF_CACHE_MB", "64")) * 1024 * 1024)
+
+
+# Одна загрузка из Notion на ключ: параллельные запросы одной страницы ждут общий результат.
+_notion_flight = SingleFlight("notion_fetch")
+# Быстрые повторные нажатия chk:/step: в одном сообщении: одна отрисовка последнего состояния
+# (при параллельной обработке апдейтов; последовательно нажатия и так идут по одному).
+_press_coalescer = Coalescer("callback_press")
+# Неотрисованные отметки чеклиста: ((чат, сообщение), brief_index) → {item_index: completed}
+_checklist_pending: dict[tuple, dict[int, bool]] = {}
+# Отпечатки последней отрисовки сообщений: неизменившийся экран не отправляется в Telegram.
+_render_cache = RenderCache("edit")
+
+
+def _store_briefs(bot_data: dict, briefs: list[Brief]):
+    """Кладёт список брифов в bot_data вместе с производными (меню тем, индекс и страницы выбора)."""
+    bot_data["briefs"] = briefs
+    # Меню темы и страницы выбора темы зависят только от списка — рендерим вместе с ним.
+    bot_data["topic_menus"] = {
+        b.page_id: topic_menu_message(b, page_url(b.page_id)) for b in briefs if b.is_page
+    }
+    index = build_topic_index(briefs)
+    bot_data["topic_index"] = index
+    bot_data["topic_pages"] = render_topic_pages(index)
+
+
+def _store_brief_content(bot_data: dict, page_id: str, content: BriefContent, blocks: BriefBlocks | None = None):
+    """
+    Кладёт контент брифа в кэш вместе с пре-рендером и отпечатками блоков.
+    Если в кэше уже есть прежняя версия, экраны неизменившихся шагов переиспользуются.
+    """
+    cache = _content_cache(bot_data)
+    renders = bot_data.setdefault("brief_render", {})
+    previous = cache.get(page_id)
+    render = render_brief(content, page_url(page_id), renders.get(page_id), previous.steps if previous else ())
+    renders[page_id] = render
+    if blocks is not None:
+        bot_data.setdefault("brief_blocks", {})[page_id] = blocks
+    else:
+        bot_data.get("brief_blocks", {}).pop(page_id, None)
+    bot_data.setdefault("brief_loaded_at", {})[page_id] = time_module.time()
+    # В бюджет кэша идёт всё, что держится ради брифа: контент, экраны и отпечатки блоков
+    cache.put(page_id, content, approx_size((content, render, blocks)))
+
+
+def _content_cache(bot_data: dict) -> ByteLRU:
+    """
+    Кэш контента брифов (bot_data["brief_content"]): LRU с бюджетом BRIEF_CACHE_BYTES.
+    Вытесненный бриф уносит с собой рендер и отпечатки; при следующем обращении он
+    загружается заново (Notion или офлайн-бандл).
+    """
+    cache = bot_data.get("brief_content")
+    if cache is None:
+        def evict(page_id: str):
+            for key in ("brief_render", "brief_blocks", "brief_loaded_at"):
+                bot_data.get(key, {}).pop(page_id, None)
+
+        cache = bot_data["brief_content"] = ByteLRU("brief_cache", BRIEF_CACHE_BYTES, on_evict=evict)
+    return cache
+
+
+def _fetch_brief_page(page_id: str) -> tuple[BriefContent, BriefBlocks | None]:
+    """Контент брифа из Notion; без токена, но с бандлом — из офлайн-бандла (бриф, вытесненный из кэша)."""
+    if BRIEFS_BUNDLE and not os.environ.get("NOTION_TOKEN"):
+        return load_bundle_page(BRIEFS_BUNDLE, page_id)
+    return fetch_brief_page(page_id)
+
+
+async def load_briefs(bot_data: dict) -> list[Brief]:
+    """Список брифов из кэша или Notion (одна загрузка на все параллельные запросы)."""
+    if not bot_data.get("briefs"):
+        briefs = await _notion_flight.do("briefs", fetch_briefs, NOTION_BRIEFS_PAGE_ID)
+        if not bot_data.get("briefs"):
+            _store_briefs(bot_data, briefs)
+    return bot_data["briefs"]
+
+
+async def load_brief_content(bot_data: dict, page_id: str, count: bool = True) -> BriefContent:
+    """
+    Контент брифа из кэша или Notion / бандла (одна загрузка на page_id).
+    count=False — не учитывать обращение в brief_cache.hit/miss (повторное чтение
+    в том же нажатии, уже учтённое get_brief_render).
+    """
+    cache = _content_cache(bot_data)
+    if page_id in cache:
+        if count:
+            inc("brief_cache.hit")
+        return cache[page_id]
+    if count:
+        inc("brief_cache.miss")
+    content, blocks = await _notion_flight.do(("content", page_id), _fetch_brief_page, page_id)
+    if page_id not in cache:  # остальные ожидавшие уже получат готовое
+        _store_brief_content(bot_data, page_id, content, blocks)
     return cache[page_id]
 
 
-def _back_keyboard() -> InlineKeyboardMarkup:
-    """Кнопка «Назад» в меню раздела."""
-    return InlineKeyboardMarkup([[InlineKeyboardButton("◀ Назад", callback_data="menu_back")]])
-
-
-CHECKLIST_PAGE_SIZE = 5
-
-
-def _checklist_message(items: list, checked: set, url: str, brief_index: int, page: int = 0) -> tuple:
-    """Текст чеклиста и клавиатура: только неотмеченные, по 5 на страницу, без дублей по тексту."""
-    seen_text = set()
-    unchecked = []
-    for i in range(len(items)):
-        if i in checked:
-            continue
-        t = (items[i].get("text") or "").strip()
-        if not t or t in seen_text:
-            continue
-        seen_text.add(t)
-        unchecked.append(i)
-    total = len(items)
-    left = len(unchecked)
-    if left == 0:
-        text = f"Чеклист: все пункты отмечены.\n\nВсего было {total} пунктов.\n\nПодробнее в Notion: {url}"
-        return text, _back_keyboard()
-    total_pages = max(1, (left + CHECKLIST_PAGE_SIZE - 1) // CHECKLIST_PAGE_SIZE)
-    page = max(0, min(page, total_pages - 1))
-    start = page * CHECKLIST_PAGE_SIZE
-    page_indices = unchecked[start : start + CHECKLIST_PAGE_SIZE]
-    lines = [f"Чеклист (осталось {left} из {total}):\n"]
-    buttons = []
-    for num, i in enumerate(page_indices, 1):
-        line_text = (items[i].get("text") or "")[:55]
-        lines.append(f"☐ {num}. {line_text}")
-        buttons.append([InlineKeyboardButton(f"☐ {num}", callback_data=f"chk:{brief_index}:{i}")])
-    nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton("◀ Пред", callback_data=f"clpage:{brief_index}:{page - 1}"))
-    if page < total_pages - 1:
-        nav.append(InlineKeyboardButton("След ▶", callback_data=f"clpage:{brief_index}:{page + 1}"))
-    if nav:
-        buttons.append(nav)
-    buttons.append([InlineKeyboardButton("◀ Назад", callback_data="menu_back")])
-    text = "\n".join(lines) + f"\n\nПодробнее в Notion: {url}"
-    return text, InlineKeyboardMarkup(buttons)
-
-
-def _topic_menu_message(brief: dict, url: str) -> tuple:
-    """Текст и клавиатура меню выбранной темы (для start и callback)."""
-    title = _topic_only(brief.get("title", "Бриф"))
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("📄 Открыть бриф в Notion", url=url)],
-        [
-            InlineKeyboardButton("✅ Чеклист", callback_data="menu:checklist"),
-            InlineKeyboardButton("🖥 Окружение", callback_data="menu:environment"),
-        ],
-        [
-            InlineKeyboardButton("📦 Продукт", callback_data="menu:product"),
-            InlineKeyboardButton("📋 Шаги по порядку", callback_data="menu:steps"),
-        ],
-        [
-            InlineKeyboardButton("🆘 Нужна помощь", callback_data="menu:help"),
-            InlineKeyboardButton("📅 Нужен прогон/встреча", callback_data="menu:meeting"),
-        ],
-        [InlineKeyboardButton("❓ FAQ", callback_data="menu:faq")],
-    ])
-    return f"Тема: {title}\n\nВыберите раздел или откройте бриф в Notion:", keyboard
-
-
-def _topic_only(title: str) -> str:
-    """Убирает префикс 'Бриф для студента: ', оставляет только тему."""
-    if not title:
-        return title
-    prefix = "Бриф для студента: "
-    return title[len(prefix):].strip() if title.startswith(prefix) else title
+async def peek_brief_content(bot_data: dict, page_id: str) -> BriefContent:
+    """
+    Контент брифа для разовых чтений (выгрузка): из кэша — без отметки об использовании,
+    недостающий — загрузка без записи в кэш, чтобы не вытеснить брифы, открытые студентами.
+    """
+    cached = _content_cache(bot_data).peek(page_id)
+    if cached is not None:
+        return cached
+    content, _ = await _notion_flight.do(("content", page_id), _fetch_brief_page, page_id)
+    return content
+
+
+async def refresh_brief_content(bot_data: dict, page_id: str) -> BriefDiff | None:
+    """
+    Перечитывает страницу брифа и обновляет кэш на месте: перепарсиваются и
+    перерисовываются только шаги и пункты с изменившимися блоками.
+    Возвращает изменения; None — прежней версии с отпечатками не было (разобран целиком).
+    Если страницу не удалось прочитать целиком (NotionError) или она пришла пустой,
+    кэш не трогается — остаётся прежняя версия.
+    """
+    blocks = await _notion_flight.do(("blocks", page_id), fetch_brief_blocks, page_id, None, True)
+    if not blocks:
+        raise NotionError(f"страница {page_id} пуста")
+    previous = bot_data.get("brief_content", {}).get(page_id)
+    content, hashes, diff = parse_brief_blocks(blocks, previous, bot_data.get("brief_blocks", {}).get(page_id))
+    _store_brief_content(bot_data, page_id, content, hashes)
+    return diff
+
+
+async def get_briefs(context: ContextTypes.DEFAULT_TYPE) -> list[Brief]:
+    """Кэш брифов в bot_data (обновляется при старте и по необходимости)."""
+    return await load_briefs(context.bot_data)
+
+
+async def get_topic_index(context: ContextTypes.DEFAULT_TYPE) -> tuple[TopicEntry, ...]:
+    """Индекс тем для выбора и поиска (строится вместе со списком брифов)."""
+    await get_briefs(context)
+    return context.bot_data.get("topic_index", ())
+
+
+async def get_topic_page(context: ContextTypes.DEFAULT_TYPE, page: int) -> tuple:
+    """Готовая страница полного списка тем (text, keyboard)."""
+    await get_briefs(context)
+    pages = context.bot_data.get("topic_pages") or ()
+    if not pages:
+        return topic_picker([], 0)
+    return pages[max(0, min(page, len(pages) - 1))]
+
+
+async def _topic_search_message(context: ContextTypes.DEFAULT_TYPE, query: str, page: int = 0) -> tuple:
+    """Результаты поиска темы (text, keyboard); пусто — подсказка и снова поиск."""
+    found = search_topics(await get_topic_index(context), query)
+    if not found:
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔍 Найти тему", callback_data="topics_search")],
+            [InlineKeyboardButton("Все темы", callback_data="topics:0")],
+        ])
+        return f"Темы по запросу «{query}» не найдены.", keyboard
+    return topic_picker(found, page, header=f"Темы по запросу «{query}»:", nav_prefix="topicsq")
+
+
+def get_topic_menu(context: ContextTypes.DEFAULT_TYPE, brief: Brief) -> tuple:
+    """Готовые (text, keyboard) меню темы."""
+    menus = context.bot_data.setdefault("topic_menus", {})
+    if brief.page_id not in menus:
+        menus[brief.page_id] = topic_menu_message(brief, page_url(brief.page_id))
+    return menus[brief.page_id]
+
+
+async def get_brief_content(context: ContextTypes.DEFAULT_TYPE, page_id: str, count: bool = True) -> BriefContent:
+    """Контент страницы брифа (кэш по page_id в bot_data, вместе с пре-рендером); count — как в load_brief_content."""
+    return await load_brief_content(context.bot_data, page_id, count)
+
+
+async def get_brief_render(context: ContextTypes.DEFAULT_TYPE, page_id: str) -> BriefRender:
+    """
+    Пре-рендеренные экраны брифа; строятся при загрузке контента.
+    Одно обращение — один hit или miss в brief_cache (промах считает загрузка контента).
+    """
+    renders = context.bot_data.setdefault("brief_render", {})
+    if page_id in renders:
+        inc("brief_cache.hit")
+        return renders[page_id]
+    content = await get_brief_content(context, page_id)  # загрузка контента рендерит бриф
+    return renders.setdefault(page_id, render_brief(content, page_url(page_id)))
+
+
+def invalidate_briefs(bot_data: dict, page_id: str | None = None):
+    """Сбрасывает кэш контента брифа вместе с его рендером (page_id=None — все брифы и список тем)."""
+    if page_id is None:
+        for key in (
+            "briefs", "topic_menus", "topic_index", "topic_pages",
+            "brief_content", "brief_render", "brief_blocks", "brief_loaded_at",
+        ):
+            bot_data.pop(key, None)
+        return
+    for key in ("brief_content", "brief_render", "brief_blocks", "brief_loaded_at"):
+        bot_data.get(key, {}).pop(page_id, None)
 
 
+@timed("cmd.reset")
 async def reset_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для админа: сбросить выбранную тему студента. /reset <telegram_id>"""
     user = update.effective_user
@@ -161,14 +311,14 @@ async def reset_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = (context.args or [])
     if args and args[0].strip().lstrip("-").isdigit():
         target_id = int(args[0].strip())
-        clear_selected_brief(target_id)
-        n = clear_checklist_progress(target_id)
+        await adb.clear_selected_brief(target_id)
+        n = await adb.clear_checklist_progress(target_id)
         logger.info("Reset пользователя %s: тема и чеклист сброшены (удалено записей чеклиста: %s)", target_id, n)
         await update.message.reply_text(
             f"Тема и чеклист сброшены для пользователя {target_id}. При следующем /start он снова выберет тему."
         )
         return
-    rows = get_all_students_with_progress()
+    rows = await adb.get_all_students_with_progress()
     lines = ["Использование: /reset <telegram_id>\n\nСтуденты (ID — имя):"]
     for r in rows:
         name = f"{r['first_name'] or ''} {r['last_name'] or ''}".strip() or (r["username"] or "—")
@@ -176,29 +326,219 @@ async def reset_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("\n".join(lines) if len(lines) > 1 else "Использование: /reset <telegram_id>\n\nСтудентов пока нет.")
 
 
-def _format_faq() -> str:
-    rows = list_faq()
+# Сколько брифов с изменениями перечислять в ответе /refresh
+REFRESH_REPORT_MAX = 30
+
+
+@timed("cmd.refresh")
+async def refresh_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Команда для админа: перечитать брифы из Notion или бандла.
+    Список тем загружается заново; у уже загруженных брифов перепарсиваются только
+    изменившиеся шаги и пункты чеклиста — в ответе перечислено, что изменилось.
+    """
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Недоступно.")
+        return
+    bot_data = context.bot_data
+    if not os.environ.get("NOTION_TOKEN") and BRIEFS_BUNDLE:
+        # Без доступа к Notion «обновление» — перечитать бандл
+        load_bundle_into(bot_data)
+        briefs = await get_briefs(context)
+        topics = sum(1 for b in briefs if b.is_page)
+        logger.info("Кэш брифов перечитан из бандла админом %s, тем: %s", user.id, topics)
+        await update.message.reply_text(f"Кэш брифов перечитан из бандла. Тем загружено: {topics}.")
+        return
+
+    with timer("refresh.briefs"):
+        # Прежний список и контент остаются в кэше, пока новый не прочитан целиком
+        try:
+            briefs = await _notion_flight.do(("briefs", "strict"), fetch_briefs, NOTION_BRIEFS_PAGE_ID, None, True)
+        except NotionError as e:
+            briefs = []
+            logger.warning("Обновление брифов: список тем не прочитан: %s", e)
+        if not briefs:
+            await update.message.reply_text(
+                "Не удалось прочитать список тем из Notion — оставлены прежние брифы. Попробуйте позже."
+            )
+            return
+        _store_briefs(bot_data, briefs)
+        titles = {b.page_id: topic_only(b.title) for b in briefs if b.is_page}
+        loaded = list(bot_data.get("brief_content", {}))
+        for page_id in loaded:
+            if page_id not in titles:
+                invalidate_briefs(bot_data, page_id)
+        targets = [pid for pid in loaded if pid in titles]
+        sem = asyncio.Semaphore(WARMUP_CONCURRENCY)
+
+        async def refresh_one(page_id: str) -> BriefDiff | NotionError | None:
+            async with sem:
+                try:
+                    return await refresh_brief_content(bot_data, page_id)
+                except NotionError as e:
+                    logger.warning("Обновление брифа %s не удалось, оставлена прежняя версия: %s", page_id, e)
+                    return e
+
+        diffs = await asyncio.gather(*(refresh_one(pid) for pid in targets))
+
+    lines = []
+    failed = 0
+    for page_id, diff in zip(targets, diffs):
+        if isinstance(diff, NotionError):
+            failed += 1
+            lines.append(f"• {titles[page_id]}: не прочитан из Notion, оставлена прежняя версия")
+        elif diff is None:
+            lines.append(f"• {titles[page_id]}: разобран целиком (не было отпечатков блоков)")
+        elif diff.changed:
+            lines.append(f"• {titles[page_id]}: {diff.summary()}")
+    changed = len(lines) - failed
+    logger.info(
+        "Брифы обновлены админом %s: тем %s, проверено %s, изменилось %s, с ошибкой %s",
+        user.id, len(titles), len(targets), changed, failed,
+    )
+    text = f"Брифы обновлены. Тем загружено: {len(titles)}. Проверено брифов: {len(targets)}, изменилось: {changed}."
+    if failed:
+        text += f" Не прочитано: {failed}."
+    if lines:
+        shown = lines[:REFRESH_REPORT_MAX]
+        if len(lines) > len(shown):
+            shown.append(f"… и ещё {len(lines) - len(shown)}")
+        text += "\n\n" + "\n".join(shown)
+    await update.message.reply_text(text[:4000])
+
+
+FAQ_MESSAGE_MAX = 3800
+
+
+async def _format_faq() -> str:
+    """Полный список FAQ (запасной вариант, когда нет поискового запроса)."""
+    rows = await adb.list_faq()
     if not rows:
         return "FAQ пока пуст.\n\nЗадайте вопросы куратору — он добавит сюда ответы."
     lines = ["FAQ:\n"]
+    size = 0
+    shown = 0
     for idx, r in enumerate(rows, 1):
         q = (r["question"] or "").strip()
         a = (r["answer"] or "").strip()
         if not q and not a:
             continue
-        lines.append(f"{idx}. {q}")
-        if a:
-            lines.append(f"   {a}")
-        lines.append("")  # пустая строка между ответами
+        entry = f"{idx}. {q}\n" + (f"   {a}\n" if a else "")
+        if size + len(entry) > FAQ_MESSAGE_MAX:
+            break
+        lines.append(entry)  # пустая строка между ответами — из "\n".join
+        size += len(entry)
+        shown += 1
+    total = await adb.count_faq()
+    if total > shown:
+        lines.append(f"Показано {shown} из {total}. Поиск: /faq <запрос> или @бот <запрос> в любом чате.")
     return "\n".join(lines).rstrip()
 
 
+async def _format_faq_search(query: str) -> str:
+    """Результаты поиска по FAQ: вопрос и фрагмент ответа с подсветкой «совпадений»."""
+    rows = await adb.search_faq(query, limit=FAQ_SEARCH_LIMIT)
+    if not rows:
+        return f"По запросу «{query}» ничего не найдено.\n\nПолный список: /faq"
+    lines = [f"FAQ — найдено по запросу «{query}»:\n"]
+    for r in rows:
+        lines.append(f"#{r['id']}. {(r['question'] or '').strip()}")
+        lines.append(f"   {(r['snippet'] or '').strip()}\n")
+    return "\n".join(lines).rstrip()[:FAQ_MESSAGE_MAX]
+
+
+@timed("cmd.stats")
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для админа: кэш брифов, заявки, БД, очередь апдейтов и задержки по стадиям."""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Недоступно.")
+        return
+    await update.message.reply_text((await _format_stats(context))[:4000])
+
+
+async def _format_stats(context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Сводка /stats только из счётчиков в памяти и stat() файлов БД — без запросов к таблицам."""
+    now = time_module.time()
+    bot_data = context.bot_data
+    loaded_at = bot_data.get("brief_loaded_at", {})
+    ages = [now - t for t in loaded_at.values()]
+    hits, misses = counter("brief_cache.hit"), counter("brief_cache.miss")
+    cache = bot_data.get("brief_content")
+    cache_bytes = cache.bytes if isinstance(cache, ByteLRU) else 0
+    hit_rate = f"{hits / (hits + misses) * 100:.0f}%" if hits + misses else "—"
+    sizes = await adb.db_file_sizes()
+    app = context.application
+    lines = [
+        "📊 Состояние бота",
+        "",
+        f"Аптайм: {_format_age(now - STARTED_AT)}",
+        f"Темы: {len(bot_data.get('briefs') or [])}",
+        f"Кэш брифов: {len(cache or ())} записей, {cache_bytes / 1024:.0f} из {BRIEF_CACHE_BYTES / 1024:.0f} КБ, "
+        f"hit {hits} / miss {misses} ({hit_rate}), вытеснено {counter('brief_cache.evicted')}",
+    ]
+    if ages:
+        lines.append(f"Возраст записей: мин {_format_age(min(ages))}, макс {_format_age(max(ages))}")
+    lines += [
+        f"Открытых заявок: {await adb.pending_help_count()}",
+        f"БД ({STORAGE_BACKEND}): {sizes['db'] / 1024:.0f} КБ, WAL {sizes['wal'] / 1024:.0f} КБ",
+        f"Очередь апдейтов: {app.update_queue.qsize()}, обработано: {counter('updates')}",
+    ]
+    latency = summary_lines()
+    if latency:
+        lines += ["", "Задержки (p50/p99 по корзинам):"] + latency
+    return "\n".join(lines)
+
+
+def _format_age(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    return f"{seconds // 86400} д {seconds % 86400 // 3600} ч"
+
+
+async def _count_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Счётчик всех входящих апдейтов (группа -1, не мешает остальным обработчикам)."""
+    inc("updates")
+
+
+@timed("cmd.faq")
 async def faq_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать FAQ всем пользователям."""
-    text = _format_faq()
+    """Показать FAQ всем пользователям; /faq <запрос> — полнотекстовый поиск."""
+    query = " ".join(context.args or []).strip()
+    text = await _format_faq_search(query) if query else await _format_faq()
     await update.message.reply_text(text)
 
 
+@timed("inline.faq")
+async def inline_faq(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-режим: @бот <запрос> — ранжированные ответы из FAQ."""
+    inline_query = update.inline_query
+    query = (inline_query.query or "").strip()
+    if query:
+        rows = await adb.search_faq(query, limit=FAQ_SEARCH_LIMIT)
+    else:
+        rows = [dict(r, snippet=r["answer"]) for r in await adb.list_faq(limit=FAQ_SEARCH_LIMIT)]
+    results = [
+        InlineQueryResultArticle(
+            id=str(r["id"]),
+            title=(r["question"] or "").strip()[:100] or f"FAQ #{r['id']}",
+            description=(r["snippet"] or "").strip()[:200],
+            input_message_content=InputTextMessageContent(
+                f"❓ {(r['question'] or '').strip()}\n\n{(r['answer'] or '').strip()}"[:4096]
+            ),
+        )
+        for r in rows
+    ]
+    await inline_query.answer(results, cache_time=60)
+
+
+@timed("cmd.addfaq")
 async def addfaq_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для админа: добавить запись в FAQ (диалог вопрос/ответ)."""
     user = update.effective_user
@@ -214,39 +554,94 @@ async def addfaq_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # лимит Bot API на скачивание файла
+
+
+@timed("cmd.import")
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Админ присылает CSV/JSON с подписью students или faq — массовый импорт одной транзакцией."""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        return
+    from bot.importer import detect_kind, import_data  # админский путь — не грузим при старте
+
+    doc = update.message.document
+    kind = detect_kind(update.message.caption or "") or detect_kind(doc.file_name or "")
+    if not kind:
+        await update.message.reply_text(
+            "Не понял, что импортировать. Добавьте подпись students или faq (или назовите файл students.csv / faq.json)."
+        )
+        return
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text("Файл слишком большой (больше 20 МБ).")
+        return
+    file = await doc.get_file()
+    data = bytes(await file.download_as_bytearray())
+    brief_lookup = None
+    if kind == "students":
+        brief_lookup = {e.key: e.brief_index for e in await get_topic_index(context)}
+    try:
+        # Разбор и запись — в пуле потоков, цикл событий продолжает обслуживать студентов
+        result = await asyncio.to_thread(import_data, kind, data, doc.file_name or "", brief_lookup, user.id)
+    except (ValueError, UnicodeDecodeError) as e:
+        await update.message.reply_text(f"Не удалось разобрать файл: {e}")
+        return
+    logger.info(result.summary())
+    await update.message.reply_text(result.summary())
+
+
+HELP_KIND_LABELS = {"help": "Нужна помощь", "meeting": "Нужен прогон/встреча"}
+
+
+@timed("job.morning_reminder")
 async def morning_reminder_job(context: ContextTypes.DEFAULT_TYPE):
-    """Ежедневное напоминание админам о необработанных заявках (помощь / встреча)."""
-    requests = get_help_requests(resolved=False)
-    if not requests:
-        return
-    kind_labels = {"help": "Нужна помощь", "meeting": "Нужен прогон/встреча"}
-    lines = ["📋 Необработанные заявки:\n"]
-    for r in requests:
-        kind = kind_labels.get(r["kind"], r["kind"])
-        who = f"{r['first_name'] or ''} {r['last_name'] or ''}".strip() or (r["username"] or "—")
-        lines.append(f"• {kind} — {who} (@{r['username'] or '—'}), ID {r['user_id']}")
-        if r.get("comment"):
-            lines.append(f"  «{r['comment'][:200]}{'…' if len(r.get('comment', '')) > 200 else ''}»")
-        lines.append(f"  {r['created_at']}")
-    text = "\n".join(lines)
+    """Ежедневная сводка админам: новые заявки с прошлой сводки и счётчик старых необработанных."""
+    digest = await adb.get_help_digest(DIGEST_MAX_ITEMS)
+    new = digest["new"]
+    older_total = sum(digest["older"].values())
+    if not new and not older_total:
+        return
+    kind_labels = HELP_KIND_LABELS
+    lines = []
+    if new:
+        lines.append(f"📋 Новые заявки ({digest['new_total']}):\n")
+        for r in new:
+            kind = kind_labels.get(r["kind"], r["kind"])
+            who = f"{r['first_name'] or ''} {r['last_name'] or ''}".strip() or (r["username"] or "—")
+            lines.append(f"• {kind} — {who} (@{r['username'] or '—'}), ID {r['user_id']}")
+            if r.get("comment"):
+                lines.append(f"  «{r['comment'][:200]}{'…' if len(r.get('comment', '')) > 200 else ''}»")
+            lines.append(f"  {r['created_at']}")
+        if digest["new_total"] > len(new):
+            lines.append(f"\n…и ещё {digest['new_total'] - len(new)} новых")
+    if older_total:
+        parts = ", ".join(f"{kind_labels.get(k, k)}: {n}" for k, n in sorted(digest["older"].items()))
+        lines.append(f"\nРанее не обработано: {older_total} ({parts}), самая старая от {digest['oldest_at']}")
+    text = "\n".join(lines).lstrip("\n")
+    sent = False
     for admin_id in ADMIN_IDS:
         try:
             await context.bot.send_message(chat_id=admin_id, text=text)
+            sent = True
         except Exception as e:
             logger.warning("Утреннее напоминание админу %s: %s", admin_id, e)
+    # Водяной знак двигаем, только если сводка кому-то дошла — иначе новые заявки покажем завтра
+    if sent:
+        await adb.set_meta(DIGEST_WATERMARK_KEY, digest["watermark"])
 
 
+@timed("cmd.progress")
 async def progress_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для админа: прогресс по чеклистам студентов."""
     user = update.effective_user
     if user.id not in ADMIN_IDS:
         await update.message.reply_text("Недоступно.")
         return
-    rows = get_all_students_with_progress()
+    rows = await adb.get_all_students_with_progress()
     if not rows:
         await update.message.reply_text("Студентов пока нет.")
         return
-    briefs = get_briefs(context)
+    briefs = await get_briefs(context)
     lines = ["Статус студентов:\n"]
     for r in rows:
         name = f"{r['first_name'] or ''} {r['last_name'] or ''}".strip() or (r["username"] or "—")
@@ -259,10 +654,10 @@ async def progress_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             continue
 
         brief = briefs[bidx]
-        title = _topic_only(brief.get("title", "Бриф"))[:60]
-        content = get_brief_content(context, brief["page_id"])
-        steps = content.get("steps", []) or []
-        checklist = content.get("checklist", []) or []
+        title = topic_only(brief.title or "Бриф")[:60]
+        content = await get_brief_content(context, brief.page_id)
+        steps = content.steps
+        checklist = content.checklist
 
         steps_total = len(steps)
         if steps_total:
@@ -271,14 +666,14 @@ async def progress_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 step_idx = cur_step
             step_num = step_idx + 1
-            step_title = steps[step_idx].get("title", "")[:60]
+            step_title = steps[step_idx].title[:60]
             step_part = f"шаг {step_num}/{steps_total}: {step_title}"
         else:
             step_part = "шаги не заданы в брифе"
 
         total_cl = len(checklist)
         if total_cl:
-            done_cl = len(get_checklist_checked(r["user_id"], bidx))
+            done_cl = len(await adb.get_checklist_checked(r["user_id"], bidx))
             cl_part = f"чеклист {done_cl}/{total_cl}"
         else:
             cl_part = "чеклист отсутствует"
@@ -287,6 +682,291 @@ async def progress_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("\n".join(lines))
 
 
+@timed("cmd.export")
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для админа: выгрузка прогресса всех студентов в CSV-документ."""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Недоступно.")
+        return
+    briefs = await get_briefs(context)
+    # Контент тем для названий шагов: загруженные — из кэша, остальные — из Notion/бандла без записи
+    # в кэш (выгрузка не вытесняет брифы студентов); ошибки загрузки не мешают выгрузке.
+    pages = list(dict.fromkeys(b.page_id for b in briefs if b.is_page))
+    sem = asyncio.Semaphore(WARMUP_CONCURRENCY)
+
+    async def load(page_id: str) -> BriefContent:
+        async with sem:
+            return await peek_brief_content(context.bot_data, page_id)
+
+    loaded = await asyncio.gather(*(load(pid) for pid in pages), return_exceptions=True)
+    contents = {pid: c for pid, c in zip(pages, loaded) if isinstance(c, BriefContent)}
+    from bot.export import export_filename, write_progress_csv  # админский путь — не грузим при старте
+
+    path, rows = await asyncio.to_thread(write_progress_csv, briefs, contents)
+    try:
+        if not rows:
+            await update.message.reply_text("Студентов пока нет.")
+            return
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f, filename=export_filename(), caption=f"Прогресс студентов: {rows} строк"
+            )
+    finally:
+        os.unlink(path)
+
+
+@timed("job.rollup_progress")
+async def rollup_progress_job(context: ContextTypes.DEFAULT_TYPE):
+    """Ночью: новые отметки шагов, чеклиста и завершения брифов — в дневные сводки."""
+    added = await asyncio.to_thread(db.rollup_progress)
+    logger.info("Дневные сводки обновлены: %s", added)
+
+
+@timed("job.archive")
+async def archive_job(context: ContextTypes.DEFAULT_TYPE):
+    """Ночью: закрытые заявки, журнал шагов и чеклисты прошлых потоков — в архив, освобождённые страницы — файлу."""
+    from bot.retention import archive_old_data
+
+    moved = await asyncio.to_thread(archive_old_data)
+    logger.info("Архивация: %s", moved)
+
+
+@timed("job.backup")
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    """Ежедневный снимок базы (в пуле потоков — цикл событий и запись студентов не ждут)."""
+    from bot.backup import backup_db
+
+    try:
+        path = await asyncio.to_thread(backup_db)
+    except Exception as e:
+        logger.error("Бэкап базы не удался: %s", e)
+        return
+    logger.info("Бэкап базы: %s (%.1f КБ)", path, os.path.getsize(path) / 1024)
+
+
+def _broadcast_report(bot, created_by: int | None):
+    """Корутина on_done рассылки: итог — автору (или всем админам, если автор неизвестен)."""
+    async def report(broadcast_id: int, counts: dict[str, int]):
+        from bot.broadcast import counts_summary
+
+        for admin_id in ([created_by] if created_by else ADMIN_IDS):
+            try:
+                await bot.send_message(chat_id=admin_id, text=f"Рассылка #{broadcast_id} завершена: {counts_summary(counts)}.")
+            except Exception as e:
+                logger.warning("Итог рассылки %s админу %s: %s", broadcast_id, admin_id, e)
+    return report
+
+
+@timed("cmd.broadcast")
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для админа: /broadcast <текст> — сообщение всем студентам; без текста — последние рассылки."""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Недоступно.")
+        return
+    from bot.broadcast import BROADCAST_RPS, counts_summary, start_broadcast  # админский путь
+
+    parts = (update.message.text or "").split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    if not text:
+        lines = ["Использование: /broadcast <текст> — сообщение всем студентам."]
+        recent = await adb.list_broadcasts(5)
+        if recent:
+            lines.append("\nПоследние рассылки:")
+        for b in recent:
+            state = "завершена" if b["finished_at"] else "идёт"
+            preview = b["text"][:60] + ("…" if len(b["text"]) > 60 else "")
+            lines.append(f"#{b['id']} от {b['created_at']} ({state}): {counts_summary(b['counts'])}\n  «{preview}»")
+        await update.message.reply_text("\n".join(lines))
+        return
+    if len(text) > 4096:
+        await update.message.reply_text(f"Слишком длинный текст: {len(text)} символов (лимит Telegram — 4096).")
+        return
+    broadcast_id, recipients = await adb.create_broadcast(text, user.id)
+    if not recipients:
+        await adb.finish_broadcast(broadcast_id)
+        await update.message.reply_text("Студентов пока нет — рассылать некому.")
+        return
+    start_broadcast(context.application, broadcast_id, text, on_done=_broadcast_report(context.bot, user.id))
+    logger.info("Рассылка %s запущена админом %s: получателей %s", broadcast_id, user.id, recipients)
+    eta = recipients / BROADCAST_RPS if BROADCAST_RPS > 0 else 0
+    await update.message.reply_text(
+        f"Рассылка #{broadcast_id} запущена: получателей {recipients} (≈{eta:.0f} с). Итог пришлю по завершении."
+    )
+
+
+async def resume_broadcasts_job(context: ContextTypes.DEFAULT_TYPE):
+    """После старта: досылка рассылок, прерванных перезапуском, с того же места."""
+    unfinished = await adb.get_unfinished_broadcasts()
+    if not unfinished:
+        return
+    from bot.broadcast import start_broadcast
+
+    for b in unfinished:
+        if start_broadcast(
+            context.application, b["id"], b["text"], on_done=_broadcast_report(context.bot, b["created_by"]), resume=True
+        ):
+            logger.info("Рассылка %s от %s возобновлена после перезапуска", b["id"], b["created_at"])
+
+
+def _nudge_text(student: dict) -> str:
+    if student["selected_brief_index"] is None:
+        return "Вы ещё не выбрали тему ВКР. Выбрать тему: /start"
+    step = student["current_step_index"]
+    where = f" (шаг {step + 1})" if step is not None else ""
+    return (
+        f"Давно не виделись! Последняя активность по брифу — {student['last_activity_at'][:10]}{where}.\n"
+        "Продолжить с того места, где остановились: /start"
+    )
+
+
+@timed("job.nudge_stalled")
+async def nudge_stalled_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Ежедневно: напоминание студентам без активности NUDGE_IDLE_DAYS дней — одно на период
+    бездействия (nudged_at отмечается сразу после отправки, перезапуск не повторит напоминание).
+    """
+    stalled = await adb.get_stalled_students(NUDGE_IDLE_DAYS, only_unnudged=True)
+    if not stalled:
+        return
+    from bot.broadcast import deliver  # темп — общий с рассылками
+
+    counts: dict[str, int] = {}
+    for student in stalled:
+        status, _ = await deliver(context.bot, student["user_id"], _nudge_text(student))
+        await adb.mark_nudged([student["user_id"]])
+        counts[status] = counts.get(status, 0) + 1
+        inc(f"nudge.{status}")
+    logger.info("Напоминания бездействующим (%s+ дн.): %s", NUDGE_IDLE_DAYS, counts)
+
+
+@timed("cmd.stalled")
+async def stalled_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для админа: /stalled [дней] — студенты без активности (давно бездействующие первыми)."""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Недоступно.")
+        return
+    args = context.args or []
+    days = int(args[0]) if args and args[0].isdigit() else NUDGE_IDLE_DAYS
+    total = await adb.count_stalled_students(days)
+    if not total:
+        await update.message.reply_text(f"Студентов без активности больше {days} дн. нет.")
+        return
+    rows = await adb.get_stalled_students(days, limit=STALLED_LIST_MAX)
+    briefs = context.bot_data.get("briefs") or []
+    lines = [f"Без активности больше {days} дн.: {total}\n"]
+    for r in rows:
+        who = f"{r['first_name'] or ''} {r['last_name'] or ''}".strip() or (r["username"] or "—")
+        bidx = r["selected_brief_index"]
+        if bidx is None:
+            topic = "тема не выбрана"
+        else:
+            topic = topic_only(briefs[bidx].title)[:40] if 0 <= bidx < len(briefs) else f"тема #{bidx}"
+            if r["current_step_index"] is not None:
+                topic += f", шаг {r['current_step_index'] + 1}"
+        nudged = r["nudged_at"] and r["nudged_at"] >= r["last_activity_at"]
+        lines.append(
+            f"• {who} (@{r['username'] or '—'}), ID {r['user_id']} — с {r['last_activity_at'][:10]}; {topic}"
+            + ("; напомнили" if nudged else "")
+        )
+    if total > len(rows):
+        lines.append(f"\n…и ещё {total - len(rows)}")
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+
+@timed("cmd.trend")
+async def trend_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для админа: динамика по дням из сводок (/trend [дней])."""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Недоступно.")
+        return
+    days = TREND_DEFAULT_DAYS
+    if context.args and context.args[0].isdigit():
+        days = max(1, min(TREND_MAX_DAYS, int(context.args[0])))
+    by_day, by_brief = await adb.get_trend(days)
+    if not by_day:
+        await update.message.reply_text(f"За {days} дн. данных в сводках нет (сводки обновляются ночью).")
+        return
+    lines = [f"Динамика за {days} дн. по {REMINDER_TZ} (шаги / отметки чеклиста / брифы завершены):\n"]
+    for r in by_day:
+        lines.append(f"{r['day']}: {r['steps_reached']} / {r['checklist_done']} / {r['briefs_done']}")
+    briefs = await get_briefs(context)
+    lines.append("\nПо темам:")
+    for r in by_brief[:10]:
+        bidx = r["brief_index"]
+        title = topic_only(briefs[bidx].title)[:50] if 0 <= bidx < len(briefs) else f"#{bidx}"
+        lines.append(f"• {title}: {r['steps_reached']} / {r['checklist_done']} / {r['briefs_done']}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def _requests_page(after_id: int = 0) -> tuple:
+    """Страница очереди открытых заявок (text, keyboard); after_id — последняя заявка предыдущей страницы."""
+    rows, has_more = await adb.get_open_help_requests_page(after_id, REQUESTS_PAGE_SIZE)
+    pending = await adb.pending_help_count()
+    if not rows:
+        text = "Открытых заявок нет." if not pending else f"На этой странице пусто. Открытых заявок: {pending}."
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 В начало", callback_data="rqp:0")]]) if pending else None
+        return text, keyboard
+    lines = [f"Открытые заявки ({pending}):\n"]
+    buttons = []
+    for num, r in enumerate(rows, 1):
+        kind = HELP_KIND_LABELS.get(r["kind"], r["kind"])
+        who = f"{r['first_name'] or ''} {r['last_name'] or ''}".strip() or (r["username"] or "—")
+        lines.append(f"{num}. {kind} — {who} (@{r['username'] or '—'}), {r['created_at']}")
+        if r.get("comment"):
+            lines.append(f"   «{r['comment'][:200]}{'…' if len(r['comment']) > 200 else ''}»")
+        # after_id в кнопках — чтобы после закрытия перерисовать ту же страницу
+        buttons.append([
+            InlineKeyboardButton(f"✅ {num}", callback_data=f"rqr:{r['id']}:{after_id}"),
+            InlineKeyboardButton(f"✅ Все от {num}", callback_data=f"rqa:{r['user_id']}:{after_id}"),
+        ])
+    nav = []
+    if after_id:
+        nav.append(InlineKeyboardButton("⏮ В начало", callback_data="rqp:0"))
+    if has_more:
+        nav.append(InlineKeyboardButton("След ▶", callback_data=f"rqp:{rows[-1]['id']}"))
+    if nav:
+        buttons.append(nav)
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+
+@timed("cmd.requests")
+async def requests_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для админа: очередь открытых заявок с кнопками закрытия."""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Недоступно.")
+        return
+    text, keyboard = await _requests_page()
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+async def _requests_callback(query, user, data: str):
+    """rqp:<after_id> — страница, rqr:<id>:<after_id> — закрыть заявку, rqa:<user_id>:<after_id> — все заявки студента."""
+    if user.id not in ADMIN_IDS:
+        return
+    parts = data.split(":")
+    try:
+        nums = [int(x) for x in parts[1:]]
+    except ValueError:
+        return
+    if parts[0] == "rqp" and len(nums) == 1:
+        after_id = nums[0]
+    elif parts[0] == "rqr" and len(nums) == 2:
+        await adb.resolve_help_request(nums[0])
+        after_id = nums[1]
+    elif parts[0] == "rqa" and len(nums) == 2:
+        await adb.resolve_help_requests_for_user(nums[0])
+        after_id = nums[1]
+    else:
+        return
+    text, keyboard = await _requests_page(after_id)
+    await _edit(query, text, reply_markup=keyboard)
+
+
 async def _notify_admin_help(context: ContextTypes.DEFAULT_TYPE, kind: str, who: str, username: str, user_id: int, comment: str):
     kind_label = "Нужна помощь" if kind == "help" else "Нужен прогон/встреча"
     emoji = "🆘" if kind == "help" else "📅"
@@ -304,6 +984,7 @@ async def _notify_admin_help(context: ContextTypes.DEFAULT_TYPE, kind: str, who:
             logger.warning("Не удалось отправить уведомление админу %s: %s", admin_id, e)
 
 
+@timed("message.input")
 async def handle_input_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текста: форма помощи/встречи или добавление FAQ."""
     user = update.effective_user
@@ -315,12 +996,20 @@ async def handle_input_message(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data["awaiting_input"] = awaiting
         await update.message.reply_text("Напишите текст или нажмите Отмена в сообщении выше.")
         return
-    ensure_student(user.id, user.username, user.first_name, user.last_name)
+    await adb.ensure_student(user.id, user.username, user.first_name, user.last_name)
+
+    # Поиск темы по названию
+    if awaiting == "topic_search":
+        context.user_data.pop("awaiting_input", None)
+        context.user_data["topic_query"] = text
+        reply, keyboard = await _topic_search_message(context, text)
+        await update.message.reply_text(reply, reply_markup=keyboard)
+        return
 
     # Заявки на помощь / встречу
     if awaiting in ("help", "meeting"):
         context.user_data.pop("awaiting_input", None)
-        add_help_request(user.id, awaiting, text)
+        await adb.add_help_request(user.id, awaiting, text)
         who = f"{user.first_name or ''} {user.last_name or ''}".strip() or user.username or "Без имени"
         await _notify_admin_help(context, awaiting, who, user.username, user.id, text)
         await update.message.reply_text("Заявка отправлена. С вами свяжутся.")
@@ -347,7 +1036,7 @@ async def handle_input_message(update: Update, context: ContextTypes.DEFAULT_TYP
         if not question:
             await update.message.reply_text("Не найден вопрос для FAQ. Начните заново с команды /addfaq.")
             return
-        faq_id = add_faq(question, text, user.id)
+        faq_id = await adb.add_faq(question, text, user.id)
         await update.message.reply_text(f"FAQ добавлен (#{faq_id}).")
         return
 
@@ -356,12 +1045,13 @@ async def handle_input_message(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text("Состояние ввода потеряно. Попробуйте ещё раз или /start.")
 
 
+@timed("cmd.start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     context.user_data.pop("awaiting_input", None)
-    ensure_student(user.id, user.username, user.first_name, user.last_name)
+    await adb.ensure_student(user.id, user.username, user.first_name, user.last_name)
 
-    briefs = get_briefs(context)
+    briefs = await get_briefs(context)
     if not briefs:
         await update.message.reply_text(
             "Список тем ВКР временно недоступен. Попробуйте позже или обратитесь к куратору."
@@ -369,154 +1059,207 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Если тема уже выбрана — сразу показать меню темы
-    selected = get_selected_brief(user.id)
+    selected = await adb.get_selected_brief(user.id)
     if selected is not None and 0 <= selected < len(briefs):
         brief = briefs[selected]
-        if brief.get("type") == "child_page":
-            url = page_url(brief["page_id"])
-            text, keyboard = _topic_menu_message(brief, url)
+        if brief.is_page:
+            text, keyboard = get_topic_menu(context, brief)
             await update.message.reply_text(text, reply_markup=keyboard)
             return
 
-    buttons = []
-    for i, b in enumerate(briefs):
-        if b.get("type") != "child_page":
-            continue
-        full_title = b.get("title") or ""
-        if full_title.startswith("Задачи для ВКР"):
-            continue
-        title = _topic_only(full_title)[:50]
-        buttons.append([InlineKeyboardButton(title, callback_data=f"brief:{i}")])
-
-    if not buttons:
+    if not await get_topic_index(context):
         await update.message.reply_text(
             "Список тем ВКР временно пуст. Обратитесь к куратору."
         )
         return
-    keyboard = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text(
-        "Выберите тему ВКР:",
-        reply_markup=keyboard,
-    )
+    text, keyboard = await get_topic_page(context, 0)
+    await update.message.reply_text(text, reply_markup=keyboard)
 
 
-async def callback_brief(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
+@timed("cmd.topic")
+async def topic_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск темы по названию: /topic <часть названия>; без аргумента — список тем."""
+    context.user_data.pop("awaiting_input", None)
+    query = " ".join(context.args or []).strip()
+    if not await get_topic_index(context):
+        await update.message.reply_text("Список тем ВКР временно пуст. Обратитесь к куратору.")
+        return
+    if not query:
+        text, keyboard = await get_topic_page(context, 0)
+    else:
+        context.user_data["topic_query"] = query
+        text, keyboard = await _topic_search_message(context, query)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+def _callback_stage(data: str) -> str:
+    """Ключ метрики callback: menu:* целиком, остальные — по префиксу (brief:, chk:, step:, ...)."""
+    if data.startswith("menu:"):
+        return data
+    head, sep, _ = data.partition(":")
+    return head + sep
+
+
+def _press_key(query) -> tuple | str:
+    """Ключ слияния нажатий: сообщение, в котором нажата кнопка."""
+    if query.message is not None:
+        return (query.message.chat_id, query.message.message_id)
+    return query.inline_message_id or query.id
+
+
+async def _edit(query, text: str, reply_markup=None) -> bool:
+    """Правка сообщения с нажатой кнопкой; то же содержимое, что уже отрисовано, не отправляется."""
+    return await _render_cache.edit(query, _press_key(query), text, reply_markup)
+
+
+def _apply_checks(checked: set, states: dict[int, bool]) -> set:
+    """Отметки чеклиста с учётом ещё не записанных изменений {item_index: completed}."""
+    return (checked | {i for i, done in states.items() if done}) - {i for i, done in states.items() if not done}
+
+
+# Нажатия, на которые отвечает сам обработчик (всплывающий текст известен только после разбора)
+_ANSWER_IN_HANDLER = ("step:", "stepdone:", "chk:")
+
+
+async def _answer(query, text: str | None = None):
+    """Ответ на callback query; просроченный запрос — не ошибка (Telegram принимает ответ один раз)."""
     try:
-        await query.answer()
+        await query.answer(text)
     except BadRequest as e:
         msg = (e.message or "").lower()
         if "too old" in msg or "invalid" in msg or "expired" in msg or "timeout" in msg:
             logger.debug("Callback query expired, продолжаем: %s", e.message)
         else:
             raise
-    user = query.from_user
-    ensure_student(user.id, user.username, user.first_name, user.last_name)
 
-    data = query.data
-    try:
-        await _callback_brief_handle(update, context, query, user, data)
-    except BadRequest as e:
-        if "not modified" not in (e.message or "").lower():
-            raise
 
+async def callback_brief(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    with timer("callback." + _callback_stage(data or "")):
+        answer_later = (data or "").startswith(_ANSWER_IN_HANDLER)
+        if not answer_later:
+            await _answer(query)
+        toast = None
+        try:
+            user = query.from_user
+            await adb.ensure_student(user.id, user.username, user.first_name, user.last_name)
+            toast = await _callback_brief_handle(update, context, query, user, data)
+        except BadRequest as e:
+            if "not modified" not in (e.message or "").lower():
+                raise
+        finally:
+            if answer_later:
+                await _answer(query, toast)
+
+
+async def _callback_brief_handle(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user, data: str) -> str | None:
+    """
+    Внутренняя логика callback_brief (отдельно, чтобы ловить BadRequest снаружи).
+    Для _ANSWER_IN_HANDLER возвращает текст ответа на нажатие (None — без текста).
+    """
+    if data.startswith(("rqp:", "rqr:", "rqa:")):
+        await _requests_callback(query, user, data)
+        return
 
-async def _callback_brief_handle(update: Update, context: ContextTypes.DEFAULT_TYPE, query, user, data: str):
-    """Внутренняя логика callback_brief (отдельно, чтобы ловить BadRequest снаружи)."""
     if data.startswith("brief:"):
         idx = int(data.split(":")[1])
-        briefs = get_briefs(context)
+        briefs = await get_briefs(context)
         if idx < 0 or idx >= len(briefs):
-            await query.edit_message_text("Тема не найдена.")
+            await _edit(query, "Тема не найдена.")
             return
         brief = briefs[idx]
-        if brief.get("type") != "child_page":
-            await query.edit_message_text("Выберите тему из списка (страница брифов).")
+        if not brief.is_page:
+            await _edit(query, "Выберите тему из списка (страница брифов).")
             return
-        set_selected_brief(user.id, idx)
-        page_id = brief["page_id"]
-        url = page_url(page_id)
-        text, keyboard = _topic_menu_message(brief, url)
-        await query.edit_message_text(text, reply_markup=keyboard)
+        await adb.set_selected_brief(user.id, idx)
+        text, keyboard = get_topic_menu(context, brief)
+        await _edit(query, text, reply_markup=keyboard)
+        return
+
+    if data.startswith("topics:") or data.startswith("topicsq:"):
+        # Страницы выбора темы: topics:<page> — все темы, topicsq:<page> — результаты поиска
+        prefix, _, raw_page = data.partition(":")
+        try:
+            page = int(raw_page)
+        except ValueError:
+            page = 0
+        search = context.user_data.get("topic_query", "")
+        if prefix == "topicsq" and search:
+            text, keyboard = await _topic_search_message(context, search, page)
+        else:
+            text, keyboard = await get_topic_page(context, page)
+        await _edit(query, text, reply_markup=keyboard)
+        return
+
+    if data == "topics_search":
+        context.user_data["awaiting_input"] = "topic_search"
+        cancel_kb = InlineKeyboardMarkup([[InlineKeyboardButton("Отмена", callback_data="topics:0")]])
+        await _edit(query, "Напишите часть названия темы:", reply_markup=cancel_kb)
         return
 
     if data.startswith("menu:"):
         kind = data.split(":")[1]
-        brief_index = get_selected_brief(user.id)
+        brief_index = await adb.get_selected_brief(user.id)
         if brief_index is None:
-            await query.edit_message_text("Сначала выберите тему: /start")
+            await _edit(query, "Сначала выберите тему: /start")
             return
-        briefs = get_briefs(context)
+        briefs = await get_briefs(context)
         if brief_index >= len(briefs):
-            await query.edit_message_text("Тема не найдена. Выберите снова: /start")
+            await _edit(query, "Тема не найдена. Выберите снова: /start")
             return
         brief = briefs[brief_index]
-        page_id = brief["page_id"]
-        url = page_url(page_id)
-        content = get_brief_content(context, page_id)
+        page_id = brief.page_id
+        rendered = await get_brief_render(context, page_id)
 
         if kind == "checklist":
-            items = content.get("checklist", [])
+            # обращение к кэшу уже учтено в get_brief_render
+            items = (await get_brief_content(context, page_id, count=False)).checklist
             if not items:
-                text = "Чеклист в брифе не найден.\n\nОткройте бриф в Notion: " + url
-                await query.edit_message_text(text, reply_markup=_back_keyboard())
+                await _edit(query, rendered.no_checklist, reply_markup=back_keyboard())
             else:
-                checked = get_checklist_checked(user.id, brief_index)
-                text, keyboard = _checklist_message(items, checked, url, brief_index)
-                await query.edit_message_text(text, reply_markup=keyboard)
+                checked = await adb.get_checklist_checked(user.id, brief_index)
+                text, keyboard = checklist_message(items, checked, rendered.url, brief_index)
+                await _edit(query, text, reply_markup=keyboard)
 
         elif kind == "environment":
-            sec = content.get("sections", {}).get("environment", {})
-            title = sec.get("title", "Окружение / инфраструктура")
-            preview = sec.get("preview", "")
-            text = f"🖥 {title}\n\n{preview}\n\nОткрыть раздел в Notion: {url}"
-            if not preview:
-                text = f"🖥 {title}\n\nПодробности в брифе в Notion: {url}"
-            await query.edit_message_text(text, reply_markup=_back_keyboard())
+            await _edit(query, rendered.environment, reply_markup=back_keyboard())
 
         elif kind == "product":
-            sec = content.get("sections", {}).get("product", {})
-            title = sec.get("title", "Выбор демо-приложения / продукта")
-            preview = sec.get("preview", "")
-            text = f"📦 {title}\n\n{preview}\n\nОткрыть раздел в Notion: {url}"
-            if not preview:
-                text = f"📦 {title}\n\nПодробности в брифе в Notion: {url}"
-            await query.edit_message_text(text, reply_markup=_back_keyboard())
+            await _edit(query, rendered.product, reply_markup=back_keyboard())
 
         elif kind == "steps":
-            steps = content.get("steps", [])
+            steps = rendered.steps
             if not steps:
-                text = f"Шаги не найдены.\n\nОткройте бриф в Notion: {url}"
-                await query.edit_message_text(text, reply_markup=_back_keyboard())
+                await _edit(query, rendered.no_steps, reply_markup=back_keyboard())
                 return
-            context.user_data["brief_steps"] = steps
-            context.user_data["brief_page_url"] = url
-            saved_idx = get_current_step(user.id)
+            context.user_data["brief_page_id"] = page_id
+            saved_idx = await adb.get_current_step(user.id)
             if saved_idx is None or saved_idx < 0 or saved_idx >= len(steps):
                 idx = 0
             else:
                 idx = saved_idx
             context.user_data["brief_step_index"] = idx
-            step = steps[idx]
-            msg = _format_step(step, idx + 1, len(steps), url)
-            keyboard = _steps_keyboard(idx, len(steps), url)
-            await query.edit_message_text(msg, reply_markup=keyboard)
+            msg, keyboard = steps[idx]
+            await _edit(query, msg, reply_markup=keyboard)
 
         elif kind == "faq":
-            text = _format_faq()
-            await query.edit_message_text(text, reply_markup=_back_keyboard())
+            text = await _format_faq()
+            await _edit(query, text, reply_markup=back_keyboard())
 
         elif kind == "help":
             context.user_data["awaiting_input"] = "help"
             cancel_kb = InlineKeyboardMarkup([[InlineKeyboardButton("Отмена", callback_data="input_cancel")]])
-            await query.edit_message_text(
+            await _edit(
+                query,
                 "Опишите, с чем нужна помощь (напишите текстом в чат):",
                 reply_markup=cancel_kb,
             )
         elif kind == "meeting":
             context.user_data["awaiting_input"] = "meeting"
             cancel_kb = InlineKeyboardMarkup([[InlineKeyboardButton("Отмена", callback_data="input_cancel")]])
-            await query.edit_message_text(
+            await _edit(
+                query,
                 "Укажите удобные окна для встречи/прогона (например: пн 15:00, ср после 18:00). Напишите в чат:",
                 reply_markup=cancel_kb,
             )
@@ -524,17 +1267,15 @@ async def _callback_brief_handle(update: Update, context: ContextTypes.DEFAULT_T
 
     if data.startswith("step:"):
         # навигация по шагам: step:prev / step:next / step:0
-        brief_index = get_selected_brief(user.id)
+        brief_index = await adb.get_selected_brief(user.id)
         if brief_index is None:
-            await query.answer("Сначала выберите тему: /start")
-            return
+            return "Сначала выберите тему: /start"
         direction = data.split(":")[1]
-        steps = context.user_data.get("brief_steps", [])
+        page_id = context.user_data.get("brief_page_id")
+        steps = (await get_brief_render(context, page_id)).steps if page_id else ()
         idx = context.user_data.get("brief_step_index", 0)
-        url = context.user_data.get("brief_page_url", "")
         if not steps:
-            await query.answer("Шаги не загружены. Выберите 'Шаги по порядку' снова.")
-            return
+            return "Шаги не загружены. Выберите 'Шаги по порядку' снова."
         n = len(steps)
         if direction == "prev":
             idx = max(0, idx - 1)
@@ -547,90 +1288,90 @@ async def _callback_brief_handle(update: Update, context: ContextTypes.DEFAULT_T
             except ValueError:
                 idx = 0
         context.user_data["brief_step_index"] = idx
-        step = steps[idx]
-        msg = _format_step(step, idx + 1, n, url)
-        keyboard = _steps_keyboard(idx, n, url)
-        await query.edit_message_text(msg, reply_markup=keyboard)
-        await query.answer()
+
+        async def flush():
+            # Последний выбранный шаг: нажатия, пришедшие во время отрисовки, уже сдвинули индекс
+            msg, keyboard = steps[context.user_data.get("brief_step_index", idx)]
+            await _edit(query, msg, reply_markup=keyboard)
+
+        await _press_coalescer.run(_press_key(query), flush)
         return
 
     if data.startswith("stepdone:"):
         # Отметить шаг как пройденный и перейти к следующему
         parts = data.split(":")
         if len(parts) != 2:
-            await query.answer()
-            return
+            return None
         try:
             done_idx = int(parts[1])
         except ValueError:
-            await query.answer()
-            return
-        brief_index = get_selected_brief(user.id)
+            return None
+        brief_index = await adb.get_selected_brief(user.id)
         if brief_index is None:
-            await query.answer("Сначала выберите тему: /start")
-            return
-        steps = context.user_data.get("brief_steps", [])
-        url = context.user_data.get("brief_page_url", "")
+            return "Сначала выберите тему: /start"
+        page_id = context.user_data.get("brief_page_id")
+        rendered = await get_brief_render(context, page_id) if page_id else None
+        steps = rendered.steps if rendered else ()
         if not steps:
-            await query.answer("Шаги не загружены. Выберите 'Шаги по порядку' снова.")
-            return
+            return "Шаги не загружены. Выберите 'Шаги по порядку' снова."
         total = len(steps)
         next_idx = done_idx + 1
         if next_idx >= total:
             # Все шаги пройдены
-            set_current_step(user.id, total - 1)
-            mark_brief_done(user.id, brief_index)
-            await query.edit_message_text(
-                f"Все шаги по теме пройдены! 🎉\n\nПодробнее в Notion: {url}",
-                reply_markup=_back_keyboard(),
-            )
-            await query.answer("Бриф отмечен как пройденный")
-            return
+            await adb.set_current_step(user.id, total - 1)
+            await adb.mark_brief_done(user.id, brief_index)
+            await _edit(query, rendered.all_steps_done, reply_markup=back_keyboard())
+            return "Бриф отмечен как пройденный"
         # Сохраняем следующий шаг как текущий
-        set_current_step(user.id, next_idx)
+        await adb.set_current_step(user.id, next_idx)
         context.user_data["brief_step_index"] = next_idx
-        step = steps[next_idx]
-        msg = _format_step(step, next_idx + 1, total, url)
-        keyboard = _steps_keyboard(next_idx, total, url)
-        await query.edit_message_text(msg, reply_markup=keyboard)
-        await query.answer("Шаг отмечен, идём дальше")
-        return
+        msg, keyboard = steps[next_idx]
+        await _edit(query, msg, reply_markup=keyboard)
+        return "Шаг отмечен, идём дальше"
 
     if data.startswith("chk:"):
         # Переключить пункт чеклиста: chk:brief_index:item_index
         parts = data.split(":")
         if len(parts) != 3:
-            await query.answer()
-            return
+            return None
         try:
             brief_idx = int(parts[1])
             item_idx = int(parts[2])
         except ValueError:
-            await query.answer()
-            return
-        briefs = get_briefs(context)
+            return None
+        briefs = await get_briefs(context)
         if brief_idx >= len(briefs):
-            await query.answer("Тема не найдена.")
-            return
-        page_id = briefs[brief_idx]["page_id"]
-        content = get_brief_content(context, page_id)
-        items = content.get("checklist", [])
+            return "Тема не найдена."
+        page_id = briefs[brief_idx].page_id
+        content = await get_brief_content(context, page_id)
+        items = content.checklist
         if item_idx >= len(items):
-            await query.answer()
-            return
-        checked = get_checklist_checked(user.id, brief_idx)
+            return None
+        # Нажатия копятся в _checklist_pending и пишутся в базу одной транзакцией при отрисовке
+        stored = await adb.get_checklist_checked(user.id, brief_idx)
+        # Очередь берём после await: отрисовка, завершившаяся за это время, уже забрала прежнюю
+        pending_key = (_press_key(query), brief_idx)
+        pending = _checklist_pending.setdefault(pending_key, {})
+        checked = _apply_checks(stored, pending)
         new_state = item_idx not in checked
-        set_checklist_item(user.id, brief_idx, item_idx, new_state)
+        pending[item_idx] = new_state
         if new_state:
-            item_text = (items[item_idx].get("text") or "").strip()
+            item_text = items[item_idx].text.strip()
             for j in range(len(items)):
-                if j != item_idx and (items[j].get("text") or "").strip() == item_text:
-                    set_checklist_item(user.id, brief_idx, j, True)
-        checked = get_checklist_checked(user.id, brief_idx)
+                if j != item_idx and items[j].text.strip() == item_text:
+                    pending[j] = True
         url = page_url(page_id)
-        text, keyboard = _checklist_message(items, checked, url, brief_idx, page=0)
-        await query.edit_message_text(text, reply_markup=keyboard)
-        await query.answer("Отмечено" if new_state else "Снято")
+
+        async def flush():
+            states = _checklist_pending.pop(pending_key, {})
+            checked = await adb.get_checklist_checked(user.id, brief_idx)
+            changes = {i: done for i, done in states.items() if (i in checked) != done}
+            await adb.set_checklist_items(user.id, brief_idx, changes)
+            text, keyboard = checklist_message(items, _apply_checks(checked, changes), url, brief_idx, page=0)
+            await _edit(query, text, reply_markup=keyboard)
+
+        await _press_coalescer.run(_press_key(query), flush)
+        return "Отмечено" if new_state else "Снято"
 
     if data.startswith("clpage:"):
         # Пагинация чеклиста: clpage:brief_index:page
@@ -642,84 +1383,227 @@ async def _callback_brief_handle(update: Update, context: ContextTypes.DEFAULT_T
             cl_page = int(parts[2])
         except ValueError:
             return
-        brief_index = get_selected_brief(user.id)
+        brief_index = await adb.get_selected_brief(user.id)
         if brief_index is None or brief_idx != brief_index:
             return
-        briefs = get_briefs(context)
+        briefs = await get_briefs(context)
         if brief_idx >= len(briefs):
             return
-        page_id = briefs[brief_idx]["page_id"]
-        content = get_brief_content(context, page_id)
-        items = content.get("checklist", [])
-        checked = get_checklist_checked(user.id, brief_idx)
+        page_id = briefs[brief_idx].page_id
+        content = await get_brief_content(context, page_id)
+        items = content.checklist
+        checked = await adb.get_checklist_checked(user.id, brief_idx)
         url = page_url(page_id)
-        text, keyboard = _checklist_message(items, checked, url, brief_idx, page=cl_page)
-        await query.edit_message_text(text, reply_markup=keyboard)
+        text, keyboard = checklist_message(items, checked, url, brief_idx, page=cl_page)
+        await _edit(query, text, reply_markup=keyboard)
 
     if data == "input_cancel":
         context.user_data.pop("awaiting_input", None)
-        await query.edit_message_text("Ввод отменён.", reply_markup=_back_keyboard())
+        await _edit(query, "Ввод отменён.", reply_markup=back_keyboard())
 
     if data == "menu_back":
-        brief_index = get_selected_brief(user.id)
+        brief_index = await adb.get_selected_brief(user.id)
         if brief_index is None:
-            await query.edit_message_text("Сначала выберите тему: /start")
+            await _edit(query, "Сначала выберите тему: /start")
             return
-        briefs = get_briefs(context)
+        briefs = await get_briefs(context)
         if brief_index >= len(briefs):
-            await query.edit_message_text("Тема не найдена. /start")
+            await _edit(query, "Тема не найдена. /start")
             return
-        brief = briefs[brief_index]
-        url = page_url(brief["page_id"])
-        text, keyboard = _topic_menu_message(brief, url)
-        await query.edit_message_text(text, reply_markup=keyboard)
+        text, keyboard = get_topic_menu(context, briefs[brief_index])
+        await _edit(query, text, reply_markup=keyboard)
+
+
+async def warm_up(app: Application):
+    """
+    Прогрев перед приёмом апдейтов: список брифов и контент каждой темы,
+    не больше WARMUP_CONCURRENCY загрузок одновременно, общий таймаут WARMUP_TIMEOUT.
+    """
+    started = time_module.perf_counter()
+    bot_data = app.bot_data
+    loaded = 0
+    total = 0
+
+    async def load_one(sem: asyncio.Semaphore, page_id: str):
+        nonlocal loaded
+        async with sem:
+            await load_brief_content(bot_data, page_id)
+        loaded += 1
+
+    async def run():
+        nonlocal total
+        briefs = await load_briefs(bot_data)
+        page_ids = list(dict.fromkeys(b.page_id for b in briefs if b.is_page))
+        total = len(page_ids)
+        sem = asyncio.Semaphore(WARMUP_CONCURRENCY)
+        await asyncio.gather(*(load_one(sem, pid) for pid in page_ids))
+
+    logger.info("Прогрев кэша брифов (таймаут %s с, параллельно %s)...", WARMUP_TIMEOUT, WARMUP_CONCURRENCY)
+    try:
+        await asyncio.wait_for(run(), timeout=WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(
+            "Прогрев прерван по таймауту через %.1f с: загружено %s из %s брифов, остальные — по запросу",
+            time_module.perf_counter() - started, loaded, total,
+        )
+    except Exception:
+        logger.exception("Прогрев не удался, брифы будут загружаться по запросу")
+    else:
+        logger.info(
+            "Прогрев завершён за %.1f с: тем %s, брифов загружено %s. Бот готов принимать апдейты.",
+            time_module.perf_counter() - started, len(bot_data.get("topic_index", ())), loaded,
+        )
 
 
-def _format_step(step: dict, num: int, total: int, url: str) -> str:
-    title = step.get("title", "")
-    preview = step.get("content_preview", "")
-    return f"Шаг {num}/{total}: {title}\n\n{preview}\n\nПодробнее в Notion: {url}"
+def load_bundle_into(bot_data: dict, path: str = None) -> bool:
+    """Заменяет кэш брифов содержимым офлайн-бандла (VKR_BRIEFS_BUNDLE). False — бандл не прочитан."""
+    path = path or BRIEFS_BUNDLE
+    try:
+        briefs, contents, blocks, meta = load_bundle(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Бандл брифов %s не загружен: %s", path, e)
+        return False
+    invalidate_briefs(bot_data)
+    _store_briefs(bot_data, briefs)
+    for page_id, content in contents.items():
+        _store_brief_content(bot_data, page_id, content, blocks.get(page_id))
+    logger.info(
+        "Брифы загружены из бандла %s (создан %s): тем %s, брифов с контентом %s",
+        path, meta.get("created_at"), len(bot_data.get("topic_index", ())), len(contents),
+    )
+    return True
 
 
-def _steps_keyboard(current: int, total: int, url: str) -> InlineKeyboardMarkup:
-    rows = []
-    nav = []
-    if current > 0:
-        nav.append(InlineKeyboardButton("◀ Пред", callback_data="step:prev"))
-    if current < total - 1:
-        nav.append(InlineKeyboardButton("След ▶", callback_data="step:next"))
-    if nav:
-        rows.append(nav)
-    rows.append(
-        [
-            InlineKeyboardButton("✅ Я прошёл этот шаг", callback_data=f"stepdone:{current}"),
-            InlineKeyboardButton("В меню", callback_data="menu_back"),
-        ]
-    )
-    return InlineKeyboardMarkup(rows)
+async def _post_init(app: Application):
+    if BRIEFS_BUNDLE:
+        load_bundle_into(app.bot_data)
+    if WARMUP_ENABLED and os.environ.get("NOTION_TOKEN"):
+        await warm_up(app)
 
 
-def main():
-    init_db()
-    token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    if not token:
-        raise SystemExit("Задайте TELEGRAM_BOT_TOKEN")
-    app = Application.builder().token(token).build()
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий каждый вызов Bot API (стадия tg.<method>)."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        start = time_module.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+        finally:
+            observe("tg." + url.rsplit("/", 1)[-1], time_module.perf_counter() - start)
+
+
+def build_application(token: str, request=None, get_updates_request=None) -> Application:
+    """Application со всеми обработчиками и задачами (request — подмена HTTP-слоя, напр. в бенчмарке)."""
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(request or TimedRequest())
+        # Параллельная обработка — только если включена VKR_CONCURRENT_UPDATES > 1
+        .concurrent_updates(CONCURRENT_UPDATES if CONCURRENT_UPDATES > 1 else False)
+        .post_init(_post_init)
+    )
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    app = builder.build()
     # Ежедневно в 11:00 (или VKR_REMINDER_*) — напоминание о заявках (нужен пакет python-telegram-bot[job-queue])
     if app.job_queue:
         tz = ZoneInfo(REMINDER_TZ)
         reminder_time = time(REMINDER_HOUR, REMINDER_MINUTE, tzinfo=tz)
         app.job_queue.run_daily(morning_reminder_job, reminder_time)
         logger.info("Утреннее напоминание запланировано на %s:%s (%s)", REMINDER_HOUR, REMINDER_MINUTE, REMINDER_TZ)
+        app.job_queue.run_daily(rollup_progress_job, time(ROLLUP_HOUR, 0, tzinfo=tz))
+        app.job_queue.run_daily(nudge_stalled_job, time(NUDGE_HOUR, 0, tzinfo=tz))
+        # Рассылки, прерванные перезапуском, — досылаются сразу после старта
+        app.job_queue.run_once(resume_broadcasts_job, 0)
+        # Архив и бэкап работают с файлом SQLite; у PostgreSQL — свои средства
+        if STORAGE_BACKEND == "sqlite":
+            app.job_queue.run_daily(archive_job, time(ARCHIVE_HOUR, 0, tzinfo=tz))
+            app.job_queue.run_daily(backup_job, time(BACKUP_HOUR, 0, tzinfo=tz))
     else:
         logger.warning("JobQueue недоступен: установите python-telegram-bot[job-queue]. Утреннее напоминание отключено.")
+    app.add_handler(TypeHandler(Update, _count_update), group=-1)
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("topic", topic_cmd))
     app.add_handler(CommandHandler("faq", faq_cmd))
     app.add_handler(CommandHandler("addfaq", addfaq_cmd))
     app.add_handler(CommandHandler("progress", progress_cmd))
+    app.add_handler(CommandHandler("export", export_cmd))
+    app.add_handler(CommandHandler("trend", trend_cmd))
+    app.add_handler(CommandHandler("requests", requests_cmd))
+    app.add_handler(CommandHandler("broadcast", broadcast_cmd))
+    app.add_handler(CommandHandler("stalled", stalled_cmd))
     app.add_handler(CommandHandler("reset", reset_cmd))
+    app.add_handler(CommandHandler("refresh", refresh_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_input_message))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.ChatType.PRIVATE, import_document))
     app.add_handler(CallbackQueryHandler(callback_brief))
+    app.add_handler(InlineQueryHandler(inline_faq))
+    return app
+
+
+def profile_startup():
+    """
+    --profile-startup: время импорта (python -X importtime в подпроцессе, по пакетам верхнего уровня)
+    и этапов инициализации в этом процессе; polling не запускается.
+    """
+    import subprocess
+    import sys
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import bot.main"],
+        capture_output=True, text=True, cwd=root,
+    )
+    packages: dict[str, int] = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # заголовок
+        depth = (len(name) - 1 - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0:
+            total_us += int(cumulative)
+        if name == "bot.main":
+            # сам bot.main — только собственное время, его импорты — строками ниже
+            packages[name] = int(self_us)
+            continue
+        if depth > 1:
+            continue  # вложенный импорт уже учтён в родителе
+        package = name if name.startswith("bot.") else name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(cumulative)
+    print(f"Импорт: {total_us / 1000:.0f} мс всего")
+    for package, us in sorted(packages.items(), key=lambda kv: -kv[1])[:15]:
+        print(f"  {package:<28} {us / 1000:8.1f} мс")
+
+    print("Инициализация:")
+    stages = [
+        ("init_db", db.init_db),
+        ("build_application", lambda: build_application(os.environ.get("TELEGRAM_BOT_TOKEN") or "0:profile")),
+    ]
+    if BRIEFS_BUNDLE:
+        stages.append(("load_bundle", lambda: load_bundle_into({})))
+    for name, func in stages:
+        started = time_module.perf_counter()
+        func()
+        print(f"  {name:<28} {(time_module.perf_counter() - started) * 1000:8.1f} мс")
+
+
+def main():
+    import sys
+
+    if "--profile-startup" in sys.argv[1:]:
+        profile_startup()
+        return
+    db.init_db()
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise SystemExit("Задайте TELEGRAM_BOT_TOKEN")
+    app = build_application(token)
+    start_http_server()
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
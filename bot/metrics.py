@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Лёгкие метрики задержек: гистограммы по стадиям (обработчики, SQLite, Notion, Telegram API).
+
+Наблюдение — perf_counter + bisect по фиксированным корзинам под одним коротким
+замком: наблюдения приходят и из цикла событий, и из пула потоков (to_thread —
+postgres, выгрузка, импорт, бэкап, архивация), а `+=` не атомарен. Замок без
+конкуренции стоит доли микросекунды, поэтому слой можно держать включённым постоянно.
+Плюс простые счётчики событий (inc/counter).
+Экспорт: render_prometheus() (text format) и summary_lines() для /stats.
+Если задан VKR_METRICS_PORT — поднимается HTTP-эндпоинт /metrics.
+"""
+import functools
+import inspect
+import logging
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами."""
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины (для последней — максимум)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+
+_histograms: dict[str, Histogram] = {}
+# Общий для гистограмм и счётчиков: запись из потоков, чтение из /metrics (свой поток)
+_lock = threading.Lock()
+
+
+def observe(name: str, seconds: float):
+    """Записать длительность стадии name."""
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram()
+        hist.observe(seconds)
+
+
+class timer:
+    """Контекстный менеджер: with timer("notion.blocks"): ..."""
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, perf_counter() - self.start)
+        return False
+
+
+def timed(name: str):
+    """Декоратор для sync и async функций: длительность вызова пишется в гистограмму name."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(name, perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+_counters: dict[str, int] = {}
+
+
+def inc(name: str, n: int = 1):
+    """Увеличить счётчик события name (кэш hit/miss, обработанные апдейты и т.п.)."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def counter(name: str) -> int:
+    return _counters.get(name, 0)
+
+
+def snapshot() -> dict[str, Histogram]:
+    """Текущие гистограммы (копия словаря, отсортированная по имени)."""
+    with _lock:
+        items = list(_histograms.items())
+    return dict(sorted(items))
+
+
+def summary_lines(prefix: str = "") -> list[str]:
+    """Строки «стадия: n, p50, p99, max» в миллисекундах (для /stats)."""
+    lines = []
+    for name, h in snapshot().items():
+        if not name.startswith(prefix):
+            continue
+        lines.append(
+            f"{name}: n={h.count} p50={h.quantile(0.5) * 1000:.1f} "
+            f"p99={h.quantile(0.99) * 1000:.1f} max={h.max * 1000:.1f} мс"
+        )
+    return lines
+
+
+def render_prometheus() -> str:
+    """Гистограммы в Prometheus text format (vkr_stage_seconds{stage=...})."""
+    out = [
+        "# HELP vkr_stage_seconds Длительность стадий обработки (обработчики, SQLite, Notion, Telegram API).",
+        "# TYPE vkr_stage_seconds histogram",
+    ]
+    for name, h in snapshot().items():
+        cumulative = 0
+        for bound, n in zip(BUCKETS, h.counts):
+            cumulative += n
+            out.append(f'vkr_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        out.append(f'vkr_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+        out.append(f'vkr_stage_seconds_sum{{stage="{name}"}} {h.sum:.6f}')
+        out.append(f'vkr_stage_seconds_count{{stage="{name}"}} {h.count}')
+    out.append("# HELP vkr_events_total Счётчики событий (кэш, апдейты).")
+    out.append("# TYPE vkr_events_total counter")
+    with _lock:
+        counters = sorted(_counters.items())
+    for name, value in counters:
+        out.append(f'vkr_events_total{{event="{name}"}} {value}')
+    return "\n".join(out) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int | None = None) -> ThreadingHTTPServer | None:
+    """Запускает /metrics в фоновом потоке (порт из VKR_METRICS_PORT). None — если порт не задан."""
+    port = port or int(os.environ.get("VKR_METRICS_PORT", "0") or 0)
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Метрики: http://0.0.0.0:%s/metrics", port)
+    return server
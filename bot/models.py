@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Компактные неизменяемые модели распарсенных брифов.
+
+Экземпляры frozen + slots: без __dict__ на каждый объект, их можно безопасно
+разделять между кэшем и user_data всех студентов. Повторяющиеся строки
+(тип блока, заголовки, тексты пунктов чеклиста) интернируются.
+"""
+import sys
+from dataclasses import dataclass
+
+
+def intern_text(value: str | None) -> str:
+    """Интернирует строку (None → пустая строка)."""
+    return sys.intern(value) if value else ""
+
+
+@dataclass(frozen=True, slots=True)
+class Brief:
+    """Элемент страницы брифов: дочерняя страница (child_page) или заголовок (heading_1/2/3)."""
+    title: str
+    type: str
+    block_id: str
+    level: int
+    page_id: str | None = None
+    description: str = ""
+
+    @property
+    def is_page(self) -> bool:
+        return self.type == "child_page"
+
+
+@dataclass(frozen=True, slots=True)
+class Step:
+    """Шаг брифа (heading_2) с текстовым превью раздела."""
+    index: int
+    title: str
+    content_preview: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class ChecklistItem:
+    """Пункт чеклиста (to_do)."""
+    text: str
+    checked: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class Section:
+    """Раздел «Окружение» / «Продукт»: заголовок и превью."""
+    title: str
+    preview: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class BriefContent:
+    """Контент страницы брифа: шаги, чеклист и разделы environment/product."""
+    steps: tuple[Step, ...] = ()
+    checklist: tuple[ChecklistItem, ...] = ()
+    environment: Section | None = None
+    product: Section | None = None
+
+    def section(self, key: str) -> Section | None:
+        """Раздел по ключу кнопки меню ("environment" / "product")."""
+        if key == "environment":
+            return self.environment
+        if key == "product":
+            return self.product
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class BriefBlocks:
+    """
+    Отпечатки блоков страницы брифа (id, last_edited_time и хэш содержимого) для инкрементального перепарсинга:
+    по одному на шаг (heading_2 и блоки раздела до следующего heading_2) и на пункт чеклиста.
+    """
+    steps: tuple[str, ...] = ()
+    checklist: tuple[str, ...] = ()
+
+
+@dataclass(frozen=True, slots=True)
+class BriefDiff:
+    """
+    Изменения брифа при обновлении: номера шагов и пунктов с 1. Изменённые и добавленные —
+    по новой версии, удалённые — по прежней (их в новой версии нет).
+    """
+    steps_changed: tuple[int, ...] = ()
+    steps_added: tuple[int, ...] = ()
+    steps_removed: tuple[int, ...] = ()
+    checklist_changed: tuple[int, ...] = ()
+    checklist_added: tuple[int, ...] = ()
+    checklist_removed: tuple[int, ...] = ()
+
+    @property
+    def changed(self) -> bool:
+        return any((
+            self.steps_changed, self.steps_added, self.steps_removed,
+            self.checklist_changed, self.checklist_added, self.checklist_removed,
+        ))
+
+    def summary(self) -> str:
+        def numbers(label: str, values: tuple[int, ...]):
+            if values:
+                parts.append(label + " " + ", ".join(map(str, values)))
+
+        parts = []
+        numbers("шаги", self.steps_changed)
+        numbers("новые шаги", self.steps_added)
+        numbers("удалены шаги (прежние номера)", self.steps_removed)
+        numbers("чеклист: пункты", self.checklist_changed)
+        numbers("новые пункты", self.checklist_added)
+        numbers("удалены пункты (прежние номера)", self.checklist_removed)
+        return "; ".join(parts) or "без изменений"
+
+
+# Общий пустой контент (нет токена / страницы) — один экземпляр на процесс.
+EMPTY_CONTENT = BriefContent()
@@ -1,14 +1,33 @@
 # -*- coding: utf-8 -*-
 """
 Клиент Notion API для страницы с брифами.
-Переменные (как в infra): NOTION_TOKEN, NOTION_BRIEFS_PAGE_ID.
+Переменные (как в infra): NOTION_TOKEN, NOTION_BRIEFS_PAGE_ID; NOTION_API_BASE — для тестового сервера.
 """
+import difflib
+import hashlib
+import json
 import os
 import re
-import requests
+import threading
+import time
+from dataclasses import replace
+
+from bot.metrics import timer
+from bot.models import (
+    EMPTY_CONTENT,
+    Brief,
+    BriefBlocks,
+    BriefContent,
+    BriefDiff,
+    ChecklistItem,
+    Section,
+    Step,
+    intern_text,
+)
 
 NOTION_VERSION = "2022-06-28"
-BASE = "https://api.notion.com/v1"
+# Переопределяется для локального фейкового Notion (бенчмарки): NOTION_API_BASE=http://127.0.0.1:8765/v1
+BASE = os.environ.get("NOTION_API_BASE", "https://api.notion.com/v1").rstrip("/")
 
 
 def _norm_id(page_id: str) -> str:
@@ -28,17 +47,62 @@ def _plain_text(block: dict) -> str:
     return "".join(item.get("plain_text", "") for item in rich).strip()
 
 
-def get_blocks(page_id: str, token: str = None) -> list:
+# Notion API: в среднем ~3 запроса/с на интеграцию. Ограничение общее для всех потоков процесса.
+NOTION_RPS = float(os.environ.get("NOTION_RPS", "3"))
+_RETRY_429 = 3
+_rate_lock = threading.Lock()
+_next_slot = 0.0
+
+
+def _throttle():
+    """Ждёт свой слот, чтобы не превышать NOTION_RPS (потокобезопасно)."""
+    global _next_slot
+    if NOTION_RPS <= 0:
+        return
+    with _rate_lock:
+        now = time.monotonic()
+        wait = _next_slot - now
+        _next_slot = max(now, _next_slot) + 1.0 / NOTION_RPS
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _get(url: str, headers: dict, stage: str, params: dict | None = None):
+    """GET к Notion с ограничением частоты и повтором при 429 (по Retry-After)."""
+    # requests (~45 мс импорта) грузится при первом запросе: старт из бандла обходится без него
+    import requests
+
+    for attempt in range(_RETRY_429 + 1):
+        _throttle()
+        with timer(stage):
+            r = requests.get(url, headers=headers, params=params, timeout=30)
+        if r.status_code != 429 or attempt == _RETRY_429:
+            return r
+        time.sleep(float(r.headers.get("Retry-After") or 1))
+    return r
+
+
+class NotionError(RuntimeError):
+    """Ответ Notion не получен целиком (strict-режим get_blocks)."""
+
+
+def get_blocks(page_id: str, token: str = None, strict: bool = False) -> list:
     """
     Возвращает все блоки первого уровня страницы (с пагинацией).
     page_id: ID страницы (из URL, можно с дефисами или без).
     token: NOTION_TOKEN (если не передан — из env).
+    strict: ответ не 200 (в том числе посреди пагинации) или нет токена — NotionError
+    вместо частичного/пустого списка (синхронизация бандла, обновление брифов).
     """
     token = token or os.environ.get("NOTION_TOKEN")
     if not token:
+        if strict:
+            raise NotionError("NOTION_TOKEN не задан")
         return []
     pid = _norm_id(page_id)
     if not pid:
+        if strict:
+            raise NotionError(f"Некорректный ID страницы: {page_id!r}")
         return []
     url = f"{BASE}/blocks/{pid}/children"
     headers = {
@@ -52,8 +116,15 @@ def get_blocks(page_id: str, token: str = None) -> list:
         params = {"page_size": 100}
         if cursor:
             params["start_cursor"] = cursor
-        r = requests.get(url, headers=headers, params=params, timeout=30)
+        try:
+            r = _get(url, headers, "notion.blocks_children", params)
+        except OSError as e:  # requests.RequestException — наследник OSError
+            if strict:
+                raise NotionError(f"{pid}: {e} после {len(results)} блоков") from e
+            raise
         if r.status_code != 200:
+            if strict:
+                raise NotionError(f"{pid}: HTTP {r.status_code} после {len(results)} блоков")
             break
         data = r.json()
         results.extend(data.get("results") or [])
@@ -61,6 +132,8 @@ def get_blocks(page_id: str, token: str = None) -> list:
             break
         cursor = data.get("next_cursor")
         if not cursor:
+            if strict:
+                raise NotionError(f"{pid}: has_more без next_cursor после {len(results)} блоков")
             break
     return results
 
@@ -78,7 +151,7 @@ def get_page_title(page_id: str, token: str = None) -> str:
         "Authorization": f"Bearer {token}",
         "Notion-Version": NOTION_VERSION,
     }
-    r = requests.get(url, headers=headers, timeout=30)
+    r = _get(url, headers, "notion.page")
     if r.status_code != 200:
         return ""
     data = r.json()
@@ -97,9 +170,9 @@ def _title_from_child_page(block: dict) -> str:
     return (cp.get("title") or "").strip()
 
 
-def parse_briefs(blocks: list, token: str = None) -> list:
+def parse_briefs(blocks: list, token: str = None) -> list[Brief]:
     """
-    Превращает блоки в список «брифов»:
+    Превращает блоки в список «брифов» (Brief):
     - child_page → бриф с page_id и title (заголовок страницы, при необходимости запрос к API);
     - heading_1/2/3 → бриф с title и level.
     """
@@ -112,33 +185,34 @@ def parse_briefs(blocks: list, token: str = None) -> list:
             title = _title_from_child_page(b)
             if not title and token:
                 title = get_page_title(bid, token)
-            briefs.append({
-                "title": title or "(без названия)",
-                "type": t,
-                "block_id": bid,
-                "page_id": bid,
-                "level": 1,
-            })
+            bid = intern_text(bid)
+            briefs.append(Brief(
+                title=intern_text(title or "(без названия)"),
+                type=intern_text(t),
+                block_id=bid,
+                page_id=bid,
+                level=1,
+            ))
             continue
         text = _plain_text(b)
         if not text and t not in ("heading_1", "heading_2", "heading_3"):
             continue
         level = {"heading_1": 1, "heading_2": 2, "heading_3": 3}.get(t)
         if level is not None:
-            briefs.append({"title": text, "type": t, "block_id": bid, "level": level})
-        elif t == "paragraph" and briefs and "description" not in briefs[-1]:
-            briefs[-1]["description"] = text
+            briefs.append(Brief(title=intern_text(text), type=intern_text(t), block_id=intern_text(bid), level=level))
+        elif t == "paragraph" and briefs and not briefs[-1].description:
+            briefs[-1] = replace(briefs[-1], description=text)
     return briefs
 
 
-def fetch_briefs(page_id: str = None, token: str = None) -> list:
+def fetch_briefs(page_id: str = None, token: str = None, strict: bool = False) -> list[Brief]:
     """
     Загружает страницу и возвращает список брифов.
     Поддерживаются дочерние страницы (child_page) и заголовки (heading_1/2/3).
-    page_id по умолчанию из NOTION_BRIEFS_PAGE_ID.
+    page_id по умолчанию из NOTION_BRIEFS_PAGE_ID; strict — как в get_blocks.
     """
     page_id = page_id or os.environ.get("NOTION_BRIEFS_PAGE_ID", "")
-    blocks = get_blocks(page_id, token)
+    blocks = get_blocks(page_id, token, strict=strict)
     return parse_briefs(blocks, token)
 
 
@@ -160,72 +234,199 @@ def _to_do_text(block: dict) -> tuple:
     return text, payload.get("checked", False)
 
 
-def parse_brief_page(blocks: list) -> dict:
+def _environment_title(lower: str) -> bool:
+    return "инфраструктур" in lower or "окружен" in lower or "кластер" in lower
+
+
+# Лимит превью для шага (секции «Продукт»/«Окружение» — полный список, лимит Telegram 4096)
+PREVIEW_MAX = 3600
+
+
+def block_signature(block: dict) -> str:
     """
-    Разбирает блоки страницы брифа.
-    Возвращает:
-      steps: список шагов по heading_2 [{index, title, content_preview}],
-      checklist: список to_do [{text, checked}],
-      sections: словарь по ключам "environment" / "product" — заголовок и превью (по ключевым словам в heading_2).
+    Отпечаток блока: id + last_edited_time + хэш содержимого (тип и его payload).
+    last_edited_time в Notion округлён до минуты — правка в ту же минуту меняет только хэш.
+    Без id и времени (например, в фикстурах) — только хэш.
     """
-    steps = []
-    checklist = []
-    sections = {}
-    current_content = []
+    block_type = block.get("type")
+    raw = json.dumps([block_type, block.get(block_type)], sort_keys=True, ensure_ascii=False).encode("utf-8")
+    digest = hashlib.blake2b(raw, digest_size=8).hexdigest()
+    block_id = block.get("id")
+    edited = block.get("last_edited_time")
+    if block_id and edited:
+        return f"{block_id}@{edited}#{digest}"
+    return digest
+
+
+def _split_brief_blocks(blocks: list) -> tuple[list[list[dict]], list[dict]]:
+    """Разделы шагов (heading_2 + блоки до следующего heading_2) и блоки to_do страницы."""
+    segments = []
+    todos = []
+    for b in blocks:
+        t = b.get("type")
+        if t == "to_do":
+            todos.append(b)
+        elif t == "heading_2":
+            segments.append([b])
+        elif segments:
+            segments[-1].append(b)
+    return segments, todos
 
-    # Лимит превью для шага (секции «Продукт»/«Окружение» — полный список, лимит Telegram 4096)
-    PREVIEW_MAX = 3600
 
-    def flush_content():
-        nonlocal current_content
-        if current_content and steps:
-            steps[-1]["content_preview"] = "\n".join(current_content)[:PREVIEW_MAX]
-        current_content = []
+def _segment_signature(segment: list[dict]) -> str:
+    raw = "|".join(block_signature(b) for b in segment).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
 
-    for b in blocks:
+
+def _parse_step(index: int, segment: list[dict]) -> Step:
+    """Шаг из раздела: заголовок heading_2 и превью из подзаголовков, абзацев и списков."""
+    lines = []
+    for b in segment[1:]:
         t = b.get("type")
         text = _plain_text(b)
+        if t == "heading_3":
+            lines.append(text)
+        elif t == "paragraph" and text:
+            lines.append(text[:400])
+        elif t == "bulleted_list_item" and text:
+            lines.append("• " + text[:280])
+        elif t == "numbered_list_item" and text:
+            lines.append(text[:280])
+    preview = "\n".join(lines)[:PREVIEW_MAX] if lines else ""
+    return Step(index=index, title=intern_text(_plain_text(segment[0])), content_preview=preview)
+
+
+def _parse_checklist_item(block: dict) -> ChecklistItem:
+    item_text, checked = _to_do_text(block)
+    return ChecklistItem(text=intern_text(item_text), checked=bool(checked))
+
 
-        if t == "heading_2":
-            flush_content()
-            current_content = []
-            steps.append({"index": len(steps) + 1, "title": text, "content_preview": ""})
-            # маппинг на кнопки «Окружение» / «Продукт»
-            lower = text.lower()
-            if "инфраструктур" in lower or "окружен" in lower or "кластер" in lower:
-                sections["environment"] = {"title": text, "preview": ""}
-            elif "демо-приложен" in lower or "выбор приложен" in lower or "продукт" in lower:
-                sections["product"] = {"title": text, "preview": ""}
-        elif t == "heading_3" and steps:
-            current_content.append(text)
-        elif t == "paragraph" and text and steps:
-            current_content.append(text[:400])
-        elif t == "to_do":
-            item_text, checked = _to_do_text(b)
-            checklist.append({"text": item_text, "checked": checked})
-        elif t == "bulleted_list_item" and text and steps:
-            current_content.append("• " + text[:280])
-        elif t == "numbered_list_item" and text and steps:
-            current_content.append(text[:280])
-
-    flush_content()
-
-    # превью для секций environment/product — полный текст раздела (до лимита Telegram ~4k)
+def _sections(steps: tuple[Step, ...]) -> dict[str, Section]:
+    """Разделы environment/product по заголовкам шагов (маппинг на кнопки «Окружение» / «Продукт»)."""
+    sections = {}
+    for step in steps:
+        lower = step.title.lower()
+        if _environment_title(lower):
+            sections["environment"] = Section(title=step.title)
+        elif "демо-приложен" in lower or "выбор приложен" in lower or "продукт" in lower:
+            sections["product"] = Section(title=step.title)
+    # превью для секций environment/product — полный текст раздела (до лимита Telegram ~4k);
+    # строки превью общие со Step, без копий.
     for step in steps:
-        lower = step["title"].lower()
-        prev = (step.get("content_preview") or "")[:3600]
-        if "инфраструктур" in lower or "окружен" in lower or "кластер" in lower:
-            sections["environment"] = {"title": step["title"], "preview": prev}
+        lower = step.title.lower()
+        if _environment_title(lower):
+            sections["environment"] = Section(title=step.title, preview=step.content_preview)
         elif "демо-приложен" in lower or "выбор приложен" in lower or "приложен" in lower:
-            sections["product"] = {"title": step["title"], "preview": prev}
+            sections["product"] = Section(title=step.title, preview=step.content_preview)
+    return sections
 
-    return {"steps": steps, "checklist": checklist, "sections": sections}
 
+def _reuse(new_sigs: list[str], old_sigs: tuple[str, ...], old_items: tuple) -> dict[str, object]:
+    """Прежние объекты по отпечатку (только если прежняя версия согласована с отпечатками)."""
+    if len(old_sigs) != len(old_items):
+        return {}
+    wanted = set(new_sigs)
+    return {sig: item for sig, item in zip(old_sigs, old_items) if sig in wanted}
 
-def fetch_brief_content(brief_page_id: str, token: str = None) -> dict:
-    """Загружает контент страницы брифа и возвращает структуру parse_brief_page."""
+
+def _match_signatures(old: tuple[str, ...], new: list[str]) -> tuple[tuple[int, ...], ...]:
+    """
+    Сопоставляет прежние отпечатки с новыми по порядку (SequenceMatcher): (изменённые,
+    добавленные — номера по новой версии, удалённые — по прежней). Замена блока на месте —
+    изменение; лишние с новой стороны — добавления, с прежней — удаления.
+    """
+    changed, added, removed = [], [], []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        paired = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        changed.extend(range(j1 + 1, j1 + paired + 1))
+        added.extend(range(j1 + paired + 1, j2 + 1))
+        removed.extend(range(i1 + paired + 1, i2 + 1))
+    return tuple(changed), tuple(added), tuple(removed)
+
+
+def parse_brief_blocks(
+    blocks: list,
+    previous: BriefContent | None = None,
+    previous_blocks: BriefBlocks | None = None,
+) -> tuple[BriefContent, BriefBlocks, BriefDiff | None]:
+    """
+    Разбирает блоки страницы брифа с учётом прежней версии.
+    Шаги и пункты чеклиста, чьи блоки не менялись (тот же отпечаток block_signature),
+    не перепарсиваются — берутся прежние объекты. Возвращает (контент, отпечатки,
+    изменения); изменения None, если прежней версии с отпечатками нет.
+    """
+    segments, todos = _split_brief_blocks(blocks)
+    step_sigs = [_segment_signature(seg) for seg in segments]
+    item_sigs = [block_signature(b) for b in todos]
+
+    old_steps = _reuse(step_sigs, previous_blocks.steps, previous.steps) if previous and previous_blocks else {}
+    old_items = _reuse(item_sigs, previous_blocks.checklist, previous.checklist) if previous and previous_blocks else {}
+
+    steps = []
+    for i, (sig, seg) in enumerate(zip(step_sigs, segments), 1):
+        step = old_steps.get(sig)
+        if step is None:
+            step = _parse_step(i, seg)
+        elif step.index != i:
+            step = replace(step, index=i)
+        steps.append(step)
+    steps = tuple(steps)
+    checklist = tuple(old_items.get(sig) or _parse_checklist_item(b) for sig, b in zip(item_sigs, todos))
+    sections = _sections(steps)
+
+    content = BriefContent(
+        steps=steps,
+        checklist=checklist,
+        environment=sections.get("environment"),
+        product=sections.get("product"),
+    )
+    hashes = BriefBlocks(steps=tuple(step_sigs), checklist=tuple(item_sigs))
+    diff = None
+    if previous is not None and previous_blocks is not None:
+        steps_changed, steps_added, steps_removed = _match_signatures(previous_blocks.steps, step_sigs)
+        checklist_changed, checklist_added, checklist_removed = _match_signatures(previous_blocks.checklist, item_sigs)
+        diff = BriefDiff(
+            steps_changed=steps_changed,
+            steps_added=steps_added,
+            steps_removed=steps_removed,
+            checklist_changed=checklist_changed,
+            checklist_added=checklist_added,
+            checklist_removed=checklist_removed,
+        )
+    return content, hashes, diff
+
+
+def parse_brief_page(blocks: list) -> BriefContent:
+    """
+    Разбирает блоки страницы брифа.
+    Возвращает BriefContent:
+      steps: шаги по heading_2 (Step: index, title, content_preview),
+      checklist: пункты to_do (ChecklistItem: text, checked),
+      environment / product: заголовок и превью раздела (по ключевым словам в heading_2).
+    """
+    return parse_brief_blocks(blocks)[0]
+
+
+def fetch_brief_blocks(brief_page_id: str, token: str = None, strict: bool = False) -> list:
+    """Блоки страницы брифа (пусто без токена; strict — как в get_blocks)."""
+    token = token or os.environ.get("NOTION_TOKEN")
+    if not strict and (not token or not brief_page_id):
+        return []
+    return get_blocks(brief_page_id, token, strict=strict)
+
+
+def fetch_brief_page(brief_page_id: str, token: str = None) -> tuple[BriefContent, BriefBlocks | None]:
+    """Контент страницы брифа и отпечатки её блоков (без токена — пустой контент и None)."""
     token = token or os.environ.get("NOTION_TOKEN")
     if not token or not brief_page_id:
-        return {"steps": [], "checklist": [], "sections": {}}
-    blocks = get_blocks(brief_page_id, token)
-    return parse_brief_page(blocks)
+        return EMPTY_CONTENT, None
+    content, hashes, _ = parse_brief_blocks(get_blocks(brief_page_id, token))
+    return content, hashes
+
+
+def fetch_brief_content(brief_page_id: str, token: str = None) -> BriefContent:
+    """Загружает контент страницы брифа и возвращает структуру parse_brief_page."""
+    return fetch_brief_page(brief_page_id, token)[0]
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Рендер сообщений и клавиатур бота.
+
+Тексты и клавиатуры, зависящие только от брифа (меню темы, шаги, разделы),
+строятся один раз при загрузке/обновлении брифа (BriefRender) — обработчикам
+остаётся взять готовую пару (text, keyboard) из кэша. InlineKeyboardMarkup
+в python-telegram-bot неизменяемы, поэтому их можно разделять между запросами.
+"""
+from dataclasses import dataclass
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.models import Brief, BriefContent, ChecklistItem, Step
+
+CHECKLIST_PAGE_SIZE = 5
+
+BACK_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("◀ Назад", callback_data="menu_back")]])
+
+
+def back_keyboard() -> InlineKeyboardMarkup:
+    """Кнопка «Назад» в меню раздела."""
+    return BACK_KEYBOARD
+
+
+def topic_only(title: str) -> str:
+    """Убирает префикс 'Бриф для студента: ', оставляет только тему."""
+    if not title:
+        return title
+    prefix = "Бриф для студента: "
+    return title[len(prefix):].strip() if title.startswith(prefix) else title
+
+
+def topic_menu_message(brief: Brief, url: str) -> tuple:
+    """Текст и клавиатура меню выбранной темы (для start и callback)."""
+    title = topic_only(brief.title or "Бриф")
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📄 Открыть бриф в Notion", url=url)],
+        [
+            InlineKeyboardButton("✅ Чеклист", callback_data="menu:checklist"),
+            InlineKeyboardButton("🖥 Окружение", callback_data="menu:environment"),
+        ],
+        [
+            InlineKeyboardButton("📦 Продукт", callback_data="menu:product"),
+            InlineKeyboardButton("📋 Шаги по порядку", callback_data="menu:steps"),
+        ],
+        [
+            InlineKeyboardButton("🆘 Нужна помощь", callback_data="menu:help"),
+            InlineKeyboardButton("📅 Нужен прогон/встреча", callback_data="menu:meeting"),
+        ],
+        [InlineKeyboardButton("❓ FAQ", callback_data="menu:faq")],
+    ])
+    return f"Тема: {title}\n\nВыберите раздел или откройте бриф в Notion:", keyboard
+
+
+TOPIC_PAGE_SIZE = 8
+TOPIC_SEARCH_LIMIT = 40
+# Служебная страница на странице брифов — не тема
+_NOT_A_TOPIC_PREFIX = "Задачи для ВКР"
+
+
+@dataclass(frozen=True, slots=True)
+class TopicEntry:
+    """Тема в индексе выбора: индекс брифа, подпись кнопки и ключ поиска."""
+    brief_index: int
+    label: str
+    key: str
+
+
+def build_topic_index(briefs: list[Brief]) -> tuple[TopicEntry, ...]:
+    """Индекс тем (один раз при загрузке списка): только child_page, без «Задачи для ВКР»."""
+    entries = []
+    for i, b in enumerate(briefs):
+        if not b.is_page or b.title.startswith(_NOT_A_TOPIC_PREFIX):
+            continue
+        topic = topic_only(b.title)
+        entries.append(TopicEntry(brief_index=i, label=topic[:50], key=topic.casefold()))
+    return tuple(entries)
+
+
+def search_topics(index: tuple[TopicEntry, ...], query: str) -> list[TopicEntry]:
+    """Темы по запросу: сначала совпадение с началом названия или слова, потом по подстроке."""
+    q = query.strip().casefold()
+    if not q:
+        return list(index)
+    prefix, word_prefix, substring = [], [], []
+    for entry in index:
+        pos = entry.key.find(q)
+        if pos < 0:
+            continue
+        if pos == 0:
+            prefix.append(entry)
+        elif not entry.key[pos - 1].isalnum():
+            word_prefix.append(entry)
+        else:
+            substring.append(entry)
+    return (prefix + word_prefix + substring)[:TOPIC_SEARCH_LIMIT]
+
+
+def topic_picker(entries: list[TopicEntry], page: int, header: str = "Выберите тему ВКР:", nav_prefix: str = "topics") -> tuple:
+    """Страница выбора темы: TOPIC_PAGE_SIZE кнопок, навигация nav_prefix:<page> и кнопка поиска."""
+    total_pages = max(1, (len(entries) + TOPIC_PAGE_SIZE - 1) // TOPIC_PAGE_SIZE)
+    page = max(0, min(page, total_pages - 1))
+    start = page * TOPIC_PAGE_SIZE
+    buttons = [
+        [InlineKeyboardButton(e.label, callback_data=f"brief:{e.brief_index}")]
+        for e in entries[start : start + TOPIC_PAGE_SIZE]
+    ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀ Пред", callback_data=f"{nav_prefix}:{page - 1}"))
+    if page < total_pages - 1:
+        nav.append(InlineKeyboardButton("След ▶", callback_data=f"{nav_prefix}:{page + 1}"))
+    if nav:
+        buttons.append(nav)
+    buttons.append([InlineKeyboardButton("🔍 Найти тему", callback_data="topics_search")])
+    text = header
+    if total_pages > 1:
+        text += f"\n\nСтраница {page + 1} из {total_pages}"
+    return text, InlineKeyboardMarkup(buttons)
+
+
+def render_topic_pages(index: tuple[TopicEntry, ...]) -> tuple[tuple, ...]:
+    """Все страницы полного списка тем (пре-рендер вместе со списком брифов)."""
+    total_pages = max(1, (len(index) + TOPIC_PAGE_SIZE - 1) // TOPIC_PAGE_SIZE)
+    return tuple(topic_picker(list(index), page) for page in range(total_pages))
+
+
+def checklist_message(items: tuple[ChecklistItem, ...], checked: set, url: str, brief_index: int, page: int = 0) -> tuple:
+    """Текст чеклиста и клавиатура: только неотмеченные, по 5 на страницу, без дублей по тексту."""
+    seen_text = set()
+    unchecked = []
+    for i in range(len(items)):
+        if i in checked:
+            continue
+        t = items[i].text.strip()
+        if not t or t in seen_text:
+            continue
+        seen_text.add(t)
+        unchecked.append(i)
+    total = len(items)
+    left = len(unchecked)
+    if left == 0:
+        text = f"Чеклист: все пункты отмечены.\n\nВсего было {total} пунктов.\n\nПодробнее в Notion: {url}"
+        return text, BACK_KEYBOARD
+    total_pages = max(1, (left + CHECKLIST_PAGE_SIZE - 1) // CHECKLIST_PAGE_SIZE)
+    page = max(0, min(page, total_pages - 1))
+    start = page * CHECKLIST_PAGE_SIZE
+    page_indices = unchecked[start : start + CHECKLIST_PAGE_SIZE]
+    lines = [f"Чеклист (осталось {left} из {total}):\n"]
+    buttons = []
+    for num, i in enumerate(page_indices, 1):
+        line_text = items[i].text[:55]
+        lines.append(f"☐ {num}. {line_text}")
+        buttons.append([InlineKeyboardButton(f"☐ {num}", callback_data=f"chk:{brief_index}:{i}")])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀ Пред", callback_data=f"clpage:{brief_index}:{page - 1}"))
+    if page < total_pages - 1:
+        nav.append(InlineKeyboardButton("След ▶", callback_data=f"clpage:{brief_index}:{page + 1}"))
+    if nav:
+        buttons.append(nav)
+    buttons.append([InlineKeyboardButton("◀ Назад", callback_data="menu_back")])
+    text = "\n".join(lines) + f"\n\nПодробнее в Notion: {url}"
+    return text, InlineKeyboardMarkup(buttons)
+
+
+def format_step(step: Step, num: int, total: int, url: str) -> str:
+    title = step.title
+    preview = step.content_preview
+    return f"Шаг {num}/{total}: {title}\n\n{preview}\n\nПодробнее в Notion: {url}"
+
+
+def steps_keyboard(current: int, total: int, url: str) -> InlineKeyboardMarkup:
+    rows = []
+    nav = []
+    if current > 0:
+        nav.append(InlineKeyboardButton("◀ Пред", callback_data="step:prev"))
+    if current < total - 1:
+        nav.append(InlineKeyboardButton("След ▶", callback_data="step:next"))
+    if nav:
+        rows.append(nav)
+    rows.append(
+        [
+            InlineKeyboardButton("✅ Я прошёл этот шаг", callback_data=f"stepdone:{current}"),
+            InlineKeyboardButton("В меню", callback_data="menu_back"),
+        ]
+    )
+    return InlineKeyboardMarkup(rows)
+
+
+def _section_text(emoji: str, title: str, preview: str, url: str) -> str:
+    if not preview:
+        return f"{emoji} {title}\n\nПодробности в брифе в Notion: {url}"
+    return f"{emoji} {title}\n\n{preview}\n\nОткрыть раздел в Notion: {url}"
+
+
+@dataclass(frozen=True, slots=True)
+class BriefRender:
+    """Готовые тексты и клавиатуры одного брифа (кроме чеклиста — он зависит от отметок студента)."""
+    url: str
+    steps: tuple[tuple[str, InlineKeyboardMarkup], ...]
+    environment: str
+    product: str
+    no_steps: str
+    no_checklist: str
+    all_steps_done: str
+
+
+def render_brief(
+    content: BriefContent,
+    url: str,
+    previous: BriefRender | None = None,
+    previous_steps: tuple[Step, ...] = (),
+) -> BriefRender:
+    """
+    Пре-рендер всех экранов брифа, кроме чеклиста.
+    previous / previous_steps — прежний рендер и шаги, по которым он построен: экраны шагов,
+    оставшихся теми же объектами на тех же местах (при том же числе шагов), берутся готовыми.
+    """
+    total = len(content.steps)
+    env = content.environment
+    prod = content.product
+    reuse = (
+        previous is not None and previous.url == url
+        and len(previous.steps) == len(previous_steps) == total
+    )
+    return BriefRender(
+        url=url,
+        steps=tuple(
+            previous.steps[i] if reuse and step is previous_steps[i]
+            else (format_step(step, i + 1, total, url), steps_keyboard(i, total, url))
+            for i, step in enumerate(content.steps)
+        ),
+        environment=_section_text(
+            "🖥", env.title if env else "Окружение / инфраструктура", env.preview if env else "", url
+        ),
+        product=_section_text(
+            "📦", prod.title if prod else "Выбор демо-приложения / продукта", prod.preview if prod else "", url
+        ),
+        no_steps=f"Шаги не найдены.\n\nОткройте бриф в Notion: {url}",
+        no_checklist="Чеклист в брифе не найден.\n\nОткройте бриф в Notion: " + url,
+        all_steps_done=f"Все шаги по теме пройдены! 🎉\n\nПодробнее в Notion: {url}",
+    )
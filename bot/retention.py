@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Хранение данных: перенос старых записей из рабочих таблиц в архивную базу
+и возврат освобождённых страниц файлу (auto_vacuum=INCREMENTAL).
+
+В архив (отдельный файл, ATTACH) уходят:
+- закрытые заявки старше VKR_ARCHIVE_RESOLVED_DAYS;
+- журнал шагов, уже учтённый в дневных сводках и старше VKR_ARCHIVE_PROGRESS_DAYS;
+- отметки чеклиста студентов, у которых бриф завершён раньше
+  VKR_ARCHIVE_PROGRESS_DAYS (выпускники прошлых потоков).
+Завершения брифов (progress) остаются в рабочей базе: по ним выпускник отличается
+от бездействующего студента (напоминания, /export), а строк там по одной на бриф.
+Перенос — пачками по ARCHIVE_BATCH строк, каждая пачка в своей транзакции,
+чтобы запись студентов не ждала весь перенос.
+"""
+import logging
+import os
+import sqlite3
+import time
+
+from bot.database import DB_PATH, get_connection, get_meta
+from bot.metrics import inc, timed
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DB_PATH = os.environ.get("VKR_ARCHIVE_DB_PATH") or os.path.splitext(DB_PATH)[0] + ".archive.db"
+RESOLVED_DAYS = int(os.environ.get("VKR_ARCHIVE_RESOLVED_DAYS", "30"))
+PROGRESS_DAYS = int(os.environ.get("VKR_ARCHIVE_PROGRESS_DAYS", "365"))
+ARCHIVE_BATCH = 500
+# Страниц за один incremental_vacuum (по 4 КБ — до ~8 МБ за проход)
+VACUUM_PAGES = 2000
+
+# Архивные таблицы: те же колонки + archived_at
+_ARCHIVE_TABLES = {
+    "help_requests": "id INTEGER PRIMARY KEY, user_id INTEGER, kind TEXT, comment TEXT, created_at TEXT, resolved INTEGER",
+    "step_log": "id INTEGER PRIMARY KEY, user_id INTEGER, brief_index INTEGER, step_index INTEGER, reached_at TEXT",
+    "checklist_progress": "user_id INTEGER, brief_index INTEGER, item_index INTEGER, completed_at TEXT",
+}
+
+
+def _columns(table: str) -> str:
+    return ", ".join(c.split()[0] for c in _ARCHIVE_TABLES[table].split(", "))
+
+
+def _attach_archive(conn: sqlite3.Connection):
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+    for table, columns in _ARCHIVE_TABLES.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS archive.{table} ({columns}, archived_at TEXT DEFAULT (datetime('now')))")
+    conn.commit()
+
+
+def _move_batched(conn: sqlite3.Connection, table: str, where: str, params: tuple) -> int:
+    """Переносит строки main.table, подходящие под where, в archive.table пачками; возвращает число строк."""
+    cols = _columns(table)
+    moved = 0
+    while True:
+        rowids = [r[0] for r in conn.execute(
+            f"SELECT rowid FROM main.{table} WHERE {where} ORDER BY rowid LIMIT ?", (*params, ARCHIVE_BATCH)
+        )]
+        if not rowids:
+            return moved
+        marks = ",".join("?" * len(rowids))
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO archive.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE rowid IN ({marks})",
+                rowids,
+            )
+            conn.execute(f"DELETE FROM main.{table} WHERE rowid IN ({marks})", rowids)
+        moved += len(rowids)
+        if len(rowids) < ARCHIVE_BATCH:
+            return moved
+        time.sleep(0)  # отдаём GIL/блокировку между пачками
+
+
+def ensure_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """Переводит базу в auto_vacuum=INCREMENTAL (для существующего файла — один полный VACUUM)."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    logger.info("База переведена в auto_vacuum=INCREMENTAL")
+    return True
+
+
+@timed("job.archive_old_data")
+def archive_old_data() -> dict:
+    """Перенос старых данных в архив и incremental_vacuum. Возвращает число перенесённых строк по таблицам."""
+    resolved_cutoff = f"-{RESOLVED_DAYS} days"
+    progress_cutoff = f"-{PROGRESS_DAYS} days"
+    # Журнал шагов — только то, что уже попало в дневные сводки
+    rolled_up_step_id = int(get_meta("rollup.steps_reached", "0"))
+    conn = get_connection()
+    moved = {}
+    try:
+        ensure_incremental_vacuum(conn)
+        _attach_archive(conn)
+        moved["help_requests"] = _move_batched(
+            conn, "help_requests",
+            "resolved = 1 AND created_at < datetime('now', ?)", (resolved_cutoff,),
+        )
+        moved["step_log"] = _move_batched(
+            conn, "step_log",
+            "id <= ? AND reached_at < datetime('now', ?)", (rolled_up_step_id, progress_cutoff),
+        )
+        # Выпускники: бриф завершён давно — их отметки чеклиста больше не «горячие».
+        # Сами завершения не переносим: без них выпускник снова считается бездействующим.
+        finished = (
+            "user_id IN (SELECT user_id FROM main.progress GROUP BY user_id"
+            " HAVING MAX(completed_at) < datetime('now', ?))"
+        )
+        moved["checklist_progress"] = _move_batched(conn, "checklist_progress", finished, (progress_cutoff,))
+        conn.execute("DETACH DATABASE archive")
+        freed = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # incremental_vacuum освобождает по странице за шаг, а execute() делает только первый —
+        # executescript выполняет прагму до конца
+        conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+        moved["vacuumed_pages"] = freed - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    for table, n in moved.items():
+        if n:
+            inc(f"archive.{table}", n)
+    return moved
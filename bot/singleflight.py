@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight: не больше одного одновременного вызова на ключ.
+
+Пока загрузка по ключу (например, page_id брифа) в процессе, остальные
+вызывающие ждут её результата вместо собственного запроса к Notion.
+Блокирующая функция выполняется в пуле потоков (asyncio.to_thread).
+"""
+import asyncio
+from collections.abc import Callable, Hashable
+
+from bot.metrics import inc
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Hashable, func: Callable, *args):
+        """Результат func(*args); параллельные вызовы с тем же key получают один и тот же результат (или исключение)."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            inc(f"{self.name}.calls")
+        else:
+            inc(f"{self.name}.coalesced")
+        # shield: отмена одного ожидающего не отменяет общую загрузку
+        return await asyncio.shield(task)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище бота: протокол Storage и выбор реализации по VKR_STORAGE.
+
+- sqlite (по умолчанию) — модуль bot.database, один файл VKR_DB_PATH;
+- memory — всё в памяти процесса (тесты, бенчмарки);
+- postgres — PostgreSQL с пулом соединений (VKR_DATABASE_URL), несколько реплик бота
+  могут работать с одной базой. Нужен пакет psycopg[pool] (requirements-postgres.txt);
+  импортируется, только если выбран этот бэкенд.
+
+Асинхронный код (обработчики, задачи) обращается к хранилищу через adb:
+await adb.ensure_student(...). Вызовы PostgreSQL (сетевой round trip) уходят в пул
+потоков и не блокируют цикл событий; SQLite и память вызываются напрямую.
+Синхронный код (скрипты, задачи в пуле потоков) — через db: db.ensure_student(...).
+"""
+import asyncio
+import os
+from collections.abc import Iterator
+from typing import Protocol
+
+STORAGE_BACKEND = os.environ.get("VKR_STORAGE", "sqlite").strip().lower() or "sqlite"
+
+
+class Storage(Protocol):
+    """Операции хранилища, которыми пользуется бот (сигнатуры и семантика — как в bot.database)."""
+
+    def init_db(self) -> None: ...
+    def pending_help_count(self) -> int: ...
+    def db_file_sizes(self) -> dict: ...
+
+    # студенты и прогресс
+    def ensure_student(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None): ...
+    def set_selected_brief(self, user_id: int, brief_index: int): ...
+    def get_selected_brief(self, user_id: int) -> int | None: ...
+    def clear_selected_brief(self, user_id: int): ...
+    def clear_checklist_progress(self, user_id: int) -> int: ...
+    def set_checklist_item(self, user_id: int, brief_index: int, item_index: int, completed: bool): ...
+    def set_checklist_items(self, user_id: int, brief_index: int, states: dict[int, bool]): ...
+    def get_checklist_checked(self, user_id: int, brief_index: int) -> set: ...
+    def set_current_step(self, user_id: int, step_index: int): ...
+    def get_current_step(self, user_id: int) -> int | None: ...
+    def mark_brief_done(self, user_id: int, brief_index: int): ...
+    def get_all_students_with_progress(self) -> list[dict]: ...
+    def upsert_students(self, rows: list[tuple]) -> int: ...
+    def iter_export_rows(self, chunk_size: int = 500) -> Iterator[tuple]: ...
+
+    # заявки
+    def add_help_request(self, user_id: int, kind: str, comment: str = "") -> int: ...
+    def get_open_help_requests_page(self, after_id: int = 0, limit: int = 5) -> tuple[list[dict], bool]: ...
+    def resolve_help_request(self, request_id: int) -> int: ...
+    def resolve_help_requests_for_user(self, user_id: int) -> int: ...
+    def get_help_digest(self, limit: int = 20) -> dict: ...
+
+    # FAQ
+    def add_faq(self, question: str, answer: str, created_by: int | None = None) -> int: ...
+    def list_faq(self, limit: int | None = 20) -> list[dict]: ...
+    def search_faq(self, query: str, limit: int = 10) -> list[dict]: ...
+    def count_faq(self) -> int: ...
+    def upsert_faq(self, rows: list[tuple], created_by: int | None = None) -> int: ...
+
+    # служебное и сводки
+    def get_meta(self, key: str, default: str | None = None) -> str | None: ...
+    def set_meta(self, key: str, value: str): ...
+    def rollup_progress(self) -> dict: ...
+    def get_trend(self, days: int = 14) -> tuple[list[dict], list[dict]]: ...
+
+    # рассылки
+    def create_broadcast(self, text: str, created_by: int | None = None) -> tuple[int, int]: ...
+    def claim_broadcast_recipient(self, broadcast_id: int) -> int | None: ...
+    def set_broadcast_status(self, broadcast_id: int, user_id: int, status: str, error: str | None = None): ...
+    def abandon_broadcast_sends(self, broadcast_id: int, error: str = "прервано перезапуском") -> int: ...
+    def finish_broadcast(self, broadcast_id: int): ...
+    def get_unfinished_broadcasts(self) -> list[dict]: ...
+    def list_broadcasts(self, limit: int = 5) -> list[dict]: ...
+    def get_broadcast_counts(self, broadcast_id: int) -> dict[str, int]: ...
+
+    # бездействующие студенты
+    def get_stalled_students(self, idle_days: int, limit: int | None = None, only_unnudged: bool = False) -> list[dict]: ...
+    def count_stalled_students(self, idle_days: int) -> int: ...
+    def mark_nudged(self, user_ids: list[int]): ...
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    """Реализация хранилища по имени (импорт — только выбранной, psycopg нужен лишь для postgres)."""
+    if backend == "sqlite":
+        from bot import database
+        return database
+    if backend == "memory":
+        from bot.storage_memory import MemoryStorage
+        return MemoryStorage()
+    if backend in ("postgres", "postgresql"):
+        from bot.storage_postgres import PostgresStorage
+        return PostgresStorage(os.environ.get("VKR_DATABASE_URL", ""))
+    raise ValueError(f"Неизвестное хранилище VKR_STORAGE={backend} (sqlite, memory, postgres)")
+
+
+class AsyncStorage:
+    """Асинхронная обёртка над Storage: те же методы, await adb.<метод>(...)."""
+
+    def __init__(self, storage: Storage, offload: bool):
+        self._storage = storage
+        # True — вызовы в пуле потоков (asyncio.to_thread): сетевой бэкенд не держит цикл событий
+        self._offload = offload
+
+    def __getattr__(self, name: str):
+        func = getattr(self._storage, name)
+        if self._offload:
+            async def call(*args, **kwargs):
+                return await asyncio.to_thread(func, *args, **kwargs)
+        else:
+            async def call(*args, **kwargs):
+                return func(*args, **kwargs)
+        call.__name__ = name
+        setattr(self, name, call)  # следующие обращения — без __getattr__
+        return call
+
+
+def offloads(backend: str = STORAGE_BACKEND) -> bool:
+    """Нужно ли выполнять вызовы бэкенда вне цикла событий (сетевые базы)."""
+    return backend in ("postgres", "postgresql")
+
+
+db: Storage = create_storage()
+adb = AsyncStorage(db, offload=offloads())
@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище в памяти процесса (VKR_STORAGE=memory): для тестов и бенчмарков.
+
+Повторяет семантику bot.database на словарях; данные живут до перезапуска.
+Методы берут общий замок — их вызывают и из цикла событий, и из пула потоков
+(импорт, выгрузка, ночные задачи).
+"""
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from itertools import count
+
+from bot.database import BROADCAST_STATUSES, DIGEST_WATERMARK_KEY, day_offset_minutes
+from bot.metrics import timed
+
+
+def _now() -> str:
+    """Время в формате datetime('now') SQLite (UTC)."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _ago(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _local_day(at: str, offset: timedelta) -> str:
+    """Местные сутки (BOT_TZ) для времени в формате _now()."""
+    return (datetime.strptime(at, "%Y-%m-%d %H:%M:%S") + offset).strftime("%Y-%m-%d")
+
+
+class MemoryStorage:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.students: dict[int, dict] = {}
+        self.progress: dict[tuple[int, int], str] = {}
+        self.checklist: dict[tuple[int, int], dict[int, str]] = {}
+        self.help_requests: dict[int, dict] = {}
+        self.faq: dict[int, dict] = {}
+        self.step_log: list[tuple] = []
+        self.rollup: dict[tuple[str, int], list[int]] = {}
+        self.meta: dict[str, str] = {}
+        self.broadcasts: dict[int, dict] = {}
+        self.broadcast_recipients: dict[int, dict[int, dict]] = {}
+        self._help_ids = count(1)
+        self._faq_ids = count(1)
+        self._broadcast_ids = count(1)
+        self._pending = 0
+
+    def init_db(self):
+        pass
+
+    def pending_help_count(self) -> int:
+        return self._pending
+
+    def db_file_sizes(self) -> dict:
+        return {"db": 0, "wal": 0, "journal": 0}
+
+    # --- Студенты и прогресс ---
+
+    @timed("db.ensure_student")
+    def ensure_student(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        with self._lock:
+            s = self.students.setdefault(user_id, {
+                "selected_brief_index": None, "current_step_index": None, "created_at": _now(),
+                "last_activity_at": _now(), "nudged_at": None,
+            })
+            s.update(username=username, first_name=first_name, last_name=last_name)
+
+    @timed("db.set_selected_brief")
+    def set_selected_brief(self, user_id: int, brief_index: int):
+        with self._lock:
+            if user_id in self.students:
+                self.students[user_id]["selected_brief_index"] = brief_index
+
+    @timed("db.get_selected_brief")
+    def get_selected_brief(self, user_id: int) -> int | None:
+        s = self.students.get(user_id)
+        return s["selected_brief_index"] if s else None
+
+    @timed("db.clear_selected_brief")
+    def clear_selected_brief(self, user_id: int):
+        with self._lock:
+            if user_id in self.students:
+                self.students[user_id].update(selected_brief_index=None, current_step_index=None)
+            self._clear_checklist(user_id)
+
+    def _clear_checklist(self, user_id: int) -> int:
+        keys = [k for k in self.checklist if k[0] == user_id]
+        return sum(len(self.checklist.pop(k)) for k in keys)
+
+    @timed("db.clear_checklist_progress")
+    def clear_checklist_progress(self, user_id: int) -> int:
+        with self._lock:
+            return self._clear_checklist(user_id)
+
+    @timed("db.set_checklist_item")
+    def set_checklist_item(self, user_id: int, brief_index: int, item_index: int, completed: bool):
+        with self._lock:
+            items = self.checklist.setdefault((user_id, brief_index), {})
+            if completed:
+                items.setdefault(item_index, _now())
+            else:
+                items.pop(item_index, None)
+            self._touch(user_id)
+
+    @timed("db.set_checklist_items")
+    def set_checklist_items(self, user_id: int, brief_index: int, states: dict[int, bool]):
+        with self._lock:
+            items = self.checklist.setdefault((user_id, brief_index), {})
+            for item_index, completed in states.items():
+                if completed:
+                    items.setdefault(item_index, _now())
+                else:
+                    items.pop(item_index, None)
+            self._touch(user_id)
+
+    @timed("db.get_checklist_checked")
+    def get_checklist_checked(self, user_id: int, brief_index: int) -> set:
+        with self._lock:
+            return set(self.checklist.get((user_id, brief_index), ()))
+
+    @timed("db.set_current_step")
+    def set_current_step(self, user_id: int, step_index: int):
+        with self._lock:
+            s = self.students.get(user_id)
+            if s is None:
+                return
+            if s["current_step_index"] != step_index:
+                self.step_log.append((len(self.step_log) + 1, user_id, s["selected_brief_index"], step_index, _now()))
+            s["current_step_index"] = step_index
+            s["last_activity_at"] = _now()
+
+    @timed("db.get_current_step")
+    def get_current_step(self, user_id: int) -> int | None:
+        s = self.students.get(user_id)
+        return s["current_step_index"] if s else None
+
+    @timed("db.mark_brief_done")
+    def mark_brief_done(self, user_id: int, brief_index: int):
+        with self._lock:
+            self.progress.setdefault((user_id, brief_index), _now())
+            self._touch(user_id)
+
+    def _touch(self, user_id: int):
+        s = self.students.get(user_id)
+        if s is not None:
+            s["last_activity_at"] = _now()
+
+    @timed("db.get_all_students_with_progress")
+    def get_all_students_with_progress(self) -> list[dict]:
+        with self._lock:
+            rows = [
+                {
+                    "user_id": uid, "username": s["username"], "first_name": s["first_name"],
+                    "last_name": s["last_name"], "selected_brief_index": s["selected_brief_index"],
+                    "current_step_index": s["current_step_index"],
+                }
+                for uid, s in self.students.items()
+            ]
+        # NULL в SQLite сортируется первым
+        rows.sort(key=lambda r: (r["first_name"] is not None, r["first_name"] or "", r["last_name"] is not None, r["last_name"] or ""))
+        return rows
+
+    @timed("db.upsert_students")
+    def upsert_students(self, rows: list[tuple]) -> int:
+        with self._lock:
+            for user_id, username, first_name, last_name, brief_index in rows:
+                s = self.students.setdefault(user_id, {
+                    "username": None, "first_name": None, "last_name": None,
+                    "selected_brief_index": None, "current_step_index": None, "created_at": _now(),
+                    "last_activity_at": _now(), "nudged_at": None,
+                })
+                for key, value in (("username", username), ("first_name", first_name),
+                                   ("last_name", last_name), ("selected_brief_index", brief_index)):
+                    if value is not None:
+                        s[key] = value
+        return len(rows)
+
+    def iter_export_rows(self, chunk_size: int = 500):
+        with self._lock:
+            user_ids = sorted(self.students)
+        for start in range(0, len(user_ids), chunk_size):
+            with self._lock:
+                chunk = []
+                for uid in user_ids[start : start + chunk_size]:
+                    s = self.students.get(uid)
+                    if s is None:
+                        continue
+                    requests = [r for r in self.help_requests.values() if r["user_id"] == uid]
+                    chunk.append((
+                        uid, s["username"], s["first_name"], s["last_name"],
+                        s["selected_brief_index"], s["current_step_index"],
+                        len(self.checklist.get((uid, s["selected_brief_index"]), ())),
+                        sum(1 for (u, _) in self.progress if u == uid),
+                        len(requests),
+                        sum(1 for r in requests if not r["resolved"]),
+                        s["created_at"],
+                    ))
+            yield from chunk
+
+    # --- Заявки ---
+
+    @timed("db.add_help_request")
+    def add_help_request(self, user_id: int, kind: str, comment: str = "") -> int:
+        with self._lock:
+            rid = next(self._help_ids)
+            self.help_requests[rid] = {
+                "id": rid, "user_id": user_id, "kind": kind, "comment": comment,
+                "created_at": _now(), "resolved": 0,
+            }
+            self._pending += 1
+            return rid
+
+    def _with_student(self, r: dict) -> dict:
+        s = self.students.get(r["user_id"]) or {}
+        return {
+            "id": r["id"], "user_id": r["user_id"], "kind": r["kind"], "comment": r["comment"],
+            "created_at": r["created_at"], "username": s.get("username"),
+            "first_name": s.get("first_name"), "last_name": s.get("last_name"),
+        }
+
+    def _open_sorted(self) -> list[dict]:
+        return sorted(
+            (r for r in self.help_requests.values() if not r["resolved"]),
+            key=lambda r: (r["created_at"], r["id"]),
+        )
+
+    @timed("db.get_open_help_requests_page")
+    def get_open_help_requests_page(self, after_id: int = 0, limit: int = 5) -> tuple[list[dict], bool]:
+        with self._lock:
+            after = self.help_requests.get(after_id)
+            key = (after["created_at"], after_id) if after else ("", after_id)
+            rows = [r for r in self._open_sorted() if (r["created_at"], r["id"]) > key]
+            return [self._with_student(r) for r in rows[:limit]], len(rows) > limit
+
+    def _resolve(self, requests) -> int:
+        n = 0
+        for r in requests:
+            if not r["resolved"]:
+                r["resolved"] = 1
+                n += 1
+        self._pending = max(0, self._pending - n)
+        return n
+
+    @timed("db.resolve_help_request")
+    def resolve_help_request(self, request_id: int) -> int:
+        with self._lock:
+            r = self.help_requests.get(request_id)
+            return self._resolve([r] if r else [])
+
+    @timed("db.resolve_help_requests_for_user")
+    def resolve_help_requests_for_user(self, user_id: int) -> int:
+        with self._lock:
+            return self._resolve([r for r in self.help_requests.values() if r["user_id"] == user_id])
+
+    @timed("db.get_help_digest")
+    def get_help_digest(self, limit: int = 20) -> dict:
+        with self._lock:
+            raw = self.meta.get(DIGEST_WATERMARK_KEY, "|0")
+            wm_at, _, wm_id = raw.partition("|")
+            wm = (wm_at, int(wm_id or 0))
+            new, older = [], []
+            for r in self._open_sorted():
+                (new if (r["created_at"], r["id"]) > wm else older).append(r)
+            by_kind = {}
+            for r in older:
+                by_kind[r["kind"]] = by_kind.get(r["kind"], 0) + 1
+            return {
+                "new": [self._with_student(r) for r in new[:limit]],
+                "new_total": len(new),
+                "older": by_kind,
+                "oldest_at": older[0]["created_at"] if older else None,
+                "watermark": f"{new[-1]['created_at']}|{new[-1]['id']}" if new else raw,
+            }
+
+    # --- FAQ ---
+
+    @timed("db.add_faq")
+    def add_faq(self, question: str, answer: str, created_by: int | None = None) -> int:
+        with self._lock:
+            faq_id = next(self._faq_ids)
+            self.faq[faq_id] = {
+                "id": faq_id, "question": question, "answer": answer,
+                "created_by": created_by, "created_at": _now(),
+            }
+            return faq_id
+
+    @timed("db.list_faq")
+    def list_faq(self, limit: int | None = 20) -> list[dict]:
+        with self._lock:
+            rows = [dict(self.faq[i]) for i in sorted(self.faq)]
+        return rows if limit is None else rows[:limit]
+
+    @timed("db.search_faq")
+    def search_faq(self, query: str, limit: int = 10) -> list[dict]:
+        """Все слова запроса — префиксы слов записи; совпадения в вопросе весят больше."""
+        words = re.findall(r"\w+", query.lower())[:10]
+        if not words:
+            return []
+        scored = []
+        with self._lock:
+            entries = list(self.faq.values())
+        for e in entries:
+            q_words = re.findall(r"\w+", e["question"].lower())
+            a_words = re.findall(r"\w+", e["answer"].lower())
+            score = 0
+            for w in words:
+                in_q = sum(1 for x in q_words if x.startswith(w))
+                in_a = sum(1 for x in a_words if x.startswith(w))
+                if not in_q and not in_a:
+                    break
+                score += 4 * in_q + in_a
+            else:
+                scored.append((-score, e["id"], e))
+        scored.sort(key=lambda t: t[:2])
+        return [
+            {"id": e["id"], "question": e["question"], "answer": e["answer"], "snippet": e["answer"][:120]}
+            for _, _, e in scored[:limit]
+        ]
+
+    @timed("db.count_faq")
+    def count_faq(self) -> int:
+        return len(self.faq)
+
+    @timed("db.upsert_faq")
+    def upsert_faq(self, rows: list[tuple], created_by: int | None = None) -> int:
+        with self._lock:
+            by_question = {e["question"]: e for e in self.faq.values()}
+            for faq_id, question, answer in rows:
+                if faq_id is not None:
+                    e = self.faq.get(faq_id)
+                    if e is None:
+                        self.faq[faq_id] = e = {"id": faq_id, "created_by": created_by, "created_at": _now()}
+                        # следующий автоматический id — после максимального, как AUTOINCREMENT
+                        self._faq_ids = count(max(self.faq) + 1)
+                    e.update(question=question, answer=answer)
+                    by_question[question] = e
+                elif question in by_question:
+                    by_question[question]["answer"] = answer
+                else:
+                    by_question[question] = self.faq[self.add_faq(question, answer, created_by)]
+        return len(rows)
+
+    # --- Служебное и сводки ---
+
+    def get_meta(self, key: str, default: str | None = None) -> str | None:
+        return self.meta.get(key, default)
+
+    def set_meta(self, key: str, value: str):
+        self.meta[key] = value
+
+    def _add_rollup(self, column: int, events) -> int:
+        n = 0
+        for day, brief_index in events:
+            if brief_index is None:
+                continue
+            self.rollup.setdefault((day, brief_index), [0, 0, 0])[column] += 1
+            n += 1
+        return n
+
+    @timed("db.rollup_progress")
+    def rollup_progress(self) -> dict:
+        offset = timedelta(minutes=day_offset_minutes())
+        with self._lock:
+            time_hi = (datetime.now(timezone.utc) - timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")
+            step_lo = int(self.meta.get("rollup.steps_reached", "0"))
+            cl_lo = self.meta.get("rollup.checklist_done", "")
+            pr_lo = self.meta.get("rollup.briefs_done", "")
+            added = {
+                "steps_reached": self._add_rollup(0, (
+                    (_local_day(at, offset), b) for sid, _, b, _, at in self.step_log if sid > step_lo
+                )),
+                "checklist_done": self._add_rollup(1, (
+                    (_local_day(at, offset), b) for (_, b), items in self.checklist.items()
+                    for at in items.values() if cl_lo < at <= time_hi
+                )),
+                "briefs_done": self._add_rollup(2, (
+                    (_local_day(at, offset), b) for (_, b), at in self.progress.items() if pr_lo < at <= time_hi
+                )),
+            }
+            self.meta["rollup.steps_reached"] = str(len(self.step_log))
+            self.meta["rollup.checklist_done"] = time_hi
+            self.meta["rollup.briefs_done"] = time_hi
+            return added
+
+    @timed("db.get_trend")
+    def get_trend(self, days: int = 14) -> tuple[list[dict], list[dict]]:
+        since = _local_day(_ago(max(1, days) - 1), timedelta(minutes=day_offset_minutes()))
+        by_day: dict[str, list[int]] = {}
+        by_brief: dict[int, list[int]] = {}
+        with self._lock:
+            for (day, brief_index), counts in self.rollup.items():
+                if day < since:
+                    continue
+                for target in (by_day.setdefault(day, [0, 0, 0]), by_brief.setdefault(brief_index, [0, 0, 0])):
+                    for i in range(3):
+                        target[i] += counts[i]
+        keys = ("steps_reached", "checklist_done", "briefs_done")
+        return (
+            [{"day": d, **dict(zip(keys, c))} for d, c in sorted(by_day.items())],
+            [
+                {"brief_index": b, **dict(zip(keys, c))}
+                for b, c in sorted(by_brief.items(), key=lambda t: -(t[1][0] + t[1][1]))
+            ],
+        )
+
+    # --- Рассылки ---
+
+    @timed("db.create_broadcast")
+    def create_broadcast(self, text: str, created_by: int | None = None) -> tuple[int, int]:
+        with self._lock:
+            broadcast_id = next(self._broadcast_ids)
+            self.broadcasts[broadcast_id] = {
+                "id": broadcast_id, "text": text, "created_by": created_by, "created_at": _now(), "finished_at": None,
+            }
+            self.broadcast_recipients[broadcast_id] = {
+                uid: {"status": "pending", "error": None, "updated_at": _now()} for uid in sorted(self.students)
+            }
+            return broadcast_id, len(self.broadcast_recipients[broadcast_id])
+
+    @timed("db.claim_broadcast_recipient")
+    def claim_broadcast_recipient(self, broadcast_id: int) -> int | None:
+        with self._lock:
+            for uid, r in self.broadcast_recipients.get(broadcast_id, {}).items():
+                if r["status"] == "pending":
+                    r.update(status="sending", updated_at=_now())
+                    return uid
+            return None
+
+    @timed("db.set_broadcast_status")
+    def set_broadcast_status(self, broadcast_id: int, user_id: int, status: str, error: str | None = None):
+        with self._lock:
+            r = self.broadcast_recipients.get(broadcast_id, {}).get(user_id)
+            if r is not None:
+                r.update(status=status, error=error, updated_at=_now())
+
+    @timed("db.abandon_broadcast_sends")
+    def abandon_broadcast_sends(self, broadcast_id: int, error: str = "прервано перезапуском") -> int:
+        with self._lock:
+            stuck = [r for r in self.broadcast_recipients.get(broadcast_id, {}).values() if r["status"] == "sending"]
+            for r in stuck:
+                r.update(status="failed", error=error, updated_at=_now())
+            return len(stuck)
+
+    @timed("db.finish_broadcast")
+    def finish_broadcast(self, broadcast_id: int):
+        with self._lock:
+            b = self.broadcasts.get(broadcast_id)
+            if b is not None and b["finished_at"] is None:
+                b["finished_at"] = _now()
+
+    @timed("db.get_unfinished_broadcasts")
+    def get_unfinished_broadcasts(self) -> list[dict]:
+        with self._lock:
+            return [
+                {k: b[k] for k in ("id", "text", "created_by", "created_at")}
+                for b in sorted(self.broadcasts.values(), key=lambda b: b["id"]) if b["finished_at"] is None
+            ]
+
+    @timed("db.list_broadcasts")
+    def list_broadcasts(self, limit: int = 5) -> list[dict]:
+        with self._lock:
+            rows = sorted(self.broadcasts.values(), key=lambda b: b["id"], reverse=True)[:limit]
+            return [{**b, "counts": self.get_broadcast_counts(b["id"])} for b in rows]
+
+    @timed("db.get_broadcast_counts")
+    def get_broadcast_counts(self, broadcast_id: int) -> dict[str, int]:
+        with self._lock:
+            counts = dict.fromkeys(BROADCAST_STATUSES, 0)
+            for r in self.broadcast_recipients.get(broadcast_id, {}).values():
+                counts[r["status"]] += 1
+            return counts
+
+    # --- Бездействующие студенты ---
+
+    def _stalled(self, idle_days: int) -> list[tuple[int, dict]]:
+        cutoff = _ago(idle_days)
+        return sorted(
+            (
+                (uid, s) for uid, s in self.students.items()
+                if (s.get("last_activity_at") or s["created_at"]) < cutoff
+                and (uid, s["selected_brief_index"]) not in self.progress
+            ),
+            key=lambda item: item[1].get("last_activity_at") or item[1]["created_at"],
+        )
+
+    @timed("db.get_stalled_students")
+    def get_stalled_students(self, idle_days: int, limit: int | None = None, only_unnudged: bool = False) -> list[dict]:
+        with self._lock:
+            rows = [
+                {
+                    "user_id": uid,
+                    **{k: s.get(k) for k in ("username", "first_name", "last_name", "selected_brief_index",
+                                             "current_step_index", "last_activity_at", "nudged_at")},
+                }
+                for uid, s in self._stalled(idle_days)
+                if not only_unnudged or s.get("nudged_at") is None or s["nudged_at"] < s["last_activity_at"]
+            ]
+        return rows if limit is None else rows[:limit]
+
+    @timed("db.count_stalled_students")
+    def count_stalled_students(self, idle_days: int) -> int:
+        with self._lock:
+            return len(self._stalled(idle_days))
+
+    @timed("db.mark_nudged")
+    def mark_nudged(self, user_ids: list[int]):
+        with self._lock:
+            for uid in user_ids:
+                if uid in self.students:
+                    self.students[uid]["nudged_at"] = _now()
@@ -0,0 +1,667 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище в PostgreSQL (VKR_STORAGE=postgres, VKR_DATABASE_URL=postgresql://...).
+
+Схема повторяет SQLite (время — текст 'YYYY-MM-DD HH:MM:SS' UTC, как datetime('now')),
+поэтому водяные знаки, сводки и форматирование в боте работают без изменений.
+Соединения берутся из пула psycopg_pool; несколько реплик бота могут писать в одну базу.
+Поиск по FAQ — tsvector (генерируемая колонка + GIN), ранжирование ts_rank.
+"""
+import os
+import re
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError as e:  # pragma: no cover - зависит от окружения
+    raise ImportError("Для VKR_STORAGE=postgres установите зависимости: pip install -r requirements-postgres.txt") from e
+
+from bot.database import BROADCAST_STATUSES, DIGEST_WATERMARK_KEY, day_offset_minutes
+from bot.metrics import timed
+
+POOL_MIN = int(os.environ.get("VKR_PG_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("VKR_PG_POOL_MAX", "10"))
+
+_NOW = "to_char(timezone('utc', now()), 'YYYY-MM-DD HH24:MI:SS')"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS students (
+    user_id BIGINT PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    selected_brief_index INTEGER,
+    current_step_index INTEGER,
+    created_at TEXT DEFAULT {_NOW}
+);
+CREATE TABLE IF NOT EXISTS progress (
+    user_id BIGINT,
+    brief_index INTEGER,
+    completed_at TEXT DEFAULT {_NOW},
+    PRIMARY KEY (user_id, brief_index)
+);
+CREATE TABLE IF NOT EXISTS help_requests (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT,
+    kind TEXT,
+    comment TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    resolved INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS checklist_progress (
+    user_id BIGINT,
+    brief_index INTEGER,
+    item_index INTEGER,
+    completed_at TEXT DEFAULT {_NOW},
+    PRIMARY KEY (user_id, brief_index, item_index)
+);
+CREATE TABLE IF NOT EXISTS faq (
+    id BIGSERIAL PRIMARY KEY,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_by BIGINT,
+    created_at TEXT DEFAULT {_NOW},
+    search tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', question), 'A') || setweight(to_tsvector('russian', answer), 'B')
+    ) STORED
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS step_log (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT,
+    brief_index INTEGER,
+    step_index INTEGER,
+    reached_at TEXT DEFAULT {_NOW}
+);
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    day TEXT,
+    brief_index INTEGER,
+    steps_reached INTEGER NOT NULL DEFAULT 0,
+    checklist_done INTEGER NOT NULL DEFAULT 0,
+    briefs_done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, brief_index)
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id BIGSERIAL PRIMARY KEY,
+    text TEXT NOT NULL,
+    created_by BIGINT,
+    created_at TEXT DEFAULT {_NOW},
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    broadcast_id BIGINT,
+    user_id BIGINT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    updated_at TEXT DEFAULT {_NOW},
+    PRIMARY KEY (broadcast_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(broadcast_id, status, user_id);
+ALTER TABLE students ADD COLUMN IF NOT EXISTS last_activity_at TEXT;
+ALTER TABLE students ADD COLUMN IF NOT EXISTS nudged_at TEXT;
+UPDATE students SET last_activity_at = COALESCE(
+    GREATEST(
+        (SELECT MAX(reached_at) FROM step_log WHERE user_id = students.user_id),
+        (SELECT MAX(completed_at) FROM checklist_progress WHERE user_id = students.user_id),
+        (SELECT MAX(completed_at) FROM progress WHERE user_id = students.user_id)
+    ),
+    created_at
+)
+WHERE last_activity_at IS NULL;
+ALTER TABLE students ALTER COLUMN last_activity_at SET DEFAULT {_NOW};
+CREATE INDEX IF NOT EXISTS idx_students_last_activity ON students(last_activity_at);
+CREATE INDEX IF NOT EXISTS idx_faq_question ON faq(question);
+CREATE INDEX IF NOT EXISTS idx_faq_search ON faq USING GIN (search);
+CREATE INDEX IF NOT EXISTS idx_help_requests_user ON help_requests(user_id);
+CREATE INDEX IF NOT EXISTS idx_help_requests_open ON help_requests(resolved, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_checklist_progress_completed ON checklist_progress(completed_at);
+CREATE INDEX IF NOT EXISTS idx_progress_completed ON progress(completed_at);
+"""
+
+# Отметка активности студента — в той же транзакции, что и само действие
+_TOUCH_ACTIVITY = f"UPDATE students SET last_activity_at = {_NOW} WHERE user_id = %s"
+
+# Бездействующие дольше %s дней, кроме завершивших выбранную тему (диапазон по idx_students_last_activity)
+_STALLED_WHERE = """
+    WHERE s.last_activity_at < to_char(timezone('utc', now()) - make_interval(days => %s), 'YYYY-MM-DD HH24:MI:SS')
+      AND NOT EXISTS (
+          SELECT 1 FROM progress p WHERE p.user_id = s.user_id AND p.brief_index = s.selected_brief_index
+      )
+"""
+
+_HELP_COLUMNS = ("id", "user_id", "kind", "comment", "created_at", "username", "first_name", "last_name")
+
+
+class PostgresStorage:
+    def __init__(self, url: str):
+        if not url:
+            raise ValueError("Для VKR_STORAGE=postgres задайте VKR_DATABASE_URL")
+        self.pool = ConnectionPool(url, min_size=POOL_MIN, max_size=POOL_MAX, open=True)
+
+    def _one(self, sql: str, params: tuple = ()):
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def _all(self, sql: str, params: tuple = ()) -> list:
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _run(self, sql: str, params: tuple = ()) -> int:
+        """Выполняет запрос (commit при выходе из контекста пула), возвращает rowcount."""
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).rowcount
+
+    @timed("db.init_db")
+    def init_db(self):
+        with self.pool.connection() as conn:
+            conn.execute(_SCHEMA)
+
+    @timed("db.pending_help_count")
+    def pending_help_count(self) -> int:
+        # Реплик может быть несколько — счётчик в памяти не годится; запрос идёт по индексу
+        return self._one("SELECT COUNT(*) FROM help_requests WHERE resolved = 0")[0]
+
+    def db_file_sizes(self) -> dict:
+        return {"db": self._one("SELECT pg_database_size(current_database())")[0], "wal": 0, "journal": 0}
+
+    # --- Студенты и прогресс ---
+
+    @timed("db.ensure_student")
+    def ensure_student(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        self._run(
+            """
+            INSERT INTO students (user_id, username, first_name, last_name) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username, first_name = excluded.first_name, last_name = excluded.last_name
+            """,
+            (user_id, username, first_name, last_name),
+        )
+
+    @timed("db.set_selected_brief")
+    def set_selected_brief(self, user_id: int, brief_index: int):
+        self._run("UPDATE students SET selected_brief_index = %s WHERE user_id = %s", (brief_index, user_id))
+
+    @timed("db.get_selected_brief")
+    def get_selected_brief(self, user_id: int) -> int | None:
+        row = self._one("SELECT selected_brief_index FROM students WHERE user_id = %s", (user_id,))
+        return row[0] if row else None
+
+    @timed("db.clear_selected_brief")
+    def clear_selected_brief(self, user_id: int):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE students SET selected_brief_index = NULL, current_step_index = NULL WHERE user_id = %s",
+                (user_id,),
+            )
+            conn.execute("DELETE FROM checklist_progress WHERE user_id = %s", (user_id,))
+
+    @timed("db.clear_checklist_progress")
+    def clear_checklist_progress(self, user_id: int) -> int:
+        return self._run("DELETE FROM checklist_progress WHERE user_id = %s", (user_id,))
+
+    @timed("db.set_checklist_item")
+    def set_checklist_item(self, user_id: int, brief_index: int, item_index: int, completed: bool):
+        with self.pool.connection() as conn:
+            if completed:
+                conn.execute(
+                    f"""
+                    INSERT INTO checklist_progress (user_id, brief_index, item_index) VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id, brief_index, item_index) DO NOTHING
+                    """,
+                    (user_id, brief_index, item_index),
+                )
+            else:
+                conn.execute(
+                    "DELETE FROM checklist_progress WHERE user_id = %s AND brief_index = %s AND item_index = %s",
+                    (user_id, brief_index, item_index),
+                )
+            conn.execute(_TOUCH_ACTIVITY, (user_id,))
+
+    @timed("db.set_checklist_items")
+    def set_checklist_items(self, user_id: int, brief_index: int, states: dict[int, bool]):
+        if not states:
+            return
+        done = [(user_id, brief_index, i) for i, completed in states.items() if completed]
+        undone = [(user_id, brief_index, i) for i, completed in states.items() if not completed]
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            if done:
+                cur.executemany(
+                    f"""
+                    INSERT INTO checklist_progress (user_id, brief_index, item_index) VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id, brief_index, item_index) DO NOTHING
+                    """,
+                    done,
+                )
+            if undone:
+                cur.executemany(
+                    "DELETE FROM checklist_progress WHERE user_id = %s AND brief_index = %s AND item_index = %s",
+                    undone,
+                )
+            cur.execute(_TOUCH_ACTIVITY, (user_id,))
+
+    @timed("db.get_checklist_checked")
+    def get_checklist_checked(self, user_id: int, brief_index: int) -> set:
+        rows = self._all(
+            "SELECT item_index FROM checklist_progress WHERE user_id = %s AND brief_index = %s",
+            (user_id, brief_index),
+        )
+        return {r[0] for r in rows}
+
+    @timed("db.set_current_step")
+    def set_current_step(self, user_id: int, step_index: int):
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO step_log (user_id, brief_index, step_index)
+                SELECT user_id, selected_brief_index, %s FROM students
+                WHERE user_id = %s AND current_step_index IS DISTINCT FROM %s
+                """,
+                (step_index, user_id, step_index),
+            )
+            conn.execute(
+                f"UPDATE students SET current_step_index = %s, last_activity_at = {_NOW} WHERE user_id = %s",
+                (step_index, user_id),
+            )
+
+    @timed("db.get_current_step")
+    def get_current_step(self, user_id: int) -> int | None:
+        row = self._one("SELECT current_step_index FROM students WHERE user_id = %s", (user_id,))
+        return row[0] if row else None
+
+    @timed("db.mark_brief_done")
+    def mark_brief_done(self, user_id: int, brief_index: int):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT INTO progress (user_id, brief_index) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (user_id, brief_index),
+            )
+            conn.execute(_TOUCH_ACTIVITY, (user_id,))
+
+    @timed("db.get_all_students_with_progress")
+    def get_all_students_with_progress(self) -> list[dict]:
+        rows = self._all("""
+            SELECT user_id, username, first_name, last_name, selected_brief_index, current_step_index
+            FROM students ORDER BY first_name NULLS FIRST, last_name NULLS FIRST
+        """)
+        keys = ("user_id", "username", "first_name", "last_name", "selected_brief_index", "current_step_index")
+        return [dict(zip(keys, r)) for r in rows]
+
+    @timed("db.upsert_students")
+    def upsert_students(self, rows: list[tuple]) -> int:
+        with self.pool.connection() as conn:
+            conn.cursor().executemany(
+                """
+                INSERT INTO students (user_id, username, first_name, last_name, selected_brief_index)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, students.username),
+                    first_name = COALESCE(excluded.first_name, students.first_name),
+                    last_name = COALESCE(excluded.last_name, students.last_name),
+                    selected_brief_index = COALESCE(excluded.selected_brief_index, students.selected_brief_index)
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def iter_export_rows(self, chunk_size: int = 500):
+        """Серверный курсор: строки приходят порциями по chunk_size."""
+        with self.pool.connection() as conn:
+            with conn.cursor(name="vkr_export") as cur:
+                cur.itersize = chunk_size
+                cur.execute("""
+                    SELECT s.user_id, s.username, s.first_name, s.last_name,
+                           s.selected_brief_index, s.current_step_index,
+                           (SELECT COUNT(*) FROM checklist_progress cp
+                             WHERE cp.user_id = s.user_id AND cp.brief_index = s.selected_brief_index),
+                           (SELECT COUNT(*) FROM progress p WHERE p.user_id = s.user_id),
+                           (SELECT COUNT(*) FROM help_requests hr WHERE hr.user_id = s.user_id),
+                           (SELECT COUNT(*) FROM help_requests hr WHERE hr.user_id = s.user_id AND hr.resolved = 0),
+                           s.created_at
+                    FROM students s
+                    ORDER BY s.user_id
+                """)
+                yield from cur
+
+    # --- Заявки ---
+
+    @timed("db.add_help_request")
+    def add_help_request(self, user_id: int, kind: str, comment: str = "") -> int:
+        return self._one(
+            "INSERT INTO help_requests (user_id, kind, comment) VALUES (%s, %s, %s) RETURNING id",
+            (user_id, kind, comment),
+        )[0]
+
+    @timed("db.get_open_help_requests_page")
+    def get_open_help_requests_page(self, after_id: int = 0, limit: int = 5) -> tuple[list[dict], bool]:
+        rows = self._all(
+            """
+            SELECT hr.id, hr.user_id, hr.kind, hr.comment, hr.created_at, s.username, s.first_name, s.last_name
+            FROM help_requests hr
+            LEFT JOIN students s ON s.user_id = hr.user_id
+            WHERE hr.resolved = 0
+              AND (hr.created_at, hr.id) > (
+                  COALESCE((SELECT created_at FROM help_requests WHERE id = %s), ''), %s
+              )
+            ORDER BY hr.created_at, hr.id
+            LIMIT %s
+            """,
+            (after_id, after_id, limit + 1),
+        )
+        return [dict(zip(_HELP_COLUMNS, r)) for r in rows[:limit]], len(rows) > limit
+
+    @timed("db.resolve_help_request")
+    def resolve_help_request(self, request_id: int) -> int:
+        return self._run("UPDATE help_requests SET resolved = 1 WHERE id = %s AND resolved = 0", (request_id,))
+
+    @timed("db.resolve_help_requests_for_user")
+    def resolve_help_requests_for_user(self, user_id: int) -> int:
+        return self._run("UPDATE help_requests SET resolved = 1 WHERE user_id = %s AND resolved = 0", (user_id,))
+
+    @timed("db.get_help_digest")
+    def get_help_digest(self, limit: int = 20) -> dict:
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = %s", (DIGEST_WATERMARK_KEY,)).fetchone()
+            raw = row[0] if row else "|0"
+            wm_at, _, wm_id = raw.partition("|")
+            wm = (wm_at, int(wm_id or 0))
+            new = conn.execute(
+                """
+                SELECT hr.id, hr.user_id, hr.kind, hr.comment, hr.created_at, s.username, s.first_name, s.last_name
+                FROM help_requests hr
+                LEFT JOIN students s ON s.user_id = hr.user_id
+                WHERE hr.resolved = 0 AND (hr.created_at, hr.id) > (%s, %s)
+                ORDER BY hr.created_at, hr.id
+                LIMIT %s
+                """,
+                (*wm, limit),
+            ).fetchall()
+            new_total, last_at, last_id = conn.execute(
+                """
+                SELECT COUNT(*), MAX(created_at), (ARRAY_AGG(id ORDER BY created_at DESC, id DESC))[1]
+                FROM help_requests WHERE resolved = 0 AND (created_at, id) > (%s, %s)
+                """,
+                wm,
+            ).fetchone()
+            older = dict(conn.execute(
+                "SELECT kind, COUNT(*) FROM help_requests WHERE resolved = 0 AND (created_at, id) <= (%s, %s) GROUP BY kind",
+                wm,
+            ).fetchall())
+            oldest_at = conn.execute(
+                "SELECT MIN(created_at) FROM help_requests WHERE resolved = 0 AND (created_at, id) <= (%s, %s)", wm
+            ).fetchone()[0]
+        return {
+            "new": [dict(zip(_HELP_COLUMNS, r)) for r in new],
+            "new_total": new_total,
+            "older": older,
+            "oldest_at": oldest_at,
+            "watermark": f"{last_at}|{last_id}" if new_total else raw,
+        }
+
+    # --- FAQ ---
+
+    @timed("db.add_faq")
+    def add_faq(self, question: str, answer: str, created_by: int | None = None) -> int:
+        return self._one(
+            "INSERT INTO faq (question, answer, created_by) VALUES (%s, %s, %s) RETURNING id",
+            (question, answer, created_by),
+        )[0]
+
+    @timed("db.list_faq")
+    def list_faq(self, limit: int | None = 20) -> list[dict]:
+        rows = self._all(
+            "SELECT id, question, answer, created_by, created_at FROM faq ORDER BY id LIMIT %s", (limit,)
+        )
+        keys = ("id", "question", "answer", "created_by", "created_at")
+        return [dict(zip(keys, r)) for r in rows]
+
+    @timed("db.search_faq")
+    def search_faq(self, query: str, limit: int = 10) -> list[dict]:
+        words = re.findall(r"\w+", query.lower())[:10]
+        if not words:
+            return []
+        tsquery = " & ".join(f"{w}:*" for w in words)
+        rows = self._all(
+            """
+            SELECT id, question, answer,
+                   ts_headline('russian', answer, q, 'StartSel=«, StopSel=», MaxWords=16, MinWords=5')
+            FROM faq, to_tsquery('russian', %s) q
+            WHERE search @@ q
+            ORDER BY ts_rank(search, q) DESC, id
+            LIMIT %s
+            """,
+            (tsquery, limit),
+        )
+        return [{"id": r[0], "question": r[1], "answer": r[2], "snippet": r[3]} for r in rows]
+
+    @timed("db.count_faq")
+    def count_faq(self) -> int:
+        return self._one("SELECT COUNT(*) FROM faq")[0]
+
+    @timed("db.upsert_faq")
+    def upsert_faq(self, rows: list[tuple], created_by: int | None = None) -> int:
+        with_id = [(r[0], r[1], r[2], created_by) for r in rows if r[0] is not None]
+        by_question = [r for r in rows if r[0] is None]
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                """
+                INSERT INTO faq (id, question, answer, created_by) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (id) DO UPDATE SET question = excluded.question, answer = excluded.answer
+                """,
+                with_id,
+            )
+            if with_id:
+                # явные id не двигают последовательность — выравниваем, чтобы новые записи не столкнулись
+                cur.execute("SELECT setval(pg_get_serial_sequence('faq', 'id'), (SELECT MAX(id) FROM faq))")
+            cur.executemany(
+                "UPDATE faq SET answer = %s WHERE question = %s AND answer <> %s",
+                [(a, q, a) for _, q, a in by_question],
+            )
+            cur.executemany(
+                "INSERT INTO faq (question, answer, created_by)"
+                " SELECT %s, %s, %s WHERE NOT EXISTS (SELECT 1 FROM faq WHERE question = %s)",
+                [(q, a, created_by, q) for _, q, a in by_question],
+            )
+        return len(rows)
+
+    # --- Служебное и сводки ---
+
+    @timed("db.get_meta")
+    def get_meta(self, key: str, default: str | None = None) -> str | None:
+        row = self._one("SELECT value FROM meta WHERE key = %s", (key,))
+        return row[0] if row else default
+
+    @timed("db.set_meta")
+    def set_meta(self, key: str, value: str):
+        self._run(
+            "INSERT INTO meta (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    @timed("db.rollup_progress")
+    def rollup_progress(self) -> dict:
+        sources = (
+            ("steps_reached", """
+                SELECT to_char(reached_at::timestamp + make_interval(mins => %s), 'YYYY-MM-DD'), brief_index, COUNT(*) FROM step_log
+                WHERE id > %s AND id <= %s AND brief_index IS NOT NULL
+                GROUP BY 1, 2
+            """),
+            ("checklist_done", """
+                SELECT to_char(completed_at::timestamp + make_interval(mins => %s), 'YYYY-MM-DD'), brief_index, COUNT(*) FROM checklist_progress
+                WHERE completed_at > %s AND completed_at <= %s
+                GROUP BY 1, 2
+            """),
+            ("briefs_done", """
+                SELECT to_char(completed_at::timestamp + make_interval(mins => %s), 'YYYY-MM-DD'), brief_index, COUNT(*) FROM progress
+                WHERE completed_at > %s AND completed_at <= %s
+                GROUP BY 1, 2
+            """),
+        )
+        offset = day_offset_minutes()
+        added = {}
+        with self.pool.connection() as conn:
+            # Одна сводка за раз, даже если задачу запустили несколько реплик
+            conn.execute("SELECT pg_advisory_xact_lock(hashtext('vkr.rollup_progress'))")
+            time_hi = conn.execute(
+                "SELECT to_char(timezone('utc', now()) - interval '1 second', 'YYYY-MM-DD HH24:MI:SS')"
+            ).fetchone()[0]
+            id_hi = conn.execute("SELECT COALESCE(MAX(id), 0) FROM step_log").fetchone()[0]
+            for column, sql in sources:
+                key = f"rollup.{column}"
+                row = conn.execute("SELECT value FROM meta WHERE key = %s", (key,)).fetchone()
+                if column == "steps_reached":
+                    lo, hi = int(row[0]) if row else 0, id_hi
+                else:
+                    lo, hi = (row[0] if row else ""), time_hi
+                rows = conn.execute(sql, (offset, lo, hi)).fetchall()
+                conn.cursor().executemany(
+                    f"""
+                    INSERT INTO daily_rollup (day, brief_index, {column}) VALUES (%s, %s, %s)
+                    ON CONFLICT (day, brief_index) DO UPDATE SET {column} = daily_rollup.{column} + excluded.{column}
+                    """,
+                    rows,
+                )
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (key, str(hi)),
+                )
+                added[column] = sum(r[2] for r in rows)
+        return added
+
+    @timed("db.get_trend")
+    def get_trend(self, days: int = 14) -> tuple[list[dict], list[dict]]:
+        params = (day_offset_minutes(), max(1, days) - 1)
+        # Местные сутки BOT_TZ, как в rollup_progress
+        day_from = "to_char(timezone('utc', now()) + make_interval(mins => %s) - make_interval(days => %s), 'YYYY-MM-DD')"
+        with self.pool.connection() as conn:
+            by_day = conn.execute(f"""
+                SELECT day, SUM(steps_reached), SUM(checklist_done), SUM(briefs_done)
+                FROM daily_rollup WHERE day >= {day_from}
+                GROUP BY day ORDER BY day
+            """, params).fetchall()
+            by_brief = conn.execute(f"""
+                SELECT brief_index, SUM(steps_reached), SUM(checklist_done), SUM(briefs_done)
+                FROM daily_rollup WHERE day >= {day_from}
+                GROUP BY brief_index ORDER BY SUM(steps_reached) + SUM(checklist_done) DESC
+            """, params).fetchall()
+        keys = ("steps_reached", "checklist_done", "briefs_done")
+        return (
+            [{"day": r[0], **dict(zip(keys, map(int, r[1:])))} for r in by_day],
+            [{"brief_index": r[0], **dict(zip(keys, map(int, r[1:])))} for r in by_brief],
+        )
+
+    # --- Рассылки ---
+
+    @timed("db.create_broadcast")
+    def create_broadcast(self, text: str, created_by: int | None = None) -> tuple[int, int]:
+        with self.pool.connection() as conn:
+            broadcast_id = conn.execute(
+                "INSERT INTO broadcasts (text, created_by) VALUES (%s, %s) RETURNING id", (text, created_by)
+            ).fetchone()[0]
+            recipients = conn.execute(
+                "INSERT INTO broadcast_recipients (broadcast_id, user_id) SELECT %s, user_id FROM students",
+                (broadcast_id,),
+            ).rowcount
+        return broadcast_id, recipients
+
+    @timed("db.claim_broadcast_recipient")
+    def claim_broadcast_recipient(self, broadcast_id: int) -> int | None:
+        # SKIP LOCKED: реплики, досылающие одну рассылку, не берут одного получателя дважды
+        row = self._one(f"""
+            UPDATE broadcast_recipients SET status = 'sending', updated_at = {_NOW}
+            WHERE broadcast_id = %s AND user_id = (
+                SELECT user_id FROM broadcast_recipients
+                WHERE broadcast_id = %s AND status = 'pending'
+                ORDER BY user_id LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING user_id
+        """, (broadcast_id, broadcast_id))
+        return row[0] if row else None
+
+    @timed("db.set_broadcast_status")
+    def set_broadcast_status(self, broadcast_id: int, user_id: int, status: str, error: str | None = None):
+        self._run(
+            f"""
+            UPDATE broadcast_recipients SET status = %s, error = %s, updated_at = {_NOW}
+            WHERE broadcast_id = %s AND user_id = %s
+            """,
+            (status, error, broadcast_id, user_id),
+        )
+
+    @timed("db.abandon_broadcast_sends")
+    def abandon_broadcast_sends(self, broadcast_id: int, error: str = "прервано перезапуском") -> int:
+        return self._run(
+            f"""
+            UPDATE broadcast_recipients SET status = 'failed', error = %s, updated_at = {_NOW}
+            WHERE broadcast_id = %s AND status = 'sending'
+            """,
+            (error, broadcast_id),
+        )
+
+    @timed("db.finish_broadcast")
+    def finish_broadcast(self, broadcast_id: int):
+        self._run(f"UPDATE broadcasts SET finished_at = {_NOW} WHERE id = %s AND finished_at IS NULL", (broadcast_id,))
+
+    @timed("db.get_unfinished_broadcasts")
+    def get_unfinished_broadcasts(self) -> list[dict]:
+        rows = self._all("SELECT id, text, created_by, created_at FROM broadcasts WHERE finished_at IS NULL ORDER BY id")
+        return [{"id": r[0], "text": r[1], "created_by": r[2], "created_at": r[3]} for r in rows]
+
+    @timed("db.list_broadcasts")
+    def list_broadcasts(self, limit: int = 5) -> list[dict]:
+        rows = self._all(
+            "SELECT id, text, created_by, created_at, finished_at FROM broadcasts ORDER BY id DESC LIMIT %s", (limit,)
+        )
+        return [
+            {
+                "id": r[0], "text": r[1], "created_by": r[2], "created_at": r[3], "finished_at": r[4],
+                "counts": self.get_broadcast_counts(r[0]),
+            }
+            for r in rows
+        ]
+
+    @timed("db.get_broadcast_counts")
+    def get_broadcast_counts(self, broadcast_id: int) -> dict[str, int]:
+        counts = dict(self._all(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = %s GROUP BY status", (broadcast_id,)
+        ))
+        return {status: counts.get(status, 0) for status in BROADCAST_STATUSES}
+
+    # --- Бездействующие студенты ---
+
+    @timed("db.get_stalled_students")
+    def get_stalled_students(self, idle_days: int, limit: int | None = None, only_unnudged: bool = False) -> list[dict]:
+        where = _STALLED_WHERE
+        if only_unnudged:
+            where += " AND (s.nudged_at IS NULL OR s.nudged_at < s.last_activity_at)"
+        rows = self._all(
+            f"""
+            SELECT s.user_id, s.username, s.first_name, s.last_name, s.selected_brief_index,
+                   s.current_step_index, s.last_activity_at, s.nudged_at
+            FROM students s
+            {where}
+            ORDER BY s.last_activity_at
+            LIMIT %s
+            """,
+            (int(idle_days), limit),
+        )
+        keys = (
+            "user_id", "username", "first_name", "last_name", "selected_brief_index",
+            "current_step_index", "last_activity_at", "nudged_at",
+        )
+        return [dict(zip(keys, r)) for r in rows]
+
+    @timed("db.count_stalled_students")
+    def count_stalled_students(self, idle_days: int) -> int:
+        return self._one(f"SELECT COUNT(*) FROM students s {_STALLED_WHERE}", (int(idle_days),))[0]
+
+    @timed("db.mark_nudged")
+    def mark_nudged(self, user_ids: list[int]):
+        with self.pool.connection() as conn:
+            conn.cursor().executemany(
+                f"UPDATE students SET nudged_at = {_NOW} WHERE user_id = %s", [(uid,) for uid in user_ids]
+            )
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение памяти: dict-брифы прежнего парсера против frozen/slots моделей (bot.models).
+Прежний парсер — bot/notion_client.py из коммита BASELINE_REV (git show), не переписанный.
+Синтетика: 50 брифов × 30 шагов, блоки проходят через json (как ответ Notion API).
+Запуск (из git-клона репозитория):
+  python scripts/bench_brief_memory.py [--briefs 50] [--steps 30] [--users 200] [--baseline-rev 9afafba]
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+import types
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from bot.notion_client import parse_brief_page, parse_briefs
+
+# Коммит с прежним парсером (dict-брифы)
+BASELINE_REV = "9afafba"
+
+
+def _rich(text: str) -> dict:
+    return {"rich_text": [{"plain_text": text}]}
+
+
+def make_blocks(n_briefs: int, n_steps: int) -> tuple:
+    """Блоки страницы брифов и страниц каждого брифа (после json round-trip)."""
+    root = []
+    pages = {}
+    for b in range(n_briefs):
+        pid = f"{b:08x}-0000-4000-8000-{b:012x}"
+        root.append({"id": pid, "type": "child_page", "child_page": {"title": f"Бриф для студента: Тема {b}"}})
+        blocks = []
+        for s in range(n_steps):
+            title = "Окружение и инфраструктура" if s == 1 else f"Шаг {s}: подготовка"
+            blocks.append({"id": f"{pid}-h{s}", "type": "heading_2", "heading_2": _rich(title)})
+            for p in range(6):
+                blocks.append({"id": f"{pid}-p{s}-{p}", "type": "paragraph",
+                               "paragraph": _rich(f"Абзац {p} шага {s}. " + "Описание задачи. " * 20)})
+            for li in range(8):
+                blocks.append({"id": f"{pid}-l{s}-{li}", "type": "bulleted_list_item",
+                               "bulleted_list_item": _rich(f"Пункт {li}: " + "деталь " * 30)})
+            blocks.append({"id": f"{pid}-t{s}", "type": "to_do",
+                           "to_do": {**_rich(f"Сделать пункт {s % 10}"), "checked": False}})
+        pages[pid] = blocks
+    return json.loads(json.dumps(root)), json.loads(json.dumps(pages))
+
+
+def load_baseline(rev: str):
+    """bot/notion_client.py из коммита rev (git show) — прежний парсер как есть, без переписывания."""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:bot/notion_client.py"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    module = types.ModuleType(f"notion_client@{rev}")
+    exec(compile(source, f"{rev}:bot/notion_client.py", "exec"), module.__dict__)
+    return module
+
+
+def measure(label: str, build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    print(f"{label:<28} {size / 1024 / 1024:8.2f} MiB")
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--briefs", type=int, default=50)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--users", type=int, default=200, help="студентов с brief_steps в user_data")
+    parser.add_argument("--baseline-rev", default=BASELINE_REV, help="коммит с прежним парсером")
+    args = parser.parse_args()
+    baseline = load_baseline(args.baseline_rev)
+
+    root, pages = make_blocks(args.briefs, args.steps)
+    print(f"{args.briefs} брифов × {args.steps} шагов, {args.users} студентов\n")
+
+    def build_legacy():
+        briefs = baseline.parse_briefs(root, token="")
+        content = {b["page_id"]: baseline.parse_brief_page(pages[b["page_id"]]) for b in briefs}
+        # как в прежнем main.py: user_data["brief_steps"] — ссылка на список шагов из кэша
+        users = [content[briefs[u % len(briefs)]["page_id"]]["steps"] for u in range(args.users)]
+        return briefs, content, users
+
+    def build_models():
+        briefs = parse_briefs(root, token="")
+        content = {b.page_id: parse_brief_page(pages[b.page_id]) for b in briefs}
+        users = [content[briefs[u % len(briefs)].page_id].steps for u in range(args.users)]
+        return briefs, content, users
+
+    legacy = measure(f"dict ({args.baseline_rev})", build_legacy)
+    models = measure("frozen/slots модели", build_models)
+    if legacy:
+        print(f"\nЭкономия: {(1 - models / legacy) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,7 @@ def main():
     if len(briefs) < 2:
         print("Need at least 2 briefs")
         sys.exit(1)
-    page_id = briefs[1]["page_id"]
+    page_id = briefs[1].page_id
     title = get_page_title(page_id, token)
     print(f"Page: {title}\n")
     blocks = get_blocks(page_id, token)
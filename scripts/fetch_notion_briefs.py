@@ -47,12 +47,12 @@ def main():
 
     print("Брифы:")
     for i, b in enumerate(briefs):
-        indent = "  " * (b.get("level", 1) - 1)
-        desc = b.get("description", "")
-        line = f"{i}. {indent}{b['title']}"
+        indent = "  " * (b.level - 1)
+        desc = b.description
+        line = f"{i}. {indent}{b.title}"
         if desc:
             line += f" — {desc[:50]}..."
-        pid = b.get("page_id")
+        pid = b.page_id
         if pid:
             line += f"\n   URL: {page_url(pid)}"
         print(line)
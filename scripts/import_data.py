@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Массовый импорт студентов / FAQ из CSV или JSON в базу бота (одна транзакция, upsert).
+Запуск:
+  python scripts/import_data.py students students.csv
+  python scripts/import_data.py faq faq.json
+  python scripts/import_data.py students --generate 10000   # синтетика для замера скорости
+Колонки студентов: user_id, username, first_name, last_name, brief (индекс темы).
+Колонки FAQ: id (необязательно), question, answer.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bot.importer import KINDS, import_data
+from bot.storage import db
+
+
+def generate(kind: str, n: int) -> str:
+    """CSV на n строк: студенты с темами 0..29 или FAQ с вопросами без id."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    if kind == "students":
+        w.writerow(["user_id", "username", "first_name", "last_name", "brief"])
+        for i in range(n):
+            w.writerow([100_000 + i, f"student{i}", f"Имя{i}", f"Фамилия{i}", i % 30])
+    else:
+        w.writerow(["question", "answer"])
+        for i in range(n):
+            w.writerow([f"Вопрос номер {i}: как сдать этап {i % 12}?", f"Ответ на вопрос {i}: см. бриф, раздел {i % 7}."])
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт студентов / FAQ в базу бота")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("path", nargs="?", help="CSV или JSON файл")
+    parser.add_argument("--generate", type=int, metavar="N", help="вместо файла — N синтетических строк")
+    args = parser.parse_args()
+
+    if args.generate:
+        data, filename = generate(args.kind, args.generate), f"{args.kind}.csv"
+    elif args.path:
+        with open(args.path, "rb") as f:
+            data, filename = f.read(), os.path.basename(args.path)
+    else:
+        parser.error("укажите файл или --generate N")
+
+    db.init_db()
+    result = import_data(args.kind, data, filename)
+    print(result.summary())
+
+
+if __name__ == "__main__":
+    main()
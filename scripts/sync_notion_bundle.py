@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Синхронизация брифов из Notion в офлайн-бандл (zip: список тем и по элементу на тему).
+Запуск:
+  export NOTION_TOKEN=...
+  python scripts/sync_notion_bundle.py --out briefs.zip [--workers 3] [--allow-empty]
+Бот стартует из бандла без NOTION_TOKEN: VKR_BRIEFS_BUNDLE=briefs.zip
+Ошибка Notion (ответ не 200, оборванная пагинация) или тема без блоков — бандл не пишется,
+прежний файл остаётся как есть.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bot.bundle import crawl, load_bundle, save_bundle
+from bot.notion_client import NotionError
+
+PAGE_ID = os.environ.get("NOTION_BRIEFS_PAGE_ID", "2ab9188dc2f28045badcc8786fda551d")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обход Notion → бандл брифов")
+    parser.add_argument("--out", default=os.environ.get("VKR_BRIEFS_BUNDLE") or "briefs.zip")
+    parser.add_argument("--page-id", default=PAGE_ID)
+    parser.add_argument("--workers", type=int, default=3, help="параллельных загрузок страниц")
+    parser.add_argument("--allow-empty", action="store_true", help="допускать страницы тем без блоков")
+    args = parser.parse_args()
+
+    token = os.environ.get("NOTION_TOKEN")
+    if not token:
+        print("Задайте NOTION_TOKEN")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    try:
+        briefs, contents, blocks = crawl(args.page_id, token, workers=args.workers, allow_empty=args.allow_empty)
+    except NotionError as e:
+        print(f"Ошибка Notion: {e} — бандл не записан")
+        sys.exit(1)
+    if not briefs:
+        print("Брифы не получены — бандл не записан")
+        sys.exit(1)
+    size = save_bundle(args.out, briefs, contents, blocks, source_page_id=args.page_id)
+    elapsed = time.perf_counter() - started
+
+    # проверка: бандл читается
+    _, loaded, _, meta = load_bundle(args.out)
+    steps = sum(len(c.steps) for c in loaded.values())
+    items = sum(len(c.checklist) for c in loaded.values())
+    print(f"Записано: {args.out} ({size / 1024:.1f} КБ, версия {meta['version']})")
+    print(f"Брифов: {len(briefs)}, страниц с контентом: {len(loaded)}, шагов: {steps}, пунктов чеклиста: {items}")
+    print(f"Время обхода: {elapsed:.1f} с")
+
+
+if __name__ == "__main__":
+    main()